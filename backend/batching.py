@@ -0,0 +1,326 @@
+"""
+Dynamic micro-batching for model inference
+
+Concurrent /scan requests are collected into a shared queue and flushed as a single batch
+once either `max_batch_size` prompts are waiting or the oldest prompt has waited `max_wait_ms`.
+The batch is handed to one `process_batch` call and every result is routed back to the caller
+that submitted it.
+
+`process_batch` runs on a bounded thread pool so the event loop keeps serving other
+connections during a forward pass. At most `max_concurrency` batches run at once and at most
+`max_queue_depth` prompts may wait for a batch; beyond that `submit` raises `QueueFullError`
+so the endpoint can shed load instead of piling up latency.
+
+`observe_batch`, if given, is called with the size of every dispatched batch and the seconds each of
+its items waited in the queue, which is how the service exports batch size and queue wait metrics.
+
+`LengthRoutedBatcher` keeps one micro-batcher per token-length bucket, each with its own batch size
+and worker threads, so short prompts are never padded to or queued behind a large paste. Buckets are
+prioritized from the shortest: a longer bucket holds a collected batch back while a shorter one has
+work, for at most `max_defer_ms`, so bursts of pastes don't delay short prompts and can't be starved.
+Every bucket's batches run with the model's full intra-op thread pool, so `max_total_concurrency`
+caps the batches running at once across all buckets (one when the model uses every core), so the
+buckets don't oversubscribe the cores together. The shared `DispatchSlots` hand a freed slot to the
+shortest bucket waiting for one, not to the batch that asked first.
+
+Example Usage:
+    batcher = MicroBatcher(get_sensitive_parts_batch, max_batch_size=16, max_wait_ms=5)
+    matches = await batcher.submit(prompt)
+
+    buckets = parse_length_buckets("128:32:1,512:16:1,*:4:1")
+    batcher = LengthRoutedBatcher(get_sensitive_parts_batch, buckets, estimate_tokens=lambda text: len(text) / 3)
+"""
+
+import asyncio, contextlib, heapq, itertools, math, threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# max_tokens is None for the bucket taking everything longer than the other buckets
+LengthBucket = namedtuple("LengthBucket", ["name", "max_tokens", "max_batch_size", "max_concurrency"])
+
+
+class QueueFullError(Exception):
+    """Raised when more prompts are waiting than the configured queue depth allows"""
+
+
+class DispatchSlots:
+    """
+    A counting semaphore shared by batchers, handing a freed slot to the waiter of the lowest priority value
+
+    Waiters of the same priority are served in arrival order. Slots are taken on the worker threads, so
+    waiting never blocks the event loop.
+    """
+
+    def __init__(self, slots):
+        self.slots = max(1, int(slots))
+        self._free = self.slots
+        self._waiting = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    def acquire(self, priority=0):
+        with self._condition:
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(self._waiting, ticket)
+            while not (self._free and self._waiting[0] == ticket):
+                self._condition.wait()
+            heapq.heappop(self._waiting)
+            self._free -= 1
+            # the next waiter in line may take another free slot
+            self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            if self._free == self.slots:
+                raise ValueError("DispatchSlots released more often than acquired")
+            self._free += 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, priority=0):
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, max_batch_size=16, max_wait_ms=5.0, max_concurrency=1, max_queue_depth=256, observe_batch=None,
+                 yield_to=(), max_defer_ms=50.0, dispatch_slots=None, priority=0):
+        """
+        Args:
+            process_batch (callable): Receives a list of items and returns a list of results in the same order
+            max_batch_size (int): Maximum number of items flushed together
+            max_wait_ms (float): Maximum time the first item of a batch waits for more items to arrive
+            max_concurrency (int): Number of batches that may run on the worker pool at the same time
+            max_queue_depth (int): Number of items allowed to wait for a batch, 0 for unbounded
+            observe_batch (callable): Called with the batch size and the queue wait of each item in seconds
+            yield_to (list): Higher-priority batchers, a collected batch waits while any of them has work
+            max_defer_ms (float): Maximum time a collected batch waits for the higher-priority batchers
+            dispatch_slots (DispatchSlots): Shared with other batchers to cap the batches they run at once together
+            priority (int): Rank for a free dispatch slot, lower values go first
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue_depth = max(0, int(max_queue_depth))
+        self.observe_batch = observe_batch
+        self.yield_to = list(yield_to)
+        self.max_defer = max(0.0, float(max_defer_ms)) / 1000
+        self.dispatch_slots = dispatch_slots
+        self.priority = priority
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="scan-worker")
+        self._queue = None
+        self._workers = []
+        self._idle = None
+        self._in_flight = 0
+
+    def _ensure_worker(self):
+        # the queue and worker tasks have to be bound to the running event loop
+        if not self._workers or all(worker.done() for worker in self._workers):
+            loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._in_flight = 0
+            self._workers = [loop.create_task(self._run()) for _ in range(self.max_concurrency)]
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def busy(self):
+        """True while items are queued or a batch is collected or running"""
+        return self._idle is not None and not self._idle.is_set()
+
+    async def submit(self, item):
+        """
+        Queues one item for the next batch and waits for its result
+
+        Args:
+            item: A single input for `process_batch`
+        Returns:
+            The result `process_batch` produced for this item
+        Raises:
+            QueueFullError: If `max_queue_depth` items are already waiting
+        """
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        try:
+            self._queue.put_nowait((item, future, loop.time()))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"scan queue is full ({self.max_queue_depth} prompts waiting)")
+        self._idle.clear()
+        return await future
+
+    async def _collect(self):
+        """Waits for the first item, then keeps collecting until the batch is full or the wait is over"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # draining whatever is already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        # each worker only collects a new batch once its previous one finished
+        while True:
+            batch = await self._collect()
+            self._in_flight += 1
+            try:
+                await self._wait_for_priority()
+                await self._dispatch(batch)
+            except Exception as e:
+                # the worker keeps serving its bucket, the callers of this batch get the error
+                print(f"Dispatching a batch failed: {e!r}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                self._in_flight -= 1
+                if self._in_flight == 0 and self._queue.empty():
+                    self._idle.set()
+
+    async def _wait_for_priority(self):
+        busy = [batcher for batcher in self.yield_to if batcher.busy]
+        if not busy or not self.max_defer:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(batcher._idle.wait() for batcher in busy)), self.max_defer)
+        except asyncio.TimeoutError:
+            pass
+
+    def _process(self, items):
+        # on the worker thread, waiting for a slot doesn't block the event loop
+        slots = self.dispatch_slots
+        if slots is None:
+            return self.process_batch(items)
+        with slots.slot(self.priority):
+            return self.process_batch(items)
+
+    async def _dispatch(self, batch):
+        items = [item for item, _, _ in batch]
+        if self.observe_batch is not None:
+            now = asyncio.get_running_loop().time()
+            try:
+                self.observe_batch(len(batch), [now - enqueued for _, _, enqueued in batch])
+            except Exception as e:
+                # a failing metric must not take the worker, and the batch, down with it
+                print(f"Observing a batch failed: {e!r}")
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self._process, items)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            # the caller may have been cancelled (client disconnected) while waiting
+            if not future.done():
+                future.set_result(result)
+
+
+def parse_length_buckets(spec):
+    """
+    Parses a bucket specification such as "128:32:1,512:16:1,*:4:1"
+
+    Args:
+        spec (str): Comma-separated `max_tokens:max_batch_size:max_concurrency` buckets, `*` for the unbounded one
+    Returns:
+        list: LengthBucket tuples ordered from the shortest, the last one always unbounded
+    """
+    buckets = []
+    for part in spec.split(","):
+        try:
+            max_tokens, max_batch_size, max_concurrency = part.strip().split(":")
+            bound = None if max_tokens.strip() == "*" else int(max_tokens)
+            buckets.append(LengthBucket(
+                f"le{bound}" if bound is not None else "long", bound, int(max_batch_size), int(max_concurrency)
+            ))
+        except ValueError:
+            raise ValueError(f"Invalid length bucket '{part}', expected max_tokens:max_batch_size:max_concurrency")
+    buckets.sort(key=lambda bucket: math.inf if bucket.max_tokens is None else bucket.max_tokens)
+    if buckets[-1].max_tokens is not None:
+        buckets.append(LengthBucket("long", None, buckets[-1].max_batch_size, buckets[-1].max_concurrency))
+    return buckets
+
+
+class LengthRoutedBatcher:
+    def __init__(self, process_batch, buckets, estimate_tokens, max_wait_ms=5.0, max_queue_depth=256, max_defer_ms=50.0, observe_batch=None,
+                 max_total_concurrency=None):
+        """
+        Args:
+            process_batch (callable): Receives a list of items and returns a list of results in the same order
+            buckets (list): LengthBucket tuples ordered from the shortest, see `parse_length_buckets`
+            estimate_tokens (callable): Returns the approximate token count of an item, called on the event loop
+            max_wait_ms (float): Maximum time the first item of a batch waits for more items to arrive
+            max_queue_depth (int): Number of items allowed to wait in each bucket, 0 for unbounded
+            max_defer_ms (float): Maximum time a longer bucket holds a batch back for the shorter ones
+            observe_batch (callable): Called with the bucket name, the batch size and the queue wait of each item
+            max_total_concurrency (int): Number of batches all buckets together may run at once, None for no cap
+        """
+        self.buckets = list(buckets)
+        self.estimate_tokens = estimate_tokens
+        self.batchers = []
+        for bucket in self.buckets:
+            observe = None
+            if observe_batch is not None:
+                observe = lambda size, waits, name=bucket.name: observe_batch(name, size, waits)
+            self.batchers.append(MicroBatcher(
+                process_batch, bucket.max_batch_size, max_wait_ms, bucket.max_concurrency, max_queue_depth,
+                observe_batch=observe, yield_to=list(self.batchers), max_defer_ms=max_defer_ms, priority=len(self.batchers)
+            ))
+        self.set_total_concurrency(max_total_concurrency)
+
+    def set_total_concurrency(self, max_total_concurrency):
+        """Caps the batches all buckets together run at once, None for only the per-bucket `max_concurrency`"""
+        self.max_total_concurrency = None if max_total_concurrency is None else max(1, int(max_total_concurrency))
+        # shorter buckets come first in `self.batchers` and get a freed slot first
+        slots = None if self.max_total_concurrency is None else DispatchSlots(self.max_total_concurrency)
+        for batcher in self.batchers:
+            batcher.dispatch_slots = slots
+
+    @property
+    def max_batch_size(self):
+        return max(batcher.max_batch_size for batcher in self.batchers)
+
+    @property
+    def queue_depth(self):
+        return sum(batcher.queue_depth for batcher in self.batchers)
+
+    def route(self, item):
+        """Index of the first bucket the item fits in"""
+        tokens = self.estimate_tokens(item)
+        for index, bucket in enumerate(self.buckets):
+            if bucket.max_tokens is None or tokens <= bucket.max_tokens:
+                return index
+        return len(self.buckets) - 1
+
+    async def submit(self, item):
+        """
+        Queues one item in its length bucket and waits for its result
+
+        Raises:
+            QueueFullError: If the item's bucket already has `max_queue_depth` items waiting
+        """
+        return await self.batchers[self.route(item)].submit(item)
@@ -0,0 +1,356 @@
+"""
+Reproducible benchmark suite for the scan path, with a regression gate.
+
+`run` benchmarks the service offline on a fixed corpus and writes the results to JSON. The corpus is
+generated from a seed: code files from the `training_datasets` and `test_datasets` template sets
+injected with values from a seeded `SyntheticDataGenerator`, plus short chat prompts built from the
+batching benchmark's templates. The same seed always gives the same corpus, and its fingerprint is
+stored with the results.
+
+The benchmarks are:
+- `pattern_detector`: `SensitivePatternDetector.detect_sensitive_pattern` per prompt
+- `tokenization`: the served tokenizer per prompt, truncated to 512 tokens with offsets
+- `get_sensitive_parts`: `get_sensitive_parts` end to end per prompt, model included
+- `dataset`: `TrainingTokenDataset` construction over the code files
+- `http_scan`: POST /scan through the FastAPI app in process (httpx ASGI transport), from concurrent clients
+
+Every benchmark runs in a fresh process, so its peak RSS is its own (torch and the app module are
+imported in every one of them). Throughput, p50/p99 latency and peak RSS are recorded. The result
+cache is off in `http_scan`, every scan does the full work.
+
+`compare` reads two result files and exits with 1 when a metric of the candidate is worse than the
+baseline by more than the tolerance (relative, `--tolerance` for all metrics and `--metric-tolerance`
+per metric name). Rates (`*_per_second`) regress when they drop, everything else when it grows. A
+benchmark or a metric of the baseline missing from the candidate counts as a regression too.
+
+Run from the `backend` directory:
+    python benchmarks/benchmark_suite.py run --output baseline.json
+    python benchmarks/benchmark_suite.py run --output candidate.json
+    python benchmarks/benchmark_suite.py compare baseline.json candidate.json --tolerance 0.1 --metric-tolerance p99_ms=0.25
+"""
+
+import argparse, asyncio, contextlib, hashlib, io, json, multiprocessing, os, platform, resource, statistics, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "model_training"))
+
+from batching_benchmark import PROMPT_TEMPLATES, percentile
+
+# bumped whenever a benchmark changes what it measures, results of different versions aren't compared
+SUITE_VERSION = 1
+
+BENCHMARKS = ("pattern_detector", "tokenization", "get_sensitive_parts", "dataset", "http_scan")
+
+
+def build_corpus(samples, chat_prompts, seed):
+    """
+    Builds the benchmark corpus from the seed alone
+
+    Args:
+        samples (int): Code files per template split (train and test)
+        chat_prompts (int): Short chat prompts
+        seed (int): Seed of the synthetic values and of the template choices
+    Returns:
+        list: (text, values) pairs, `values` being the injected sensitive values of the text
+    """
+    from generate_corpus import load_templates, generate_sample
+    from synthetic_sample_data_generator import SyntheticDataGenerator
+
+    generator = SyntheticDataGenerator(seed=seed)
+    corpus = []
+    for split in ("train", "test"):
+        templates = load_templates(split)
+        languages = sorted(templates)
+        for _ in range(samples):
+            sample = generate_sample(generator, templates, languages)
+            corpus.append((sample["text"], tuple(sample["text"][span["start"]:span["end"]] for span in sample["spans"])))
+    for _ in range(chat_prompts):
+        values = {
+            "key": generator.random.choice(generator.run_all_api_methods()),
+            "password": generator.generate_password(),
+            "token": generator.generate_jwt_like(),
+        }
+        template = generator.random.choice(PROMPT_TEMPLATES)
+        corpus.append((template.format(**values), tuple(value for name, value in values.items() if "{" + name + "}" in template)))
+    return corpus
+
+
+def corpus_fingerprint(corpus):
+    digest = hashlib.sha256()
+    for text, _ in corpus:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_metrics(latencies, count, unit="prompts"):
+    return {
+        f"{unit}_per_second": count / sum(latencies),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def time_each(func, items, repeat):
+    """Calls `func` on every item `repeat` times after one untimed pass, returns the latency of every call"""
+    for item in items:
+        func(item)
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_pattern_detector(corpus, args):
+    from pattern_detector import SensitivePatternDetector
+
+    detector = SensitivePatternDetector()
+    texts = [text for text, _ in corpus]
+    latencies = time_each(detector.detect_sensitive_pattern, texts, args.repeat)
+    return latency_metrics(latencies, len(latencies))
+
+
+def bench_tokenization(corpus, args):
+    import app
+    from inference import MAX_LENGTH
+    from inference_backends import load_tokenizer
+
+    tokenizer = load_tokenizer(app.MODEL_PATH)
+    texts = [text for text, _ in corpus]
+    tokens = sum(len(tokenizer(text, truncation=True, max_length=MAX_LENGTH)["input_ids"]) for text in texts)
+    latencies = time_each(
+        lambda text: tokenizer(text, truncation=True, max_length=MAX_LENGTH, return_offsets_mapping=True),
+        texts,
+        args.repeat
+    )
+    metrics = latency_metrics(latencies, len(latencies))
+    metrics["tokens_per_second"] = tokens * args.repeat / sum(latencies)
+    return metrics
+
+
+def bench_get_sensitive_parts(corpus, args):
+    import app
+
+    app.load_and_warm_up()
+    texts = [text for text, _ in corpus]
+    latencies = time_each(app.get_sensitive_parts, texts, args.model_repeat)
+    return latency_metrics(latencies, len(latencies))
+
+
+def bench_dataset(corpus, args):
+    import app
+    from inference_backends import load_tokenizer
+    from data_preparation import TrainingTokenDataset
+
+    tokenizer = load_tokenizer(app.MODEL_PATH)
+    # the code files only, as in the training splits
+    code = corpus[:2 * args.samples]
+    templates = [text for text, _ in code]
+    synthetic_data = [values for _, values in code]
+    timings = []
+    for _ in range(args.model_repeat + 1):
+        start = time.perf_counter()
+        # the dataset prints its sizes on every construction
+        with contextlib.redirect_stdout(io.StringIO()):
+            TrainingTokenDataset(templates, synthetic_data, tokenizer)
+        timings.append(time.perf_counter() - start)
+    # the first construction warms the tokenizer up and isn't counted
+    seconds = statistics.median(timings[1:])
+    return {"samples_per_second": len(templates) / seconds, "seconds": seconds}
+
+
+def bench_http_scan(corpus, args):
+    import httpx
+    import app
+
+    app.load_and_warm_up()
+    app.cache_enabled = False
+    texts = [text for text, _ in corpus]
+    requests = [texts[i % len(texts)] for i in range(args.http_requests)]
+
+    async def drive():
+        latencies, errors = [], 0
+        pending = iter(requests)
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+            async def client_loop():
+                nonlocal errors
+                for prompt in pending:
+                    start = time.perf_counter()
+                    response = await client.post("/scan", json={"prompt": prompt})
+                    if response.status_code == 200 and response.json()["status"] == "success":
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+
+            # the first requests warm the batcher and the routes up and aren't counted
+            await client.post("/scan", json={"prompt": texts[0]})
+            start = time.perf_counter()
+            await asyncio.gather(*(client_loop() for _ in range(args.http_clients)))
+            return latencies, errors, time.perf_counter() - start
+
+    latencies, errors, elapsed = asyncio.run(drive())
+    return {
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "errors": errors,
+    }
+
+
+def run_benchmark(name, args):
+    """Runs one benchmark in this process, meant to be called in a fresh worker"""
+    corpus = build_corpus(args.samples, args.chat_prompts, args.seed)
+    metrics = globals()[f"bench_{name}"](corpus, args)
+    metrics["peak_rss_mb"] = peak_rss_mb()
+    return metrics
+
+
+def environment():
+    import torch, transformers
+    import app
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "torch_threads": app.torch_threads,
+        "model_backend": app.MODEL_BACKEND,
+        "model_path": app.MODEL_PATH,
+        "calibration": app.startup_calibration().version,
+        "detector_version": app.DETECTOR_VERSION,
+    }
+
+
+def run(args):
+    corpus = build_corpus(args.samples, args.chat_prompts, args.seed)
+    results = {
+        "suite_version": SUITE_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "corpus": {"seed": args.seed, "prompts": len(corpus), "fingerprint": corpus_fingerprint(corpus)},
+        "benchmarks": {},
+    }
+    print(f"corpus: {len(corpus)} prompts, fingerprint {results['corpus']['fingerprint']}")
+
+    # one process per benchmark, so every peak RSS is the benchmark's own and no state carries over
+    context = multiprocessing.get_context("spawn")
+    for name in args.only or BENCHMARKS:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            metrics = pool.submit(run_benchmark, name, args).result()
+        results["benchmarks"][name] = metrics
+        print(f"{name:20} " + "   ".join(f"{metric}: {format_metric(value)}" for metric, value in metrics.items()))
+
+    with open(args.output, "w") as fw:
+        json.dump(results, fw, indent=2)
+    print(f"results written to {args.output}")
+    return results
+
+
+def format_metric(value):
+    return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+
+
+def parse_metric_tolerances(entries):
+    tolerances = {}
+    for entry in entries:
+        name, separator, value = entry.partition("=")
+        if not separator:
+            raise ValueError(f"Invalid metric tolerance '{entry}', expected name=fraction")
+        tolerances[name] = float(value)
+    return tolerances
+
+
+def regression(metric, baseline, candidate, tolerance):
+    """
+    Returns:
+        tuple: The relative change of the metric and whether it is worse than the tolerance allows
+    """
+    # a metric the candidate lost (its benchmark failed or stopped recording it) can hide any regression
+    if candidate is None:
+        return None, baseline is not None
+    if baseline is None:
+        return None, False
+    if baseline == 0:
+        # a count that was zero (errors) regresses as soon as it isn't
+        return None, candidate > 0 and not metric.endswith("_per_second")
+    change = (candidate - baseline) / baseline
+    if metric.endswith("_per_second"):
+        return change, change < -tolerance
+    return change, change > tolerance
+
+
+def compare(args):
+    with open(args.baseline) as fr:
+        baseline = json.load(fr)
+    with open(args.candidate) as fr:
+        candidate = json.load(fr)
+    if baseline["suite_version"] != candidate["suite_version"]:
+        print(f"suite versions differ ({baseline['suite_version']} vs {candidate['suite_version']}), the results aren't comparable")
+        return 2
+    if baseline["corpus"] != candidate["corpus"]:
+        print(f"corpora differ ({baseline['corpus']} vs {candidate['corpus']}), the results aren't comparable")
+        return 2
+
+    tolerances = parse_metric_tolerances(args.metric_tolerance)
+    regressions = 0
+    print(f"{'benchmark':20} {'metric':20} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name, metrics in baseline["benchmarks"].items():
+        if name not in candidate["benchmarks"]:
+            print(f"{name:20} missing from the candidate {'':>42} REGRESSION")
+            regressions += 1
+            continue
+        for metric, value in metrics.items():
+            new_value = candidate["benchmarks"][name].get(metric)
+            change, regressed = regression(metric, value, new_value, tolerances.get(metric, args.tolerance))
+            regressions += regressed
+            status = ("MISSING" if new_value is None else "REGRESSION") if regressed else ""
+            change_text = "-" if change is None else f"{change:+.1%}"
+            print(f"{name:20} {metric:20} {format_metric(value):>12} {format_metric(new_value):>12} {change_text:>8} {status}")
+
+    print(f"{regressions} regression(s) past the tolerance" if regressions else "no regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks and write the results")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="run only these benchmarks")
+    run_parser.add_argument("--samples", type=int, default=100, help="code files per template split")
+    run_parser.add_argument("--chat-prompts", type=int, default=100)
+    run_parser.add_argument("--repeat", type=int, default=20, help="passes over the corpus of the cheap benchmarks")
+    run_parser.add_argument("--model-repeat", type=int, default=2, help="passes over the corpus of the model and dataset benchmarks")
+    run_parser.add_argument("--http-requests", type=int, default=400)
+    run_parser.add_argument("--http-clients", type=int, default=16)
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    compare_parser = commands.add_parser("compare", help="compare two result files, exit with 1 on a regression")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression of every metric")
+    compare_parser.add_argument("--metric-tolerance", action="append", default=[], metavar="NAME=FRACTION",
+                                help="allowed relative regression of one metric, e.g. p99_ms=0.25")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
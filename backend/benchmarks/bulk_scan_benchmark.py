@@ -0,0 +1,104 @@
+"""
+Throughput of offline bulk scanning on a generated corpus.
+
+A corpus of source files (built like the long-document benchmark) and a JSONL chat export is written
+to a temporary directory, then scanned with `bulk_scan.py` once per worker count. MB/s, GB/hour and
+the findings count are printed, so the scaling with worker processes is visible. A last run is
+interrupted halfway through its checkpoint and resumed, and must not rescan the finished chunks.
+
+Run from the `backend` directory:
+    python benchmarks/bulk_scan_benchmark.py --megabytes 5 --workers 1 2 4
+"""
+
+import argparse, json, os, random, sys, tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bulk_scan
+from long_document_benchmark import build_source_file
+from synthetic_sample_data_generator import SyntheticDataGenerator
+
+
+def build_corpus(directory, megabytes, generator):
+    """Writes source files of 1k-50k characters and one chat export until the corpus holds `megabytes`"""
+    target = int(megabytes * 1e6)
+    written = 0
+    n = 0
+    with open(os.path.join(directory, "chats.jsonl"), "w") as chats:
+        while written < target:
+            if n % 4 == 3:
+                text, _ = build_source_file(random.randint(200, 2000), generator, secret_every=10)
+                chats.write(json.dumps({"prompt": text}) + "\n")
+            else:
+                text, _ = build_source_file(random.randint(1000, 50000), generator)
+                with open(os.path.join(directory, f"module_{n}.py"), "w") as fw:
+                    fw.write(text)
+            written += len(text)
+            n += 1
+    return n
+
+
+def run(corpus, output, args, workers, checkpoint=None):
+    return bulk_scan.main(SimpleNamespace(
+        paths=[corpus],
+        output=output,
+        checkpoint=checkpoint,
+        field="prompt",
+        workers=workers,
+        batch_size=args.batch_size,
+        bucket_window=512,
+        chunk_chars=args.chunk_chars,
+        read_chars=1 << 20,
+        threshold=0.5,
+        include_text=False,
+        backend=args.backend,
+        model_path=args.model_path
+    ))
+
+
+def main(args):
+    random.seed(args.seed)
+    generator = SyntheticDataGenerator()
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = os.path.join(directory, "corpus")
+        os.makedirs(corpus)
+        documents = build_corpus(corpus, args.megabytes, generator)
+        print(f"Corpus: {documents} documents, {args.megabytes} MB\n")
+
+        results = []
+        for workers in args.workers:
+            stats, elapsed = run(corpus, os.path.join(directory, f"findings_{workers}.jsonl"), args, workers)
+            results.append((workers, stats, elapsed))
+
+        print(f"\n{'workers':>7} {'chunks':>7} {'MB/s':>7} {'GB/hour':>8} {'findings':>9}")
+        for workers, stats, elapsed in results:
+            rate = stats["chars"] / 1e6 / elapsed
+            print(f"{workers:7d} {stats['chunks']:7d} {rate:7.2f} {rate * 3.6:8.2f} {stats['findings']:9d}")
+
+        # resuming from a checkpoint that holds the first half of a full run
+        checkpoint = os.path.join(directory, "scan.ckpt")
+        run(corpus, os.path.join(directory, "full.jsonl"), args, args.workers[-1], checkpoint)
+        with open(checkpoint) as fr:
+            keys = fr.readlines()
+        with open(checkpoint, "w") as fw:
+            fw.writelines(keys[:len(keys) // 2])
+        stats, _ = run(corpus, os.path.join(directory, "resumed.jsonl"), args, args.workers[-1], checkpoint)
+        expected = len(keys) - len(keys) // 2
+        print(f"\nResume: rescanned {stats['chunks']} chunks, expected {expected}")
+        if stats["chunks"] != expected:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megabytes", type=float, default=5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--chunk-chars", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default=os.getenv("SCAN_MODEL_BACKEND", "torch"))
+    parser.add_argument("--model-path", default=os.getenv("SCAN_MODEL_PATH", "./results/checkpoint-50"))
+    main(parser.parse_args())
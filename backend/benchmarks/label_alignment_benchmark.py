@@ -0,0 +1,138 @@
+"""
+Parity and scaling of the label alignment in `TrainingTokenDataset`.
+
+Corpora of generated templates are labelled by the offsets-based `TrainingTokenDataset` and by the
+previous per-character alignment loop (kept below as `legacy_labels`). Every label must match; the
+corpora include repeated secrets, secrets that are prefixes of other secrets, secrets cut off by
+truncation and non-ASCII text. Seconds and templates/second are printed per corpus size, and the
+script exits with 1 on any label mismatch.
+
+Run from the `backend` directory:
+    python benchmarks/label_alignment_benchmark.py --sizes 100 1000 10000 --legacy-max 1000
+"""
+
+import argparse, os, random, string, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training"))
+
+from inference_backends import load_tokenizer
+from data_preparation import TrainingTokenDataset
+from synthetic_sample_data_generator import SyntheticDataGenerator
+
+FILLER_LINES = [
+    "def load_config(path):",
+    "    with open(path) as fr:",
+    "        return json.load(fr)",
+    "# réglages du client — ne pas modifier",
+    "for item in items:",
+    "    total += item.price",
+    "print(f'total: {total}')",
+]
+
+SECRET_LINES = [
+    "API_KEY = \"{secret}\"",
+    "headers = {{'Authorization': 'Bearer {secret}'}}",
+    "password: {secret}",
+    "db.connect(user='admin', password='{secret}')",
+]
+
+
+def build_corpus(size, generator):
+    """Builds `size` templates with their secrets, covering the edge cases of the alignment"""
+    templates, synthetic_data = [], []
+    for i in range(size):
+        secrets = [
+            random.choice(generator.run_all_api_methods()),
+            generator.generate_password(),
+            generator.generate_jwt_like(),
+            generator.generate_base64_key(),
+        ]
+        if i % 7 == 0:
+            # a secret that is a prefix of another one
+            secrets.append(secrets[0][:len(secrets[0]) // 2])
+        lines = [random.choice(FILLER_LINES) for _ in range(random.randint(2, 80))]
+        for secret in secrets[:4]:
+            for _ in range(1 + (i % 5 == 0)):
+                lines.insert(random.randint(0, len(lines)), random.choice(SECRET_LINES).format(secret=secret))
+        templates.append("\n".join(lines))
+        synthetic_data.append(tuple(secrets))
+    return templates, synthetic_data
+
+
+def legacy_labels(injected_templates, synthetic_data, tokenizer, max_length=512):
+    """The alignment loop `TrainingTokenDataset` used before the offsets-based version"""
+    all_labels = []
+    punctuation_tokens = set(string.punctuation)
+    for i in range(len(injected_templates)):
+        encoding = tokenizer(
+            injected_templates[i],
+            truncation=True,
+            padding='max_length',
+            max_length=max_length,
+            return_tensors="pt",
+            return_offsets_mapping=True,
+            add_special_tokens=True
+        )
+        labels = [0] * len(encoding['input_ids'][0])
+        for pos in range(len(encoding['input_ids'][0])):
+            if encoding['input_ids'][0][pos] in [tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id]:
+                labels[pos] = -100
+        for synthetic_item in synthetic_data[i]:
+            synthetic_str = str(synthetic_item)
+            start_idx = 0
+            while True:
+                pos = injected_templates[i].find(synthetic_str, start_idx)
+                if pos == -1:
+                    break
+                char_to_token = encoding.char_to_token(0, pos)
+                end_token = encoding.char_to_token(0, pos + len(synthetic_str) - 1)
+                if char_to_token is not None and end_token is not None:
+                    for token_idx in range(char_to_token, end_token + 1):
+                        if labels[token_idx] != -100:
+                            token = tokenizer.convert_ids_to_tokens(encoding['input_ids'][0][token_idx].item())
+                            if token not in punctuation_tokens:
+                                labels[token_idx] = 1
+                start_idx = pos + 1
+        all_labels.append(labels)
+    return all_labels
+
+
+def main(args):
+    random.seed(args.seed)
+    generator = SyntheticDataGenerator()
+    tokenizer = load_tokenizer(args.model)
+
+    mismatches = 0
+    print(f"{'templates':>9} {'seconds':>8} {'templates/s':>12} {'legacy s':>9} {'speedup':>8} {'mismatches':>11}")
+    for size in args.sizes:
+        templates, synthetic_data = build_corpus(size, generator)
+
+        start = time.perf_counter()
+        dataset = TrainingTokenDataset(templates, synthetic_data, tokenizer)
+        seconds = time.perf_counter() - start
+
+        legacy_seconds = speedup = "-"
+        size_mismatches = 0
+        if size <= args.legacy_max:
+            start = time.perf_counter()
+            expected = legacy_labels(templates, synthetic_data, tokenizer)
+            legacy_time = time.perf_counter() - start
+            legacy_seconds, speedup = f"{legacy_time:.2f}", f"{legacy_time / seconds:.1f}x"
+            size_mismatches = sum(labels != reference for labels, reference in zip(dataset.labels, expected))
+            size_mismatches += abs(len(dataset.labels) - len(expected))
+            mismatches += size_mismatches
+
+        print(f"{size:9d} {seconds:8.2f} {size / seconds:12.0f} {legacy_seconds:>9} {speedup:>8} {size_mismatches:11d}")
+
+    if mismatches:
+        sys.exit(f"{mismatches} templates are labelled differently from the legacy alignment")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="microsoft/codebert-base", help="model directory or hub name to take the tokenizer from")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--legacy-max", type=int, default=1000, help="largest corpus also labelled by the slow legacy loop")
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+"""
+Short-prompt latency under bursts of large pastes, with one queue and with token-length buckets.
+
+`--clients` simulated users keep sending short prompts built from the batching benchmark's templates,
+while every `--burst-interval` seconds a burst of `--burst-size` large pastes (Python-looking source
+files from the long-document benchmark) arrives at once. The same workload is run three times:
+
+- `short only`: no pastes, the latency short prompts should keep
+- `one queue`: a single `MicroBatcher`, short prompts are batched with and queued behind the pastes
+- `buckets`: a `LengthRoutedBatcher` with `--buckets`, as the service runs by default
+
+p50/p99 latency of the short prompts and of the pastes and the short-prompt throughput are printed.
+With buckets, the short-prompt p99 should stay close to the `short only` run.
+
+Run from the `backend` directory:
+    python benchmarks/length_routing_benchmark.py --duration 20 --burst-size 4 --paste-chars 20000
+"""
+
+import argparse, asyncio, os, random, statistics, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training"))
+
+import app
+from batching import MicroBatcher, LengthRoutedBatcher, parse_length_buckets
+from batching_benchmark import build_prompts, percentile
+from long_document_benchmark import build_source_file
+from synthetic_sample_data_generator import SyntheticDataGenerator
+
+
+async def short_client(submit, prompts, offset, deadline, latencies):
+    i = offset
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await submit(prompts[i % len(prompts)])
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+async def paste_bursts(submit, pastes, burst_size, interval, deadline, latencies):
+    async def timed(paste):
+        start = time.perf_counter()
+        await submit(paste)
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    i = 0
+    # the first burst lands once the short clients are running
+    await asyncio.sleep(interval / 2)
+    while time.perf_counter() < deadline:
+        for _ in range(burst_size):
+            tasks.append(asyncio.create_task(timed(pastes[i % len(pastes)])))
+            i += 1
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+
+
+async def run(name, submit, prompts, pastes, args):
+    short_latencies, paste_latencies = [], []
+    deadline = time.perf_counter() + args.duration
+    clients = [short_client(submit, prompts, n, deadline, short_latencies) for n in range(args.clients)]
+    if pastes:
+        clients.append(paste_bursts(submit, pastes, args.burst_size, args.burst_interval, deadline, paste_latencies))
+    await asyncio.gather(*clients)
+
+    line = (f"{name:12} short p50: {statistics.median(short_latencies) * 1000:8.1f} ms   "
+            f"p99: {percentile(short_latencies, 99) * 1000:8.1f} ms   {len(short_latencies) / args.duration:7.1f} req/s")
+    if paste_latencies:
+        line += f"   paste p50: {statistics.median(paste_latencies) * 1000:8.1f} ms (n={len(paste_latencies)})"
+    print(line)
+    return percentile(short_latencies, 99)
+
+
+async def main(args):
+    app.load_and_warm_up()
+    prompts = build_prompts(512, args.seed)
+    random.seed(args.seed)
+    generator = SyntheticDataGenerator(seed=args.seed)
+    pastes = [build_source_file(args.paste_chars, generator)[0] for _ in range(max(1, args.burst_size))]
+    process_batch = app.get_sensitive_parts_batch
+
+    # warming up the paste path so one-off allocations are not measured
+    process_batch(pastes[:1])
+
+    routed = LengthRoutedBatcher(process_batch, parse_length_buckets(args.buckets), app.estimate_tokens, args.max_wait_ms)
+    baseline = await run("short only", routed.submit, prompts, [], args)
+    single = MicroBatcher(process_batch, args.max_batch_size, args.max_wait_ms)
+    await run("one queue", single.submit, prompts, pastes, args)
+    routed = LengthRoutedBatcher(process_batch, parse_length_buckets(args.buckets), app.estimate_tokens, args.max_wait_ms)
+    bucketed = await run("buckets", routed.submit, prompts, pastes, args)
+    print(f"short-prompt p99 with bursts is {bucketed / baseline:.2f}x the short-only p99")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent users sending short prompts")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--burst-size", type=int, default=4, help="pastes arriving at once")
+    parser.add_argument("--burst-interval", type=float, default=2.0, help="seconds between bursts")
+    parser.add_argument("--paste-chars", type=int, default=20000)
+    parser.add_argument("--buckets", default=app.length_buckets if app.length_buckets != "off" else "128:32:1,512:16:1,*:4:1")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="batch size of the single queue")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,80 @@
+"""
+Load test for a running /scan service.
+
+`clients` concurrent clients post prompts to /scan for `duration` seconds while a separate
+probe keeps sending CORS preflight requests. A blocked event loop shows up as preflight latency
+growing with the scan latency. p50/p99 latency of both, and the count of 503 responses shed
+by the queue-depth limit, are printed. Run it against the server before and after a change to
+compare, e.g.:
+
+    python app.py &
+    python benchmarks/load_test.py --url https://127.0.0.1:8000 --clients 50 --insecure
+"""
+
+import argparse, asyncio, os, statistics, sys, time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batching_benchmark import build_prompts, percentile
+
+
+async def scan_client(client, url, prompts, offset, deadline, latencies, statuses):
+    i = offset
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.post(f"{url}/scan", json={"prompt": prompts[i % len(prompts)]})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code == 200:
+            latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+async def preflight_probe(client, url, deadline, latencies, interval=0.05):
+    headers = {
+        "Origin": "https://chatgpt.com",
+        "Access-Control-Request-Method": "POST",
+        "Access-Control-Request-Headers": "content-type",
+    }
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.options(f"{url}/scan", headers=headers)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+
+def summary(name, latencies):
+    if not latencies:
+        return f"{name:10} no successful requests"
+    return (f"{name:10} n={len(latencies):6}   p50: {statistics.median(latencies) * 1000:8.1f} ms   "
+            f"p99: {percentile(latencies, 99) * 1000:8.1f} ms")
+
+
+async def main(args):
+    prompts = build_prompts(512, args.seed)
+    scan_latencies, preflight_latencies, statuses = [], [], {}
+    limits = httpx.Limits(max_connections=args.clients + 1)
+
+    async with httpx.AsyncClient(verify=not args.insecure, timeout=args.timeout, limits=limits) as client:
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            preflight_probe(client, args.url, deadline, preflight_latencies),
+            *(scan_client(client, args.url, prompts, n, deadline, scan_latencies, statuses)
+              for n in range(args.clients))
+        )
+
+    print(summary("scan", scan_latencies))
+    print(summary("preflight", preflight_latencies))
+    print(f"status codes: {dict(sorted(statuses.items()))}")
+    print(f"throughput: {len(scan_latencies) / args.duration:.1f} req/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="https://127.0.0.1:8000")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--insecure", action="store_true", help="skip TLS verification for self-signed certificates")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
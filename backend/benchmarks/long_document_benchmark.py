@@ -0,0 +1,91 @@
+"""
+Throughput of long-document scanning on large synthetic source files.
+
+Source files of 10k-100k characters are assembled from config/code lines holding keys made by
+`SyntheticDataGenerator`. For each size the file is scanned with `get_sensitive_parts` and the
+characters/second, the number of windows and the share of injected secrets covered by a reported
+span are printed. Characters/second should stay roughly flat as the file grows.
+
+Run from the `backend` directory:
+    python benchmarks/long_document_benchmark.py --sizes 10000 25000 50000 100000
+"""
+
+import argparse, os, random, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training"))
+
+import app
+from inference import MAX_LENGTH, window_starts
+from synthetic_sample_data_generator import SyntheticDataGenerator
+
+SOURCE_LINES = [
+    "def handler_{n}(event, context):",
+    "    result = process(event['records'][{n}])",
+    "    logger.info('processed record %s', result)",
+    "    return {{'status': 200, 'body': result}}",
+    "",
+    "# TODO: clean up retry logic in module {n}",
+    "for item in items_{n}:",
+    "    total += item.price * item.quantity",
+]
+
+SECRET_LINES = [
+    "API_KEY = \"{secret}\"",
+    "os.environ['SERVICE_TOKEN'] = '{secret}'",
+    "client = Client(api_key='{secret}')",
+    "password: {secret}",
+]
+
+
+def build_source_file(size, generator, secret_every=40):
+    """Builds a Python-looking file of at least `size` characters and returns it with the injected secrets"""
+    lines, secrets = [], []
+    n = 0
+    length = 0
+    while length < size:
+        if n % secret_every == secret_every - 1:
+            secret = random.choice(generator.run_all_api_methods() + [generator.generate_password()])
+            line = random.choice(SECRET_LINES).format(secret=secret)
+            secrets.append(secret)
+        else:
+            line = SOURCE_LINES[n % len(SOURCE_LINES)].format(n=n)
+        lines.append(line)
+        length += len(line) + 1
+        n += 1
+    return "\n".join(lines), secrets
+
+
+def main(args):
+    random.seed(args.seed)
+    generator = SyntheticDataGenerator()
+
+    app.load_and_warm_up()
+    tokenizer = app.model_bundle.tokenizer
+    # warming up so one-off allocations are not measured
+    app.get_sensitive_parts(build_source_file(2000, generator)[0])
+
+    print(f"{'chars':>8} {'tokens':>8} {'windows':>8} {'seconds':>8} {'chars/s':>10} {'recall':>7}")
+    for size in args.sizes:
+        text, secrets = build_source_file(size, generator)
+        num_tokens = len(tokenizer(text, add_special_tokens=False)['input_ids'])
+        num_windows = len(window_starts(num_tokens, MAX_LENGTH - 2, app.window_overlap))
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parts = app.get_sensitive_parts(text)
+            timings.append(time.perf_counter() - start)
+        elapsed = min(timings)
+
+        found = sum(1 for secret in secrets if any(secret in part["text"] for part in parts))
+        recall = found / len(secrets) if secrets else 1.0
+        print(f"{len(text):8} {num_tokens:8} {num_windows:8} {elapsed:8.2f} {len(text) / elapsed:10.0f} {recall:7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 25000, 50000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,137 @@
+"""
+Memory per worker and aggregate throughput of serve.py against the worker count.
+
+For each worker count the launcher is started on a local port, the benchmark waits until every
+worker reports ready (/readyz answers with the pid of the worker that served it), drives /scan with
+`--clients` concurrent clients for `--duration` seconds and then reads the memory of the parent and
+of every worker from /proc/<pid>/smaps_rollup:
+
+- RSS counts shared pages in full for every process, so it overstates a forked worker's cost
+- PSS splits every shared page between the processes sharing it, the PSS sum is the real footprint
+- USS (private pages) is what one more worker adds
+
+With `--compare-no-preload` every count is also run with `--no-preload`, where each worker loads its
+own copy of the weights like `uvicorn --workers`.
+
+Run from the `backend` directory (Linux only):
+    python benchmarks/multiworker_benchmark.py --workers 1 2 4 --compare-no-preload
+"""
+
+import argparse, asyncio, json, os, signal, subprocess, sys, time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from batching_benchmark import build_prompts, percentile
+from load_test import scan_client
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def memory_kb(pid):
+    """RSS, PSS and USS of a process in kB"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as fr:
+        for line in fr:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "uss": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as fr:
+        return [int(child) for child in fr.read().split()]
+
+
+async def wait_until_ready(url, workers, timeout):
+    """Polls /readyz until as many distinct workers as started have answered ready"""
+    ready_pids = set()
+    deadline = time.perf_counter() + timeout
+    # a new connection per poll, a kept-alive one would always reach the same worker
+    async with httpx.AsyncClient(timeout=5, limits=httpx.Limits(max_keepalive_connections=0)) as client:
+        while len(ready_pids) < workers:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"only {len(ready_pids)} of {workers} workers ready after {timeout}s")
+            try:
+                response = await client.get(f"{url}/readyz")
+                if response.status_code == 200:
+                    ready_pids.add(response.json()["pid"])
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.05)
+
+
+async def drive(url, prompts, clients, duration):
+    latencies, statuses = [], {}
+    async with httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=clients)) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(scan_client(client, url, prompts, n, deadline, latencies, statuses) for n in range(clients)))
+    return latencies, statuses
+
+
+def run(workers, preload, prompts, args):
+    port = args.port
+    url = f"http://127.0.0.1:{port}"
+    command = [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--host", "127.0.0.1", "--log-level", "warning"]
+    if not preload:
+        command.append("--no-preload")
+    # plain http, the benchmark measures the workers and not TLS
+    env = {key: value for key, value in os.environ.items() if key not in ("SSL_KEYFILE", "SSL_CERTFILE")}
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL)
+    try:
+        start = time.perf_counter()
+        asyncio.run(wait_until_ready(url, workers, args.ready_timeout))
+        time_to_ready = time.perf_counter() - start
+        latencies, statuses = asyncio.run(drive(url, prompts, args.clients, args.duration))
+
+        parent = memory_kb(server.pid)
+        worker_memory = [memory_kb(pid) for pid in child_pids(server.pid)]
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    return {
+        "workers": workers,
+        "preload": preload,
+        "time_to_ready_seconds": time_to_ready,
+        "requests_per_second": len(latencies) / args.duration,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "statuses": statuses,
+        "parent_rss_mb": parent["rss"] / 1024,
+        "worker_rss_mb": sum(memory["rss"] for memory in worker_memory) / len(worker_memory) / 1024,
+        "worker_pss_mb": sum(memory["pss"] for memory in worker_memory) / len(worker_memory) / 1024,
+        "worker_uss_mb": sum(memory["uss"] for memory in worker_memory) / len(worker_memory) / 1024,
+        "total_pss_mb": (parent["pss"] + sum(memory["pss"] for memory in worker_memory)) / 1024,
+    }
+
+
+def main(args):
+    prompts = build_prompts(512, args.seed)
+    results = []
+    print(f"{'workers':>7} {'preload':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'RSS/worker':>11} {'PSS/worker':>11} {'USS/worker':>11} {'total PSS':>10}")
+    for workers in args.workers:
+        for preload in ((True, False) if args.compare_no_preload else (True,)):
+            result = run(workers, preload, prompts, args)
+            results.append(result)
+            print(f"{workers:7} {str(preload):>7} {result['requests_per_second']:8.1f} {result['p50_ms'] or 0:8.1f} {result['p99_ms'] or 0:8.1f} "
+                  f"{result['worker_rss_mb']:9.0f}MB {result['worker_pss_mb']:9.0f}MB {result['worker_uss_mb']:9.0f}MB {result['total_pss_mb']:8.0f}MB")
+
+    if args.output:
+        with open(args.output, "w") as fw:
+            json.dump(results, fw, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--compare-no-preload", action="store_true", help="also run every count with a model copy per worker")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the results as JSON")
+    main(parser.parse_args())
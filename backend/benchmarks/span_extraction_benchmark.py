@@ -0,0 +1,106 @@
+"""
+Benchmark of vectorized span extraction against the per-token Python loop.
+
+Synthetic probability matrices with many short sensitive runs stand in for model output, so no
+model is needed. Both implementations must return the same spans; their time per batch is printed.
+
+Run from the `backend` directory:
+    python benchmarks/span_extraction_benchmark.py --batch-size 16 --tokens 512
+"""
+
+import argparse, os, random, sys, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from span_extraction import extract_sensitive_parts
+
+
+def loop_sensitive_parts(text, valid, probs, offsets, threshold=0.5):
+    """The token-by-token loop the vectorized extraction replaced"""
+    sensitive_parts = []
+    span_start = None
+    span_end = 0
+    current_prob = 0
+    for is_valid, prob, (start, end) in zip(valid, probs, offsets):
+        if not is_valid:
+            continue
+        if prob > threshold:
+            if span_start is None:
+                span_start = start
+            span_end = max(span_end, end)
+            current_prob = max(current_prob, prob)
+        elif span_start is not None:
+            sensitive_parts.append({"text": text[span_start:span_end], "confidence": float(current_prob),
+                                    "start": span_start, "end": span_end})
+            span_start = None
+            span_end = 0
+            current_prob = 0
+    if span_start is not None:
+        sensitive_parts.append({"text": text[span_start:span_end], "confidence": float(current_prob),
+                                "start": span_start, "end": span_end})
+    return sensitive_parts
+
+
+def build_batch(batch_size, num_tokens, span_rate, rng):
+    """Random prompts of 4-character tokens with roughly `span_rate` of the tokens starting a sensitive run"""
+    texts, probs, valid, offsets = [], [], [], []
+    for _ in range(batch_size):
+        length = rng.randint(num_tokens // 2, num_tokens)
+        row_probs = np.zeros(num_tokens, dtype=np.float32)
+        position = 1
+        while position < length - 1:
+            if rng.random() < span_rate:
+                run = rng.randint(1, 8)
+                row_probs[position:min(position + run, length - 1)] = rng.uniform(0.51, 1.0)
+                position += run
+            position += 1
+        row_valid = np.zeros(num_tokens, dtype=bool)
+        row_valid[1:length - 1] = True
+        row_offsets = np.zeros((num_tokens, 2), dtype=np.int64)
+        row_offsets[1:length - 1, 0] = np.arange(length - 2) * 5
+        row_offsets[1:length - 1, 1] = np.arange(length - 2) * 5 + 4
+        texts.append(" ".join("tok" + str(i % 10) for i in range(length - 2)))
+        probs.append(row_probs)
+        valid.append(row_valid)
+        offsets.append(row_offsets)
+    return texts, np.stack(probs), np.stack(valid), np.stack(offsets)
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    for span_rate in args.span_rates:
+        texts, probs, valid, offsets = build_batch(args.batch_size, args.tokens, span_rate, rng)
+
+        loop_seconds, loop_result = best_time(lambda: [
+            loop_sensitive_parts(texts[row], valid[row].tolist(), probs[row].tolist(), offsets[row].tolist())
+            for row in range(len(texts))
+        ], args.repeat)
+        vector_seconds, vector_result = best_time(
+            lambda: extract_sensitive_parts(texts, probs, valid, offsets), args.repeat)
+
+        if loop_result != vector_result:
+            sys.exit(f"Vectorized extraction differs from the loop at span rate {span_rate}")
+        spans = sum(len(parts) for parts in vector_result)
+        print(f"span rate {span_rate:4.2f}  spans/batch {spans:6}  loop: {loop_seconds * 1000:8.2f} ms  "
+              f"vectorized: {vector_seconds * 1000:8.2f} ms  speedup x{loop_seconds / vector_seconds:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--tokens", type=int, default=512)
+    parser.add_argument("--span-rates", type=float, nargs="+", default=[0.01, 0.05, 0.2])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,101 @@
+"""
+Tokens/second and wall-clock per epoch of the padded and the pre-tokenized training pipelines.
+
+For the train split one training epoch (forward, backward and AdamW step) is run, for the eval split
+one evaluation pass (forward only). Each is run twice:
+- padded: `TrainingTokenDataset` batches, every example padded to 512 tokens
+- pre-tokenized: the cached `PreTokenizedDataset`, length-grouped batches padded by `DynamicPaddingCollator`
+
+Tokens/second counts real (non-pad) tokens, so the two pipelines are compared on the same work. The
+time to build the padded dataset, to build the cache and to load the cache is printed as well.
+
+Run from the `backend` directory:
+    python benchmarks/training_pipeline_benchmark.py --model microsoft/codebert-base --batch-size 4
+"""
+
+import argparse, os, shutil, sys, tempfile, time
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import AutoModelForTokenClassification
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_training"))
+
+from inference_backends import load_tokenizer
+from data_preparation import TrainingTokenDataset
+from pretokenized_dataset import load_pretokenized, DynamicPaddingCollator, LengthGroupedBatchSampler
+from training_datasets.generated_synthetic_data import synthetic_data
+from training_datasets.injected_templates import injected_templates
+from evaluation_datasets.eval_generated_synthetic_data import Eval_synthetic_data
+from evaluation_datasets.eval_injected_templates import Eval_injected_templates
+
+
+def run_epoch(model, loader, train):
+    """Returns the seconds of one pass over the loader, the real tokens and the padded tokens it processed"""
+    optimizer = torch.optim.AdamW(model.parameters(), lr=5e-5) if train else None
+    model.train(train)
+    real_tokens = padded_tokens = 0
+    start = time.perf_counter()
+    for batch in loader:
+        real_tokens += int(batch["attention_mask"].sum())
+        padded_tokens += batch["input_ids"].numel()
+        if train:
+            loss = model(**batch).loss
+            loss.backward()
+            optimizer.step()
+            optimizer.zero_grad()
+        else:
+            with torch.no_grad():
+                model(**batch)
+    return time.perf_counter() - start, real_tokens, padded_tokens
+
+
+def main(args):
+    torch.manual_seed(args.seed)
+    tokenizer = load_tokenizer(args.model)
+    cache_dir = tempfile.mkdtemp()
+    collator = DynamicPaddingCollator(tokenizer.pad_token_id)
+    splits = [("train", injected_templates, synthetic_data, True), ("eval", Eval_injected_templates, Eval_synthetic_data, False)]
+
+    rows = []
+    try:
+        for name, templates, items, train in splits:
+            start = time.perf_counter()
+            padded = TrainingTokenDataset(templates, items, tokenizer)
+            padded_build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            load_pretokenized(name, tokenizer, templates, items, cache_dir=cache_dir)
+            cache_build = time.perf_counter() - start
+            start = time.perf_counter()
+            cached = load_pretokenized(name, tokenizer, templates, items, cache_dir=cache_dir)
+            cache_load = time.perf_counter() - start
+            print(f"{name}: padded dataset built in {padded_build:.2f}s, cache built in {cache_build:.2f}s, loaded in {cache_load * 1000:.1f}ms")
+
+            loaders = {
+                "padded": DataLoader(padded, batch_size=args.batch_size, shuffle=train, generator=torch.Generator().manual_seed(args.seed)),
+                "pre-tokenized": DataLoader(
+                    cached,
+                    batch_sampler=LengthGroupedBatchSampler(cached.lengths, args.batch_size, shuffle=train, seed=args.seed),
+                    collate_fn=collator
+                )
+            }
+            for pipeline, loader in loaders.items():
+                model = AutoModelForTokenClassification.from_pretrained(args.model, num_labels=2)
+                seconds, real_tokens, padded_tokens = run_epoch(model, loader, train)
+                rows.append((name, pipeline, seconds, real_tokens / seconds, 1 - real_tokens / padded_tokens))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    print(f"\n{'split':6} {'pipeline':14} {'epoch s':>8} {'tokens/s':>9} {'pad share':>10}")
+    for name, pipeline, seconds, tokens_per_second, pad_share in rows:
+        print(f"{name:6} {pipeline:14} {seconds:8.2f} {tokens_per_second:9.0f} {pad_share:10.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="microsoft/codebert-base", help="base model or checkpoint to run the epochs with")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
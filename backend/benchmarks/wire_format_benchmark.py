@@ -0,0 +1,170 @@
+"""
+Benchmark of /scan's bytes on the wire and serialization time by encoding, for 1 KB, 50 KB and 500 KB prompts.
+
+Prompts are code pastes with a secret every few lines. The regex detector's matches, with a random
+confidence, stand in for the model's spans, so no model is needed. For every prompt size it prints:
+
+- requests: the body size and the client's encode plus the server's decode time (`decode_request`)
+  for JSON and msgpack, uncompressed, gzip and zstd
+- responses: the body size and encode time of the full matches (with their text) and of offsets only,
+  with FastAPI's default JSONResponse (`jsonable_encoder` and `json.dumps`), orjson and msgpack
+
+Times are the median of `--repeat` runs. Encodings whose package isn't installed are skipped.
+
+Run from the `backend` directory:
+    python benchmarks/wire_format_benchmark.py --repeat 50
+"""
+
+import argparse, gzip, json, os, random, statistics, string, sys, time
+
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pattern_detector import SensitivePatternDetector
+from redaction import categorize_spans
+import wire_format
+
+SIZES = {"1KB": 1024, "50KB": 50 * 1024, "500KB": 500 * 1024}
+
+CODE_LINES = [
+    "def load_settings(path):",
+    "    with open(path) as fr:",
+    "        return yaml.safe_load(fr)",
+    "for index, row in enumerate(rows):",
+    "    logger.info('processing row %d', index)",
+    "    totals[row['region']] += row['amount']",
+    "response = requests.get(url, timeout=10)",
+    "# retry once on a timeout before giving up",
+]
+
+
+def random_secret(rng):
+    alphanumeric = string.ascii_letters + string.digits
+    return rng.choice([
+        lambda: 'api_key = "' + "".join(rng.choices(alphanumeric, k=32)) + '"',
+        lambda: "token = 'ghp_" + "".join(rng.choices(alphanumeric, k=39)) + "'",
+        lambda: "DATABASE_URL = 'postgresql://admin:" + "".join(rng.choices(alphanumeric, k=12)) + "@db.internal:5432/prod'",
+        lambda: "AWS_ACCESS_KEY_ID=AKIA" + "".join(rng.choices(string.ascii_uppercase + string.digits, k=16)),
+    ])()
+
+
+def build_prompt(size, rng, secret_every=12):
+    """A code paste of about `size` characters with a secret every `secret_every` lines"""
+    lines = []
+    length = 0
+    while length < size:
+        line = random_secret(rng) if len(lines) % secret_every == secret_every - 1 else rng.choice(CODE_LINES)
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def scan_result(prompt, detector, rng):
+    """Full matches and offsets-only matches of a prompt, as /scan returns them"""
+    spans = [
+        {"text": prompt[match["start"]:match["end"]], "confidence": rng.uniform(0.5, 1.0), "start": match["start"], "end": match["end"]}
+        for match in detector.scan(prompt)
+    ]
+    offsets = [
+        {"category": span["category"], "start": span["start"], "end": span["end"], "confidence": span["confidence"]}
+        for span in categorize_spans(spans, detector.scan(prompt))
+    ]
+    return spans, offsets
+
+
+def median_seconds(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def optional_codecs():
+    codecs = {}
+    try:
+        import msgpack
+        codecs["msgpack"] = msgpack
+    except ImportError:
+        print("msgpack not installed, skipping msgpack, install it with `pip install msgpack`")
+    try:
+        import zstandard
+        codecs["zstd"] = zstandard
+    except ImportError:
+        print("zstandard not installed, skipping zstd, install it with `pip install zstandard`")
+    if wire_format.orjson is None:
+        print("orjson not installed, the fast JSON encoder falls back to json, install it with `pip install orjson`")
+    return codecs
+
+
+def request_encodings(codecs):
+    """(name, client encode, Content-Type, Content-Encoding) of every request encoding benchmarked"""
+    serializers = [("json", lambda payload: json.dumps(payload).encode("utf-8"), wire_format.JSON)]
+    if "msgpack" in codecs:
+        serializers.append(("msgpack", lambda payload: codecs["msgpack"].packb(payload, use_bin_type=True), wire_format.MSGPACK))
+    compressions = [("", lambda body: body, None), ("+gzip", lambda body: gzip.compress(body, compresslevel=6), "gzip")]
+    if "zstd" in codecs:
+        compressor = codecs["zstd"].ZstdCompressor(level=3)
+        compressions.append(("+zstd", compressor.compress, "zstd"))
+
+    encodings = []
+    for serializer_name, serialize, content_type in serializers:
+        for compression_name, compress, content_encoding in compressions:
+            encodings.append((
+                serializer_name + compression_name,
+                lambda payload, serialize=serialize, compress=compress: compress(serialize(payload)),
+                content_type,
+                content_encoding
+            ))
+    return encodings
+
+
+def response_encoders(codecs):
+    encoders = [
+        ("fastapi-json", lambda content: json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")),
+        ("orjson" if wire_format.orjson is not None else "json", lambda content: wire_format.encode(content, wire_format.JSON)),
+    ]
+    if "msgpack" in codecs:
+        encoders.append(("msgpack", lambda content: codecs["msgpack"].packb(content, use_bin_type=True)))
+    return encoders
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    detector = SensitivePatternDetector()
+    codecs = optional_codecs()
+    encodings = request_encodings(codecs)
+    encoders = response_encoders(codecs)
+
+    for label, size in SIZES.items():
+        prompt = build_prompt(size, rng)
+        payload = {"prompt": prompt}
+        spans, offsets = scan_result(prompt, detector, rng)
+        print(f"\n{label} prompt ({len(prompt)} characters, {len(spans)} spans)")
+
+        print(f"  {'request':16} {'bytes':>9} {'ratio':>6} {'encode ms':>10} {'decode ms':>10}")
+        plain = None
+        for name, encode_request, content_type, content_encoding in encodings:
+            body = encode_request(payload)
+            plain = plain or len(body)
+            encode_ms = median_seconds(lambda: encode_request(payload), args.repeat) * 1000
+            decode_ms = median_seconds(lambda: wire_format.decode_request(body, content_encoding, content_type), args.repeat) * 1000
+            assert wire_format.decode_request(body, content_encoding, content_type) == payload
+            print(f"  {name:16} {len(body):9d} {len(body) / plain:6.2f} {encode_ms:10.3f} {decode_ms:10.3f}")
+
+        print(f"  {'response':16} {'encoder':>12} {'bytes':>9} {'encode ms':>10}")
+        for matches_name, matches in (("full matches", spans), ("offsets only", offsets)):
+            content = {"status": "success", "matches": matches, "found_length": len(matches), "model_version": "torch:benchmark"}
+            for encoder_name, encode_response in encoders:
+                body = encode_response(content)
+                encode_ms = median_seconds(lambda: encode_response(content), args.repeat) * 1000
+                print(f"  {matches_name:16} {encoder_name:>12} {len(body):9d} {encode_ms:10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    main(parser.parse_args())
@@ -0,0 +1,248 @@
+"""
+Offline bulk scanning of repositories, chat exports and log archives
+
+Files and JSONL records are streamed through the same model path as /scan and the findings are written
+as JSONL, one line per scanned chunk that has matches, with the source, record number and offsets.
+Every match is tagged with the category of the regex match overlapping it (MODEL where none does) and
+widened to cover it, as /scan does.
+
+- Files are read lazily, in pieces of about `--read-chars` characters ending at line breaks, so memory
+  doesn't grow with the file size, and each piece is cut into chunks of about `--chunk-chars` characters
+  at line boundaries. Offsets count characters from the start of the file.
+- Chunks are grouped by length (a window of pending chunks is sorted and cut into batches), so a batch
+  pads to similar lengths.
+- Batches run on a process pool sized to the cores, each worker loads the model and the pattern detector
+  once, tokenizes its own batches and runs with `cores / workers` torch threads. Workers only import the
+  model and detector code (`inference.py`, `pattern_detector.py`, `redaction.py`), not the service.
+- Every finished chunk is appended to the checkpoint file after its findings are written. A rerun with the
+  same checkpoint skips finished chunks, so an interrupted run resumes (findings of the batches in flight
+  at the interruption may be written twice).
+
+Usage (from the `backend` directory):
+    python bulk_scan.py ~/src/some-repo exports/chats.jsonl --output findings.jsonl --checkpoint scan.ckpt
+"""
+
+import argparse, json, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from redaction import categorize_spans
+
+SKIPPED_DIRS = {".git", "node_modules", "__pycache__", ".venv", "venv"}
+
+# set in each pool worker by `init_worker`
+worker_bundle = None
+worker_scanner = None
+worker_detector = None
+
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isfile(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d not in SKIPPED_DIRS)
+            for name in sorted(files):
+                yield os.path.join(root, name)
+
+
+def is_binary(path):
+    with open(path, "rb") as fr:
+        return b"\0" in fr.read(8192)
+
+
+def read_pieces(fr, read_chars):
+    """
+    Reads an open text file in (offset, text) pieces of about `read_chars` characters, ending at line breaks
+
+    A piece without any line break is cut after `read_chars` characters, so a file of one huge line is
+    still read in bounded pieces.
+    """
+    offset = 0
+    carry = ""
+    while True:
+        data = fr.read(read_chars)
+        if not data:
+            break
+        data = carry + data
+        newline = data.rfind("\n")
+        cut = newline + 1 if newline >= 0 else len(data)
+        yield offset, data[:cut]
+        offset += cut
+        carry = data[cut:]
+    if carry:
+        yield offset, carry
+
+
+def iter_documents(paths, field, read_chars=1 << 20):
+    """
+    Yields (source, record, offset, text) for every piece of a file, or every record of a .jsonl file
+
+    Args:
+        paths (list): Files and directories to scan
+        field (str): The text field of JSONL records
+        read_chars (int): Characters of a file read at once, records are yielded whole
+    """
+    for path in iter_files(paths):
+        try:
+            if is_binary(path):
+                continue
+            if path.endswith(".jsonl"):
+                with open(path, encoding="utf-8", errors="replace") as fr:
+                    for line_number, line in enumerate(fr, 1):
+                        try:
+                            text = json.loads(line).get(field)
+                        except (json.JSONDecodeError, AttributeError):
+                            continue
+                        if isinstance(text, str) and text.strip():
+                            yield path, line_number, 0, text
+            else:
+                with open(path, encoding="utf-8", errors="replace") as fr:
+                    for offset, text in read_pieces(fr, read_chars):
+                        yield path, None, offset, text
+        except OSError as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+
+
+def iter_chunks(text, chunk_chars):
+    """Cuts text into (offset, chunk) pieces of about `chunk_chars` characters, ending at line breaks where possible"""
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_chars, len(text))
+        if end < len(text):
+            newline = text.rfind("\n", start, end)
+            if newline > start:
+                end = newline + 1
+        if text[start:end].strip():
+            yield start, text[start:end]
+        start = end
+
+
+def init_worker(backend, path, torch_threads):
+    global worker_bundle, worker_scanner, worker_detector
+    import torch
+    from inference import ModelScanner
+    from inference_backends import load_bundle
+    from pattern_detector import SensitivePatternDetector
+    torch.set_num_threads(torch_threads)
+    worker_bundle = load_bundle(backend, path, intra_op_threads=torch_threads)
+    # the service's long-document settings
+    worker_scanner = ModelScanner(
+        long_documents=os.getenv("SCAN_LONG_DOCUMENTS", "1") == "1",
+        window_overlap=int(os.getenv("SCAN_WINDOW_OVERLAP", "128")),
+        window_batch_size=int(os.getenv("SCAN_WINDOW_BATCH_SIZE", "16"))
+    )
+    worker_detector = SensitivePatternDetector()
+
+
+def scan_batch(texts, threshold):
+    """Scans a batch with the model and tags every span with the category of the regex match overlapping it"""
+    results = []
+    for text, parts in zip(texts, worker_scanner.scan_batch(texts, worker_bundle, threshold)):
+        spans = categorize_spans(parts, worker_detector.scan(text)) if parts else []
+        # widened spans get the text they now cover
+        results.append([{**span, "text": text[span["start"]:span["end"]]} for span in spans])
+    return results
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path) as fr:
+        return {line.rstrip("\n") for line in fr}
+
+
+def length_buckets(chunks, batch_size):
+    """Sorts a window of chunks by length and cuts it into batches"""
+    chunks = sorted(chunks, key=lambda chunk: len(chunk["text"]))
+    return [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+
+def main(args):
+    workers = args.workers or os.cpu_count() or 1
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    done = load_checkpoint(args.checkpoint)
+    if done:
+        print(f"Resuming, {len(done)} chunks already scanned")
+
+    output = open(args.output, "a", encoding="utf-8")
+    checkpoint = open(args.checkpoint, "a") if args.checkpoint else None
+    stats = {"chunks": 0, "chars": 0, "findings": 0}
+    start = time.perf_counter()
+
+    def write_results(batch, results):
+        for chunk, parts in zip(batch, results):
+            if parts:
+                for part in parts:
+                    part["start"] += chunk["offset"]
+                    part["end"] += chunk["offset"]
+                record = {"source": chunk["source"], "record": chunk["record"], "matches": parts}
+                if not args.include_text:
+                    record["matches"] = [{key: value for key, value in part.items() if key != "text"} for part in parts]
+                output.write(json.dumps(record) + "\n")
+                stats["findings"] += len(parts)
+            stats["chunks"] += 1
+            stats["chars"] += len(chunk["text"])
+        output.flush()
+        if checkpoint:
+            checkpoint.write("".join(chunk["key"] + "\n" for chunk in batch))
+            checkpoint.flush()
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(args.backend, args.model_path, torch_threads)
+    ) as pool:
+        in_flight = {}
+
+        def drain(limit):
+            while len(in_flight) > limit:
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write_results(in_flight.pop(future), future.result())
+
+        def submit(window):
+            for batch in length_buckets(window, args.batch_size):
+                drain(workers * 2)
+                in_flight[pool.submit(scan_batch, [chunk["text"] for chunk in batch], args.threshold)] = batch
+
+        window = []
+        for source, record, base_offset, text in iter_documents(args.paths, args.field, args.read_chars):
+            for offset, chunk in iter_chunks(text, args.chunk_chars):
+                offset += base_offset
+                key = f"{source}\t{record}\t{offset}"
+                if key in done:
+                    continue
+                window.append({"key": key, "source": source, "record": record, "offset": offset, "text": chunk})
+                if len(window) >= args.bucket_window:
+                    submit(window)
+                    window = []
+        submit(window)
+        drain(0)
+
+    output.close()
+    if checkpoint:
+        checkpoint.close()
+    elapsed = time.perf_counter() - start
+    megabytes = stats["chars"] / 1e6
+    print(f"Scanned {stats['chunks']} chunks ({megabytes:.1f} MB) in {elapsed:.1f}s with {workers} workers: "
+          f"{megabytes / elapsed:.2f} MB/s ({megabytes / elapsed * 3.6:.2f} GB/hour), {stats['findings']} findings")
+    return stats, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="files or directories, .jsonl files are read record by record")
+    parser.add_argument("--output", default="findings.jsonl")
+    parser.add_argument("--checkpoint", help="file recording finished chunks, reused to resume an interrupted run")
+    parser.add_argument("--field", default="prompt", help="text field of JSONL records")
+    parser.add_argument("--workers", type=int, default=0, help="model worker processes, 0 for one per core")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--bucket-window", type=int, default=512, help="chunks sorted by length together before batching")
+    parser.add_argument("--chunk-chars", type=int, default=1536, help="about one 512-token window of code")
+    parser.add_argument("--read-chars", type=int, default=1 << 20, help="characters of a file held in memory at once")
+    parser.add_argument("--threshold", type=float, default=None, help="defaults to the model's calibrated threshold")
+    parser.add_argument("--include-text", action="store_true", help="also write the matched text, off by default to keep secrets out of the output")
+    parser.add_argument("--backend", default=os.getenv("SCAN_MODEL_BACKEND", "torch"))
+    parser.add_argument("--model-path", default=os.getenv("SCAN_MODEL_PATH", "./results/checkpoint-50"))
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+"""
+Calibrated token probabilities for the token classification model
+
+The model has a 2-class softmax head, but tokens have always been scored with a sigmoid of the
+sensitive logit alone and a fixed 0.5 threshold. `model_training/calibrate.py` fits a temperature to the
+softmax on stored eval logits, picks the threshold offline and writes both to a versioned
+`calibration.json` next to the model. With it, a token's probability is
+
+    softmax(logits / T)[1] = sigmoid((logit_1 - logit_0) / T)
+
+a single vectorized op over the whole batch, compared against the calibrated threshold.
+
+Modes:
+- `auto`: use the model directory's calibration.json if there is one, the compatible rule otherwise
+- `calibrated`: require a calibration file
+- `compat`: always keep the original sigmoid(logit_1) > 0.5 rule
+
+Example Usage:
+    calibration = load_calibration("./results/checkpoint-50/calibration.json", mode="auto")
+    probs = calibration.probabilities(model(**inputs).logits)
+    sensitive = probs > calibration.threshold
+"""
+
+import json, os
+
+import torch
+
+CALIBRATION_FORMAT = 1
+CALIBRATION_FILENAME = "calibration.json"
+CALIBRATION_MODES = ("auto", "calibrated", "compat")
+
+
+class CalibrationError(ValueError):
+    """Raised for a missing, unreadable or incompatible calibration file"""
+
+
+class Calibration:
+    def __init__(self, temperature=None, threshold=0.5, version="compat", details=None):
+        """
+        Args:
+            temperature (float): Softmax temperature, None for the original sigmoid of the sensitive logit
+            threshold (float): Minimum probability for a token to be considered sensitive
+            version (str): Identifies the calibration in responses, stats and the cache namespace
+            details (dict): Metrics and operating points recorded by the calibration run
+        """
+        self.temperature = temperature
+        self.threshold = threshold
+        self.version = version
+        self.details = details or {}
+
+    @property
+    def mode(self):
+        return "compat" if self.temperature is None else "calibrated"
+
+    def probabilities(self, logits):
+        """Sensitive-class probability of every token of a (..., 2) logits tensor"""
+        if self.temperature is None:
+            return torch.sigmoid(logits[..., 1])
+        return torch.sigmoid((logits[..., 1] - logits[..., 0]) / self.temperature)
+
+    def to_dict(self):
+        return {
+            "format": CALIBRATION_FORMAT,
+            "version": self.version,
+            "temperature": self.temperature,
+            "threshold": self.threshold,
+            **self.details
+        }
+
+    def save(self, path):
+        with open(path, "w") as fw:
+            json.dump(self.to_dict(), fw, indent=2)
+
+    @classmethod
+    def from_dict(cls, config):
+        if config.get("format") != CALIBRATION_FORMAT:
+            raise CalibrationError(f"Unsupported calibration format {config.get('format')!r}, expected {CALIBRATION_FORMAT}")
+        temperature = config.get("temperature")
+        threshold = config.get("threshold")
+        if not isinstance(temperature, (int, float)) or temperature <= 0 or not isinstance(threshold, (int, float)) or not 0 < threshold < 1:
+            raise CalibrationError(f"Invalid calibration, temperature {temperature!r} and threshold {threshold!r}")
+        details = {key: value for key, value in config.items() if key not in ("format", "version", "temperature", "threshold")}
+        return cls(float(temperature), float(threshold), config.get("version", "unversioned"), details)
+
+
+def load_calibration(path, mode="auto"):
+    """
+    Loads the calibration the server applies
+
+    Args:
+        path (str): A calibration.json written by `model_training/calibrate.py`
+        mode (str): One of CALIBRATION_MODES
+    Returns:
+        Calibration: The loaded calibration, or the compatible sigmoid/0.5 rule
+    """
+    if mode not in CALIBRATION_MODES:
+        raise CalibrationError(f"Unknown calibration mode '{mode}', expected one of {CALIBRATION_MODES}")
+    if mode == "compat" or (mode == "auto" and not os.path.isfile(path)):
+        return Calibration()
+    try:
+        with open(path) as fr:
+            return Calibration.from_dict(json.load(fr))
+    except (OSError, ValueError) as e:
+        raise CalibrationError(f"Cannot load calibration from {path}: {e}")
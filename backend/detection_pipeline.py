@@ -0,0 +1,201 @@
+"""
+Tiered detection pipeline that gates the transformer behind cheap checks
+
+A prompt goes through the cheap stages in order and the first one that flags it sends it to the
+model. Prompts no stage flags (most plain chat traffic) skip the forward pass entirely.
+
+Stages:
+1. `regex`: the precompiled `SensitivePatternDetector`
+2. `keyword`: a secret-like name assigned a value (`password: hunter2`, `token = ...`), whatever the value looks like
+3. `entropy`: Shannon entropy and character-class mix of candidate tokens (random keys, passwords)
+4. `code`: a heuristic "looks like code/config" classifier (assignments, brackets, keywords, URLs)
+
+In `paranoid` mode every prompt goes to the model and the stages only run with `collect_stats`, so
+their statistics show how often the model found something in a prompt the gate would have skipped
+(`gate_misses`). Without it a paranoid pipeline does no work per prompt. Paranoid is the service's
+default: cascade trades recall for throughput, so switch to it only once `gate_misses` stays at zero
+on your traffic or test set.
+
+`observe_stage`, if given, is called with the name and the seconds of every stage run, e.g. to export
+regex detection time as a histogram.
+
+Example Usage:
+    pipeline = DetectionPipeline(SensitivePatternDetector(), mode="cascade")
+    decision = pipeline.evaluate(prompt)
+    if decision["run_model"]:
+        matches = get_sensitive_parts(prompt)
+    pipeline.record_model_result(decision, matches)
+"""
+
+import math, re, time
+from collections import Counter
+
+MODES = ("cascade", "paranoid")
+
+CANDIDATE_TOKEN = re.compile(r'[^\s\'"`=:,;(){}\[\]<>]+')
+
+# a short secret after its name (password: hunter2) is neither a known format, random nor code
+SECRET_ASSIGNMENT = re.compile(
+    r'(?<![A-Za-z0-9])(?:password|passwd|pwd|passphrase|secret|token|api[_\-]?key|access[_\-]?key|private[_\-]?key|key|credential)s?(?![A-Za-z0-9])[\'"]?\s*[:=]',
+    re.IGNORECASE
+)
+
+CODE_SIGNALS = {
+    "assignment": re.compile(r'[A-Za-z_][\w.\-]*\s*(?:=|:=|=>)\s*\S'),
+    "config_key": re.compile(r'^\s*[A-Za-z_][\w.\-]*\s*:\s*\S+\s*$', re.MULTILINE),
+    "brackets": re.compile(r'[{};]|\)\s*$|\[\s*[\'"]', re.MULTILINE),
+    "keyword": re.compile(r'\b(?:import|def|class|const|let|var|function|return|export|from|public|private|SELECT|INSERT)\b'),
+    "url": re.compile(r'\w+://'),
+    "env_var": re.compile(r'\b[A-Z][A-Z0-9]*_[A-Z0-9_]+\b'),
+}
+
+
+def shannon_entropy(token):
+    """Entropy of the character distribution of `token` in bits per character"""
+    length = len(token)
+    return -sum(count / length * math.log2(count / length) for count in Counter(token).values())
+
+
+def character_classes(token):
+    """Number of character classes (lowercase, uppercase, digits, symbols) used in `token`"""
+    return (
+        any(c.islower() for c in token)
+        + any(c.isupper() for c in token)
+        + any(c.isdigit() for c in token)
+        + any(not c.isalnum() for c in token)
+    )
+
+
+class DetectionPipeline:
+    STAGES = ("regex", "keyword", "entropy", "code")
+
+    def __init__(self, detector, mode="cascade", entropy_threshold=3.5, min_token_length=8, min_entropy_length=16, min_code_signals=2, observe_stage=None,
+                 collect_stats=True):
+        """
+        Args:
+            detector (SensitivePatternDetector): The regex stage
+            mode (str): `cascade` to gate the model, `paranoid` to always run it
+            entropy_threshold (float): Minimum bits per character for a candidate token to look random
+            min_token_length (int): Minimum length of a candidate token mixing digits with 2+ other character classes
+            min_entropy_length (int): Minimum length of a candidate token judged by entropy alone
+            min_code_signals (int): Number of distinct code signals needed for the code stage to flag
+            observe_stage (callable): Called with the stage name and its run time in seconds
+            collect_stats (bool): Run the stages in paranoid mode too, only to measure what the gate would skip
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown detection mode '{mode}', expected one of {MODES}")
+        self.detector = detector
+        self.mode = mode
+        self.entropy_threshold = entropy_threshold
+        self.min_token_length = min_token_length
+        self.min_entropy_length = min_entropy_length
+        self.min_code_signals = min_code_signals
+        self.observe_stage = observe_stage
+        self.collect_stats = collect_stats
+        self.reset_stats()
+
+    def reset_stats(self):
+        self._prompts = 0
+        self._model_runs = 0
+        self._model_hits = 0
+        self._gate_misses = 0
+        self._stages = {name: {"evaluated": 0, "hits": 0, "seconds": 0.0} for name in self.STAGES}
+
+    def _regex_stage(self, prompt):
+        return bool(self.detector.scan(prompt))
+
+    def _keyword_stage(self, prompt):
+        return SECRET_ASSIGNMENT.search(prompt) is not None
+
+    def _entropy_stage(self, prompt):
+        for token in CANDIDATE_TOKEN.findall(prompt):
+            if len(token) < self.min_token_length:
+                continue
+            # short passwords mix digits with other classes, long keys are random enough to show in the entropy
+            if any(c.isdigit() for c in token) and character_classes(token) >= 3:
+                return True
+            if len(token) >= self.min_entropy_length and shannon_entropy(token) >= self.entropy_threshold:
+                return True
+        return False
+
+    def _code_stage(self, prompt):
+        signals = 0
+        for pattern in CODE_SIGNALS.values():
+            if pattern.search(prompt):
+                signals += 1
+                if signals >= self.min_code_signals:
+                    return True
+        return False
+
+    def evaluate(self, prompt):
+        """
+        Runs the cheap stages until one flags the prompt
+
+        Args:
+            prompt (str): The input text to analyze
+        Returns:
+            dict: `run_model` tells whether the model has to run, `stage` names the stage that flagged the prompt
+                (None if none did), `evaluated` is False when the stages were skipped
+        """
+        self._prompts += 1
+        if self.mode == "paranoid" and not self.collect_stats:
+            self._model_runs += 1
+            return {"run_model": True, "stage": None, "evaluated": False}
+        flagged_by = None
+        for name in self.STAGES:
+            start = time.perf_counter()
+            hit = getattr(self, f"_{name}_stage")(prompt)
+            seconds = time.perf_counter() - start
+            stats = self._stages[name]
+            stats["seconds"] += seconds
+            if self.observe_stage is not None:
+                self.observe_stage(name, seconds)
+            stats["evaluated"] += 1
+            if hit:
+                stats["hits"] += 1
+                flagged_by = name
+                break
+
+        run_model = self.mode == "paranoid" or flagged_by is not None
+        if run_model:
+            self._model_runs += 1
+        return {"run_model": run_model, "stage": flagged_by, "evaluated": True}
+
+    def record_model_result(self, decision, matches):
+        """
+        Records what the model found for a prompt, to measure how often the gate would miss
+
+        Args:
+            decision (dict): The result of `evaluate` for the prompt
+            matches (list): The sensitive parts the model returned
+        """
+        if decision["run_model"] and matches:
+            self._model_hits += 1
+            if decision["evaluated"] and decision["stage"] is None:
+                self._gate_misses += 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Per-stage evaluation counts, hit rates and time spent, plus how many prompts skipped the model
+        """
+        stages = {}
+        for name, stats in self._stages.items():
+            evaluated = stats["evaluated"]
+            stages[name] = {
+                "evaluated": evaluated,
+                "hits": stats["hits"],
+                "hit_rate": stats["hits"] / evaluated if evaluated else 0.0,
+                "total_ms": stats["seconds"] * 1000,
+                "mean_ms": stats["seconds"] * 1000 / evaluated if evaluated else 0.0,
+            }
+        return {
+            "mode": self.mode,
+            "prompts": self._prompts,
+            "model_runs": self._model_runs,
+            "model_skip_rate": 1 - self._model_runs / self._prompts if self._prompts else 0.0,
+            "model_hits": self._model_hits,
+            # prompts no stage flagged but the model still found sensitive parts in (only seen in paranoid mode with collect_stats)
+            "gate_misses": self._gate_misses,
+            "stages": stages,
+        }
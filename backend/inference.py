@@ -0,0 +1,203 @@
+"""
+Model inference on batches of texts, shared by the service and offline scans
+
+`ModelScanner` tokenizes texts, runs the forward pass of a `ModelBundle` and extracts the sensitive
+spans. Texts over MAX_LENGTH tokens are scanned in overlapping windows in long-document mode, or
+truncated. It holds no served model, queue or metrics of its own, so `bulk_scan.py` workers import it
+without the FastAPI app, and `app.py` passes callbacks exporting its stage timings and token counts.
+
+Example Usage:
+    scanner = ModelScanner(window_overlap=128)
+    results = scanner.scan_batch(["export API_KEY=...", "hello"], load_bundle("torch", "./results/checkpoint-50"))
+"""
+
+import contextlib, time
+
+import numpy as np
+import torch
+
+from span_extraction import extract_sensitive_parts
+
+MAX_LENGTH = 512
+
+
+def special_token_mask(input_ids, tokenizer):
+    """True for the cls, sep and pad tokens of a (batch, tokens) id tensor"""
+    special_ids = torch.tensor([tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id])
+    return torch.isin(input_ids, special_ids)
+
+
+def is_long_document(text, tokenizer):
+    """Checks whether the prompt would be truncated at MAX_LENGTH tokens"""
+    # every token covers at least one character, so short prompts can't overflow
+    if len(text) <= MAX_LENGTH - 2:
+        return False
+    return len(tokenizer(text, add_special_tokens=False)['input_ids']) > MAX_LENGTH - 2
+
+
+def window_starts(num_tokens, window_size, overlap):
+    """
+    Computes the first token index of each overlapping window covering the token stream
+
+    Args:
+        num_tokens (int): Length of the token stream without special tokens
+        window_size (int): Number of content tokens in a window
+        overlap (int): Number of tokens shared by neighbouring windows
+    Returns:
+        list: Start indices, the last window always ends at the end of the stream
+    """
+    step = max(1, window_size - overlap)
+    starts = list(range(0, max(num_tokens - window_size, 0) + 1, step))
+    if starts[-1] + window_size < num_tokens:
+        starts.append(num_tokens - window_size)
+    return starts
+
+
+class ModelScanner:
+    def __init__(self, long_documents=True, window_overlap=128, window_batch_size=16, observe_stage=None, observe_tokens=None, observe_long=None):
+        """
+        Args:
+            long_documents (bool): Scan texts over MAX_LENGTH tokens in overlapping windows instead of truncating them
+            window_overlap (int): Number of tokens shared by neighbouring windows
+            window_batch_size (int): Windows per forward pass
+            observe_stage (callable): Called with the stage name (tokenize, forward, extract) and its seconds
+            observe_tokens (callable): Called with the token count of every text reaching the model
+            observe_long (callable): Called with `windowed` or `truncated` for every text over MAX_LENGTH tokens
+        """
+        self.long_documents = long_documents
+        self.window_overlap = window_overlap
+        self.window_batch_size = window_batch_size
+        self.observe_stage = observe_stage
+        self.observe_tokens = observe_tokens
+        self.observe_long = observe_long
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.observe_stage is not None:
+                self.observe_stage(name, time.perf_counter() - start)
+
+    def scan_long(self, text, bundle, threshold=None):
+        """
+        Scans a prompt of any length with overlapping MAX_LENGTH token windows
+
+        All windows go through batched forward passes, each token keeps the highest probability any window
+        gave it, and consecutive sensitive tokens are merged into spans across window boundaries.
+
+        Args:
+            text (str): The prompt to scan
+            bundle (ModelBundle): The model and tokenizer to use
+            threshold (float): Minimum probability for a token to be considered sensitive, the bundle's calibrated one by default
+        Returns:
+            list: A list of dicts with the sensitive `text`, its `confidence` and its `start`/`end` character offsets in `text`
+        """
+        model, tokenizer = bundle.model, bundle.tokenizer
+        threshold = bundle.calibration.threshold if threshold is None else threshold
+        with self._stage("tokenize"):
+            encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        input_ids = encoding['input_ids']
+        offsets = encoding['offset_mapping']
+        if not input_ids:
+            return []
+        if self.observe_tokens is not None:
+            self.observe_tokens(len(input_ids))
+        if self.observe_long is not None:
+            self.observe_long("windowed")
+
+        window_size = MAX_LENGTH - 2
+        starts = window_starts(len(input_ids), window_size, min(self.window_overlap, window_size - 1))
+        windows = [
+            [tokenizer.cls_token_id] + input_ids[start:start + window_size] + [tokenizer.sep_token_id]
+            for start in starts
+        ]
+
+        token_probs = torch.zeros(len(input_ids))
+        for i in range(0, len(windows), self.window_batch_size):
+            inputs = tokenizer.pad({'input_ids': windows[i:i + self.window_batch_size]}, return_tensors="pt")
+            with torch.no_grad(), self._stage("forward"):
+                outputs = model(**inputs)
+                predictions = bundle.calibration.probabilities(outputs.logits)
+
+            # merging overlapping windows, skipping the cls token at position 0
+            for row, start in enumerate(starts[i:i + self.window_batch_size]):
+                length = len(windows[i + row]) - 2
+                window_probs = predictions[row, 1:length + 1]
+                token_probs[start:start + length] = torch.maximum(token_probs[start:start + length], window_probs)
+
+        with self._stage("extract"):
+            return extract_sensitive_parts(
+                [text],
+                token_probs.unsqueeze(0).numpy(),
+                np.ones((1, len(input_ids)), dtype=bool),
+                np.asarray(offsets).reshape(1, -1, 2),
+                threshold
+            )[0]
+
+    def scan_batch(self, texts, bundle, threshold=None):
+        """
+        Scans several prompts, with one forward pass per token length
+
+        Prompts of the same token length share a forward pass and no prompt is ever padded, so the
+        scores of a prompt are exactly the same whether it is scanned alone or in any batch. Prompts
+        longer than MAX_LENGTH tokens are routed to `scan_long` when long-document mode is on.
+
+        Args:
+            texts (list): The prompts to scan
+            bundle (ModelBundle): The model and tokenizer to use
+            threshold (float): Minimum probability for a token to be considered sensitive, the bundle's calibrated one by default
+        Returns:
+            list: The sensitive parts of each prompt, in the same order as `texts`
+        """
+        model, tokenizer = bundle.model, bundle.tokenizer
+        threshold = bundle.calibration.threshold if threshold is None else threshold
+        results = [None] * len(texts)
+        with self._stage("tokenize"):
+            is_long = [self.long_documents and is_long_document(text, tokenizer) for text in texts]
+        short_indices = []
+        for i, text in enumerate(texts):
+            if is_long[i]:
+                results[i] = self.scan_long(text, bundle, threshold)
+            else:
+                short_indices.append(i)
+        if not short_indices:
+            return results
+
+        with self._stage("tokenize"):
+            encodings = tokenizer(
+                [texts[i] for i in short_indices],
+                truncation=True,
+                max_length=MAX_LENGTH,
+                return_offsets_mapping=True
+            )
+        # padding changes the float rounding of the unpadded rows too, so only equal lengths are batched
+        groups = {}
+        for row, input_ids in enumerate(encodings['input_ids']):
+            groups.setdefault(len(input_ids), []).append(row)
+            if self.observe_tokens is not None:
+                self.observe_tokens(len(input_ids))
+            # with long-document mode off, a text filling every position was cut at MAX_LENGTH
+            if len(input_ids) == MAX_LENGTH and self.observe_long is not None:
+                self.observe_long("truncated")
+
+        for length, rows in groups.items():
+            input_ids = torch.tensor([encodings['input_ids'][row] for row in rows])
+            with torch.no_grad(), self._stage("forward"):
+                outputs = model(input_ids=input_ids, attention_mask=torch.ones_like(input_ids))
+                predictions = bundle.calibration.probabilities(outputs.logits)
+
+            # special tokens never belong to a span
+            with self._stage("extract"):
+                group_parts = extract_sensitive_parts(
+                    [texts[short_indices[row]] for row in rows],
+                    predictions.numpy(),
+                    (~special_token_mask(input_ids, tokenizer)).numpy(),
+                    np.array([encodings['offset_mapping'][row] for row in rows], dtype=np.int64).reshape(len(rows), length, 2),
+                    threshold
+                )
+            for row, parts in zip(rows, group_parts):
+                results[short_indices[row]] = parts
+
+        return results
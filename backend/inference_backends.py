@@ -0,0 +1,185 @@
+"""
+CPU inference backends for the token classification model
+
+Every backend is called like the Hugging Face model, `backend(input_ids=..., attention_mask=...)`,
+and returns an object with a torch `logits` tensor, so the scanning code doesn't care which one runs.
+
+Backends:
+- `torch`: the fp32 training checkpoint, run eagerly
+- `int8`: torch dynamic int8 quantization of the Linear layers, exported by `model_training/export_model.py`
+- `onnx`: an ONNX graph run by ONNX Runtime with all graph optimizations, exported by the same tool
+
+A `ModelBundle` pairs a loaded backend with its tokenizer and its probability calibration. When the
+model directory holds its own tokenizer files (written by the export tool), the bundle is fully local
+and loads without the hub. Its `fingerprint` identifies the files it was loaded from, so the same
+directory holding new weights is told apart.
+
+Example Usage:
+    model = load_model("onnx", "./exports/checkpoint-50-onnx")
+    logits = model(**tokenizer(text, return_tensors="pt")).logits
+
+    bundle = load_bundle("torch", "./exports/checkpoint-50-local")
+"""
+
+import hashlib, os
+from collections import namedtuple
+
+import torch
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer
+
+from calibration import load_calibration, CALIBRATION_FILENAME
+
+BACKENDS = ("torch", "int8", "onnx")
+
+ONNX_FILENAME = "model.onnx"
+QUANTIZED_FILENAME = "quantized_state_dict.pt"
+
+TOKENIZER_NAME = "microsoft/codebert-base"
+
+LogitsOutput = namedtuple("LogitsOutput", ["logits"])
+
+
+def quantize_dynamic_int8(model):
+    """Replaces the Linear layers of an fp32 model with dynamically quantized int8 ones"""
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class TorchBackend:
+    def __init__(self, path):
+        # safetensors weights are memory-mapped instead of read and copied
+        self.model = AutoModelForTokenClassification.from_pretrained(path, low_cpu_mem_usage=True)
+        self.model.eval()
+
+    def __call__(self, **inputs):
+        return LogitsOutput(self.model(**inputs).logits)
+
+
+class Int8Backend:
+    def __init__(self, path):
+        # rebuilding the fp32 architecture from the exported config, then swapping in the int8 weights
+        config = AutoConfig.from_pretrained(path)
+        model = AutoModelForTokenClassification.from_config(config)
+        model.eval()
+        self.model = quantize_dynamic_int8(model)
+        self.model.load_state_dict(torch.load(os.path.join(path, QUANTIZED_FILENAME)))
+
+    def __call__(self, **inputs):
+        return LogitsOutput(self.model(**inputs).logits)
+
+
+class OnnxBackend:
+    def __init__(self, path, intra_op_threads=0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime, install it with `pip install onnxruntime`")
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(path, ONNX_FILENAME),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+
+    def __call__(self, **inputs):
+        feed = {name: value.numpy() for name, value in inputs.items() if name in self.input_names}
+        logits = self.session.run(["logits"], feed)[0]
+        return LogitsOutput(torch.from_numpy(logits))
+
+
+def load_model(backend, path, intra_op_threads=0):
+    """
+    Loads a model with the given backend
+
+    Args:
+        backend (str): One of BACKENDS
+        path (str): The training checkpoint for `torch`, the export directory for `int8` and `onnx`
+        intra_op_threads (int): Threads per ONNX Runtime session, 0 for its default
+    Returns:
+        A callable returning an object with `logits`
+    """
+    if backend == "torch":
+        return TorchBackend(path)
+    if backend == "int8":
+        return Int8Backend(path)
+    if backend == "onnx":
+        return OnnxBackend(path, intra_op_threads)
+    raise ValueError(f"Unknown model backend '{backend}', expected one of {BACKENDS}")
+
+
+def rss_mb():
+    """Resident set size of this process in MB"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def has_local_tokenizer(path):
+    return os.path.isfile(os.path.join(path, "tokenizer.json"))
+
+
+def load_tokenizer(path):
+    """Loads the tokenizer stored next to the model if there is one, otherwise the hub tokenizer"""
+    if has_local_tokenizer(path):
+        return AutoTokenizer.from_pretrained(path, add_prefix_space=True, local_files_only=True)
+    return AutoTokenizer.from_pretrained(TOKENIZER_NAME, add_prefix_space=True)
+
+
+def checkpoint_fingerprint(path):
+    """
+    Short hash of the resolved model directory and of the name, size and modification time of every file in it
+
+    Returns:
+        str: The fingerprint, None if the directory doesn't exist
+    """
+    real_path = os.path.realpath(path)
+    try:
+        entries = sorted((entry for entry in os.scandir(real_path) if entry.is_file()), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return None
+    digest = hashlib.sha256(real_path.encode("utf-8"))
+    for entry in entries:
+        stat = entry.stat()
+        digest.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+class ModelBundle:
+    def __init__(self, model, tokenizer, backend, path, calibration, fingerprint=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.backend = backend
+        self.path = path
+        self.calibration = calibration
+        self.fingerprint = fingerprint
+        self.version = f"{backend}:{os.path.basename(os.path.normpath(path))}"
+
+
+def load_bundle(backend, path, intra_op_threads=0, calibration=None):
+    """
+    Loads a model, its tokenizer and its calibration
+
+    Args:
+        backend (str): One of BACKENDS
+        path (str): The model directory, see `load_model`
+        intra_op_threads (int): Threads per ONNX Runtime session, 0 for its default
+        calibration (Calibration): Overrides the calibration.json of the model directory
+    Returns:
+        ModelBundle: The loaded model, tokenizer and calibration
+    """
+    if calibration is None:
+        calibration = load_calibration(os.path.join(path, CALIBRATION_FILENAME))
+    # taken before loading, files replaced while loading then differ from it and are loaded again
+    fingerprint = checkpoint_fingerprint(path)
+    tokenizer = load_tokenizer(path)
+    model = load_model(backend, path, intra_op_threads)
+    return ModelBundle(model, tokenizer, backend, path, calibration, fingerprint)
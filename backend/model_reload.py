@@ -0,0 +1,225 @@
+"""
+Zero-downtime model reloads
+
+A `ModelReloader` replaces the served model without restarting the process or blocking scans:
+
+1. The new checkpoint is loaded and warmed up on a background thread while the current model keeps serving.
+2. Optionally, live batches are scored by both models for a while (shadow scoring). The candidate's
+   results are only compared, never returned: the share of texts both models find the same spans in
+   (agreement) and the per-text latency of each are recorded. Batches are handed over through a small
+   queue and dropped when it is full, so shadow scoring never delays a request, only adds load.
+3. The candidate is activated with one assignment if its agreement reaches the minimum, otherwise it
+   is rejected. Batches already running finish on the previous model.
+
+A `CheckpointWatcher` polls the served model directory and starts a reload once its fingerprint
+differs from the served bundle's and stayed the same for one interval, so a checkpoint still being
+copied is not loaded half-written. Pointing a symlink at another checkpoint counts as a change.
+
+Shadow texts are held in memory only until the candidate scored them, they are never stored or logged.
+
+Example Usage:
+    reloader = ModelReloader(load, warm_up, scan_batch, activate)
+    reloader.start("torch", "./results/checkpoint-60", shadow_texts=500, min_agreement=0.95)
+    reloader.status()
+    # {'state': 'shadowing', 'path': './results/checkpoint-60', ...}
+"""
+
+import queue, threading, time
+
+from inference_backends import checkpoint_fingerprint
+
+IN_PROGRESS = ("loading", "warming", "shadowing")
+
+
+class ReloadInProgressError(RuntimeError):
+    pass
+
+
+def span_offsets(sensitive_parts):
+    return [(part["start"], part["end"]) for part in sensitive_parts]
+
+
+class ModelReloader:
+    def __init__(self, load, warm_up, scan_batch, activate, observe_outcome=None, shadow_queue_size=32):
+        """
+        Args:
+            load (callable): load(backend, path) returns the loaded ModelBundle
+            warm_up (callable): warm_up(bundle) runs it on sample batches
+            scan_batch (callable): scan_batch(texts, bundle) returns the sensitive parts of every text
+            activate (callable): activate(bundle) makes the bundle the served one
+            observe_outcome (callable): Called with the outcome of every reload, swapped, rejected or failed
+            shadow_queue_size (int): Live batches waiting for the candidate, more are dropped
+        """
+        self._load = load
+        self._warm_up = warm_up
+        self._scan_batch = scan_batch
+        self._activate = activate
+        self._observe_outcome = observe_outcome
+        self._shadow_queue = queue.Queue(maxsize=shadow_queue_size)
+        self._lock = threading.Lock()
+        self._status = {"state": "idle"}
+        self._shadowing = False
+
+    @property
+    def shadowing(self):
+        return self._shadowing
+
+    @property
+    def in_progress(self):
+        return self._status["state"] in IN_PROGRESS
+
+    def status(self):
+        with self._lock:
+            return {key: dict(value) if isinstance(value, dict) else value for key, value in self._status.items()}
+
+    def _update(self, **fields):
+        with self._lock:
+            self._status.update(fields)
+
+    def start(self, backend, path, shadow_texts=0, min_agreement=0.0, shadow_timeout=300.0):
+        """
+        Starts loading a checkpoint in the background
+
+        Args:
+            backend (str): The model backend of the checkpoint
+            path (str): The model directory
+            shadow_texts (int): Live texts to score with both models before swapping, 0 to swap once warm
+            min_agreement (float): Share of shadow texts with the same spans needed to swap
+            shadow_timeout (float): Seconds to wait for the shadow texts, the decision is made on those scored by then
+        Returns:
+            dict: The reload status
+        Raises:
+            ReloadInProgressError: If another reload hasn't finished yet
+        """
+        with self._lock:
+            if self._status["state"] in IN_PROGRESS:
+                raise ReloadInProgressError(f"a reload of {self._status['path']} is already {self._status['state']}")
+            self._status = {
+                "state": "loading",
+                "backend": backend,
+                "path": path,
+                "fingerprint": checkpoint_fingerprint(path),
+                "started_at": time.time(),
+            }
+        thread = threading.Thread(
+            target=self._run,
+            args=(backend, path, shadow_texts, min_agreement, shadow_timeout),
+            name="model-reload",
+            daemon=True
+        )
+        thread.start()
+        return self.status()
+
+    def _run(self, backend, path, shadow_texts, min_agreement, shadow_timeout):
+        try:
+            start = time.perf_counter()
+            bundle = self._load(backend, path)
+            loaded = time.perf_counter()
+            self._update(state="warming", version=bundle.version, load_seconds=round(loaded - start, 3))
+            self._warm_up(bundle)
+            self._update(warmup_seconds=round(time.perf_counter() - loaded, 3))
+
+            if shadow_texts > 0:
+                self._update(state="shadowing")
+                shadow = self._shadow(bundle, shadow_texts, shadow_timeout)
+                self._update(shadow=shadow)
+                if shadow["texts"] and shadow["agreement"] < min_agreement:
+                    self._finish("rejected", reason=f"agreement {shadow['agreement']:.3f} below {min_agreement}")
+                    return
+
+            self._activate(bundle)
+            self._finish("swapped")
+        except Exception as e:
+            self._finish("failed", error=repr(e))
+
+    def _finish(self, outcome, **fields):
+        self._update(state=outcome, finished_at=time.time(), **fields)
+        if self._observe_outcome is not None:
+            self._observe_outcome(outcome)
+
+    def offer(self, texts, results, seconds):
+        """
+        Hands a live batch scored by the served model to the candidate, never blocks
+
+        Args:
+            texts (list): The scanned texts
+            results (list): The served model's sensitive parts of every text
+            seconds (float): Time the served model took for the batch
+        """
+        if not self._shadowing:
+            return
+        try:
+            self._shadow_queue.put_nowait((texts, [span_offsets(parts) for parts in results], seconds))
+        except queue.Full:
+            self._update(shadow_dropped=self._status.get("shadow_dropped", 0) + 1)
+
+    def _shadow(self, bundle, target, timeout):
+        texts = agreed = 0
+        served_seconds = candidate_seconds = 0.0
+        deadline = time.monotonic() + timeout
+        self._shadowing = True
+        try:
+            while texts < target and time.monotonic() < deadline:
+                try:
+                    batch, served, seconds = self._shadow_queue.get(timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    continue
+                start = time.perf_counter()
+                candidate = self._scan_batch(batch, bundle)
+                candidate_seconds += time.perf_counter() - start
+                served_seconds += seconds
+                texts += len(batch)
+                agreed += sum(offsets == span_offsets(parts) for offsets, parts in zip(served, candidate))
+        finally:
+            self._shadowing = False
+            # batches offered after the last one scored only hold texts nobody needs anymore
+            while not self._shadow_queue.empty():
+                self._shadow_queue.get_nowait()
+        return {
+            "texts": texts,
+            "agreement": agreed / texts if texts else None,
+            "served_ms_per_text": served_seconds / texts * 1000 if texts else None,
+            "candidate_ms_per_text": candidate_seconds / texts * 1000 if texts else None,
+        }
+
+
+class CheckpointWatcher:
+    def __init__(self, path, served_fingerprint, reload, interval=5.0):
+        """
+        Args:
+            path (callable): Returns the model directory to watch
+            served_fingerprint (callable): Returns the fingerprint of the served bundle
+            reload (callable): Starts a reload of the watched directory, may raise ReloadInProgressError
+            interval (float): Seconds between polls
+        """
+        self._path = path
+        self._served_fingerprint = served_fingerprint
+        self._reload = reload
+        self.interval = interval
+        self._stop = threading.Event()
+        # a checkpoint that failed to load is only tried again once it changes
+        self._attempted = None
+
+    def start(self):
+        threading.Thread(target=self._run, name="checkpoint-watcher", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        pending = None
+        while not self._stop.wait(self.interval):
+            current = checkpoint_fingerprint(self._path())
+            if current is None or current == self._served_fingerprint() or current == self._attempted:
+                pending = None
+                continue
+            if current != pending:
+                # changed since the last poll, possibly still being written
+                pending = current
+                continue
+            try:
+                self._reload()
+                self._attempted = current
+            except ReloadInProgressError:
+                pass
+            pending = None
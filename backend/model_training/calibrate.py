@@ -0,0 +1,277 @@
+"""
+Calibrates a checkpoint's token probabilities and picks its operating threshold offline.
+
+1. The checkpoint is run once over the eval split and the logits of every labelled token are stored in
+   `eval_logits.npz` next to the checkpoint, with their labels and the category of the secret they
+   belong to, read from the placeholder the secret filled in its eval template. Later runs reuse the
+   stored logits as long as the checkpoint and the split are unchanged.
+2. A temperature is fitted to the 2-class softmax head by minimizing the negative log-likelihood.
+3. Thresholds are swept over the calibrated probabilities. The chosen one maximizes F-beta (`--beta` > 1
+   favours recall, since a missed secret leaks while a false positive costs a click on the cleanse
+   button), optionally subject to `--min-precision`. When no threshold reaches that precision nothing is
+   written and the script exits with 1.
+4. For every category of secret, the recall at the chosen threshold and the threshold that would reach
+   `--target-recall` are recorded. The server can't tell categories apart before it has a span, so these
+   operating points are informational and the server applies the single threshold.
+
+The result is written to `calibration.json` in the checkpoint directory, where the server picks it up
+(see `calibration.py`). ECE, NLL, precision, recall and F1 of the original sigmoid/0.5 rule and of the
+calibrated rule are printed and recorded in the file.
+
+Usage (from the `backend` directory):
+    python model_training/calibrate.py results/checkpoint-50 --beta 2
+"""
+
+import argparse, datetime, hashlib, os, re, string, sys
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calibration import Calibration, CALIBRATION_FILENAME
+from inference_backends import load_model, load_tokenizer
+from pretokenized_dataset import load_pretokenized, read_fingerprint, DynamicPaddingCollator, LengthGroupedBatchSampler, CACHE_DIR
+from data_preparation import find_occurrences, align_labels, punctuation_token_ids
+from evaluate_checkpoints import detect_backend, weight_files
+from generate_corpus import CATEGORIES, load_templates
+
+LOGITS_FILENAME = "eval_logits.npz"
+# bumped whenever what is stored with the logits changes, so older files are computed again
+LOGITS_VERSION = 2
+THRESHOLDS = np.round(np.arange(0.01, 1.0, 0.01), 2)
+
+
+def template_patterns(templates):
+    """A regex per template matching the texts injected into it, with a group named after each placeholder"""
+    patterns = []
+    for template in templates.values():
+        parts, seen = [], set()
+        for literal, field, _, _ in string.Formatter().parse(template):
+            parts.append(re.escape(literal))
+            if field is not None:
+                parts.append(f"(?P={field})" if field in seen else f"(?P<{field}>.+?)")
+                seen.add(field)
+        patterns.append(re.compile("".join(parts), re.DOTALL))
+    return patterns
+
+
+def value_categories(text, patterns):
+    """The category of each value injected into the text, the placeholder it fills in its template, empty if no template matches"""
+    for pattern in patterns:
+        match = pattern.fullmatch(text)
+        if match:
+            return {value: field for field, value in match.groupdict().items()}
+    return {}
+
+
+def token_categories(tokenizer, templates, synthetic_data, patterns, max_length=512):
+    """
+    Category index of every token of every template, -1 outside secrets
+
+    The category of a value is read from the placeholder it was injected into (see `value_categories`),
+    values no template accounts for count as secrets of no category.
+    """
+    special_ids = np.array([tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id], dtype=np.int64)
+    punctuation_ids = punctuation_token_ids(tokenizer)
+    encodings = tokenizer(list(templates), truncation=True, max_length=max_length, return_offsets_mapping=True)
+    categories = []
+    uncategorized = 0
+    for row, (template, values) in enumerate(zip(templates, synthetic_data)):
+        input_ids = np.array(encodings["input_ids"][row], dtype=np.int64)
+        offsets = np.array(encodings["offset_mapping"][row], dtype=np.int64)
+        category = np.full(len(input_ids), -1, dtype=np.int8)
+        known = value_categories(template, patterns)
+        for value in values:
+            if known.get(value) not in CATEGORIES:
+                uncategorized += 1
+                continue
+            labels = align_labels(input_ids, offsets, find_occurrences(template, [value]), special_ids, punctuation_ids)
+            category[(labels == 1) & (category == -1)] = CATEGORIES.index(known[value])
+        categories.append(category)
+    if uncategorized:
+        print(f"Warning: {uncategorized} values match no eval template placeholder and are left out of the per-category operating points")
+    return categories
+
+
+def collect_logits(model, dataset, pad_token_id, batch_size):
+    """Logits of every example of the dataset, in dataset order"""
+    loader = DataLoader(
+        dataset,
+        batch_sampler=LengthGroupedBatchSampler(dataset.lengths, batch_size, shuffle=False),
+        collate_fn=DynamicPaddingCollator(pad_token_id)
+    )
+    per_example = [None] * len(dataset)
+    for indices, batch in zip(loader.batch_sampler, loader):
+        with torch.no_grad():
+            logits = model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"]).logits.float().numpy()
+        for row, idx in enumerate(indices):
+            per_example[idx] = logits[row, :dataset.lengths[idx]]
+    return per_example
+
+
+def load_or_compute_logits(args, tokenizer):
+    from evaluation_datasets.eval_generated_synthetic_data import Eval_synthetic_data
+    from evaluation_datasets.eval_injected_templates import Eval_injected_templates
+
+    dataset = load_pretokenized("eval", tokenizer, Eval_injected_templates, Eval_synthetic_data, cache_dir=args.cache_dir)
+    backend = detect_backend(args.checkpoint)
+    # the stored logits stay valid while the split and the checkpoint's weights are unchanged
+    weights = weight_files(args.checkpoint)
+    fingerprint = hashlib.sha256(
+        (f"{LOGITS_VERSION}|" + read_fingerprint(os.path.join(args.cache_dir, "eval")) + backend + "".join(f"{path}:{os.path.getmtime(path)}" for path in weights)).encode("utf-8")
+    ).hexdigest()
+
+    path = os.path.join(args.checkpoint, LOGITS_FILENAME)
+    if os.path.isfile(path):
+        stored = np.load(path)
+        if str(stored["fingerprint"]) == fingerprint:
+            print(f"Using the logits stored in {path}")
+            return stored["logits"], stored["labels"], stored["categories"]
+
+    print(f"Computing eval logits of {args.checkpoint} ({backend})")
+    model = load_model(backend, args.checkpoint)
+    per_example = collect_logits(model, dataset, tokenizer.pad_token_id, args.batch_size)
+    categories = token_categories(tokenizer, Eval_injected_templates, Eval_synthetic_data, template_patterns(load_templates("eval")))
+
+    logits, labels, token_category = [], [], []
+    for idx in range(len(dataset)):
+        example_labels = dataset[idx]["labels"].numpy()
+        valid = example_labels != -100
+        logits.append(per_example[idx][valid])
+        labels.append(example_labels[valid])
+        token_category.append(categories[idx][:len(example_labels)][valid])
+    logits, labels, token_category = np.concatenate(logits), np.concatenate(labels), np.concatenate(token_category)
+    np.savez_compressed(path, logits=logits, labels=labels, categories=token_category, fingerprint=fingerprint)
+    print(f"Stored {len(labels)} token logits in {path}")
+    return logits, labels, token_category
+
+
+def negative_log_likelihood(margins, labels, temperature):
+    # log softmax of the 2-class head through the logit margin, numerically stable
+    scaled = margins / temperature
+    return float(np.mean(np.logaddexp(0, -scaled) * labels + np.logaddexp(0, scaled) * (1 - labels)))
+
+
+def fit_temperature(margins, labels, low=0.05, high=20.0, iterations=60):
+    """Golden-section search of the temperature minimizing the NLL, which is unimodal in log T"""
+    ratio = (np.sqrt(5) - 1) / 2
+    a, b = np.log(low), np.log(high)
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    for _ in range(iterations):
+        if negative_log_likelihood(margins, labels, np.exp(c)) < negative_log_likelihood(margins, labels, np.exp(d)):
+            b, d = d, c
+            c = b - ratio * (b - a)
+        else:
+            a, c = c, d
+            d = a + ratio * (b - a)
+    return float(np.exp((a + b) / 2))
+
+
+def expected_calibration_error(probs, labels, bins=15):
+    edges = np.linspace(0, 1, bins + 1)
+    which = np.clip(np.digitize(probs, edges) - 1, 0, bins - 1)
+    error = 0.0
+    for b in range(bins):
+        members = which == b
+        if members.any():
+            error += members.mean() * abs(probs[members].mean() - labels[members].mean())
+    return float(error)
+
+
+def sweep(probs, labels, thresholds=THRESHOLDS):
+    """Precision and recall at every threshold, vectorized over the sorted probabilities"""
+    order = np.sort(probs)
+    positives = np.sort(probs[labels == 1])
+    predicted = len(order) - np.searchsorted(order, thresholds, side="right")
+    true_positives = len(positives) - np.searchsorted(positives, thresholds, side="right")
+    precision = np.divide(true_positives, predicted, out=np.zeros(len(thresholds)), where=predicted > 0)
+    recall = true_positives / max(1, len(positives))
+    return precision, recall
+
+
+def f_beta(precision, recall, beta):
+    denominator = beta ** 2 * precision + recall
+    return np.divide((1 + beta ** 2) * precision * recall, denominator, out=np.zeros_like(precision), where=denominator > 0)
+
+
+def summarize(probs, labels, threshold):
+    predicted = probs > threshold
+    true_positives = int((predicted & (labels == 1)).sum())
+    precision = true_positives / max(1, int(predicted.sum()))
+    recall = true_positives / max(1, int((labels == 1).sum()))
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        "ece": expected_calibration_error(probs, labels),
+    }
+
+
+def main(args):
+    tokenizer = load_tokenizer(args.checkpoint)
+    logits, labels, categories = load_or_compute_logits(args, tokenizer)
+    margins = logits[:, 1] - logits[:, 0]
+
+    temperature = fit_temperature(margins, labels)
+    calibrated = Calibration(temperature, 0.5)
+    compat_probs = Calibration().probabilities(torch.from_numpy(logits)).numpy()
+    probs = calibrated.probabilities(torch.from_numpy(logits)).numpy()
+
+    precision, recall = sweep(probs, labels)
+    score = f_beta(precision, recall, args.beta)
+    if args.min_precision is not None:
+        score = np.where(precision >= args.min_precision, score, -1)
+        if (score < 0).all():
+            # argmax would pick the lowest threshold and the server would flag nearly every token
+            print(f"No threshold reaches a precision of {args.min_precision} (best {precision.max():.4f}), calibration not written")
+            sys.exit(1)
+    threshold = float(THRESHOLDS[int(np.argmax(score))])
+
+    operating_points = {}
+    for index, name in enumerate(CATEGORIES):
+        members = categories == index
+        if not members.any():
+            continue
+        category_recall = (probs[members][None, :] > THRESHOLDS[:, None]).mean(axis=1)
+        reaching = THRESHOLDS[category_recall >= args.target_recall]
+        operating_points[name] = {
+            "tokens": int(members.sum()),
+            "recall": float((probs[members] > threshold).mean()),
+            f"threshold_for_recall_{args.target_recall}": float(reaching.max()) if reaching.size else None,
+        }
+
+    before = {"nll": negative_log_likelihood(logits[:, 1], labels, 1.0), **summarize(compat_probs, labels, 0.5)}
+    after = {"nll": negative_log_likelihood(margins, labels, temperature), **summarize(probs, labels, threshold)}
+    content = f"{temperature:.6f}|{threshold}|{args.checkpoint}"
+    calibration = Calibration(temperature, threshold, version=f"cal-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:8]}", details={
+        "checkpoint": os.path.basename(os.path.normpath(args.checkpoint)),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "objective": {"beta": args.beta, "min_precision": args.min_precision},
+        "eval_tokens": int(len(labels)),
+        "compat": before,
+        "calibrated": after,
+        "categories": operating_points,
+    })
+    path = os.path.join(args.checkpoint, CALIBRATION_FILENAME)
+    calibration.save(path)
+
+    print(f"\nTemperature {temperature:.3f}, threshold {threshold:.2f} (F{args.beta:g})")
+    print(f"{'rule':22} {'NLL':>7} {'ECE':>7} {'precision':>10} {'recall':>7} {'F1':>7}")
+    for name, metrics in (("sigmoid > 0.5 (compat)", before), (f"calibrated > {threshold:.2f}", after)):
+        print(f"{name:22} {metrics['nll']:7.4f} {metrics['ece']:7.4f} {metrics['precision']:10.4f} {metrics['recall']:7.4f} {metrics['f1']:7.4f}")
+    for name, point in operating_points.items():
+        print(f"{name:12} recall {point['recall']:.4f}, threshold for recall {args.target_recall}: {point[f'threshold_for_recall_{args.target_recall}']}")
+    print(f"\nCalibration {calibration.version} written to {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checkpoint", help="checkpoint or exported model directory, the calibration is written there")
+    parser.add_argument("--beta", type=float, default=1.0, help="F-beta the threshold maximizes, above 1 favours recall")
+    parser.add_argument("--min-precision", type=float, default=None)
+    parser.add_argument("--target-recall", type=float, default=0.95, help="per-category recall the operating points report")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    main(parser.parse_args())
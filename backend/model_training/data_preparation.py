@@ -5,7 +5,14 @@ This script receives synthetic data and templates, tokenizes the templates using
 and labels the tokens that correspond to sensitive data. The resulting dataset is suitable for training a model to
 identify sensitive information in text.
 
-The `TrainingTokenDataset` class processes the templates and synthetic data to create the dataset. 
+The `TrainingTokenDataset` class processes the templates and synthetic data to create the dataset.
+Labels are aligned through the tokenizer's offsets mapping: the occurrences of each distinct sensitive string are found
+with one `str.find` scan of the template and mapped to tokens by binary search, instead of walking the template
+character by character.
+
+Corpora written by `generate_corpus.py` are read lazily, one shard at a time, with `iter_shards`, and
+`create_sharded_datasets` tokenizes them shard by shard into the memory-mapped caches of
+`pretokenized_dataset.py`, so neither their raw text nor padded examples are held at once.
 
 The `print_alignment` function is a helper function that prints the token-label alignment for a specific example in the
 dataset, which is useful for debugging and understanding the dataset structure.
@@ -15,85 +22,125 @@ Note:
 - The script relies on the Hugging Face Transformers library for tokenization.
 """
 
-from regex import E
-import test
 from torch.utils.data import Dataset
-import string, torch
-from training_datasets.generated_synthetic_data import synthetic_data
-from training_datasets.injected_templates import injected_templates
+import glob, json, string, torch
+import numpy as np
 from transformers import AutoTokenizer, AutoModelForTokenClassification, Trainer, TrainingArguments
-from evaluation_datasets.eval_generated_synthetic_data import Eval_synthetic_data
-from evaluation_datasets.eval_injected_templates import Eval_injected_templates
-from test_datasets.test_generated_synthetic_data import test_synthetic_data
-from test_datasets.test_injected_templates import test_injected_templates
+
+
+def punctuation_token_ids(tokenizer):
+    """Ids of the vocabulary tokens that are a single punctuation character, which are never labelled sensitive"""
+    vocab = tokenizer.get_vocab()
+    return np.array(sorted(vocab[char] for char in string.punctuation if char in vocab), dtype=np.int64)
+
+
+def find_occurrences(text, items):
+    """
+    Finds every occurrence of every item in the text, overlapping ones included
+
+    Each distinct item is searched with `str.find`, which scans in C. With a handful of items per
+    template this beats compiling a multi-pattern regex for every template by two orders of magnitude.
+
+    Returns:
+        list: (start, end) character ranges
+    """
+    occurrences = []
+    for item in {str(item) for item in items}:
+        if not item:
+            continue
+        pos = text.find(item)
+        while pos != -1:
+            occurrences.append((pos, pos + len(item)))
+            pos = text.find(item, pos + 1)
+    return occurrences
+
+
+def align_labels(input_ids, offsets, occurrences, special_ids, punctuation_ids):
+    """
+    Labels the tokens of one encoded template
+
+    Args:
+        input_ids (numpy.ndarray): Token ids of the template
+        offsets (numpy.ndarray): (tokens, 2) character offsets of each token
+        occurrences (list): (start, end) character ranges of the sensitive strings
+        special_ids (numpy.ndarray): Ids labelled -100 (cls, sep and pad)
+        punctuation_ids (numpy.ndarray): Ids never labelled sensitive
+    Returns:
+        numpy.ndarray: -100 for special tokens, 1 for sensitive tokens, 0 otherwise
+    """
+    special = np.isin(input_ids, special_ids)
+    labels = np.where(special, -100, 0)
+    if not occurrences:
+        return labels
+
+    # tokens in text order that hold characters, a character belongs to the first token whose range holds it
+    holders = np.flatnonzero(~special & (offsets[:, 1] > offsets[:, 0]))
+    if holders.size == 0:
+        return labels
+    starts = offsets[holders, 0]
+    ends = offsets[holders, 1]
+    ranges = np.array(occurrences, dtype=np.int64)
+
+    def char_to_token(chars):
+        # the last token starting at or before the character
+        positions = np.searchsorted(starts, chars, side="right") - 1
+        found = positions >= 0
+        # tokens split from one character share its offsets, taking the first of them
+        positions = np.searchsorted(starts, starts[np.maximum(positions, 0)], side="left")
+        found &= chars < ends[positions]
+        return holders[positions], found
+
+    first, first_found = char_to_token(ranges[:, 0])
+    last, last_found = char_to_token(ranges[:, 1] - 1)
+    keep = first_found & last_found
+
+    # marking the covered token ranges with a difference array
+    covered = np.zeros(len(input_ids) + 1, dtype=np.int64)
+    np.add.at(covered, first[keep], 1)
+    np.add.at(covered, last[keep] + 1, -1)
+    sensitive = (np.cumsum(covered[:-1]) > 0) & ~special & ~np.isin(input_ids, punctuation_ids)
+    labels[sensitive] = 1
+    return labels
 
 
 class TrainingTokenDataset(Dataset):
-    def __init__(self, injected_templates, synthetic_data, tokenizer, max_length=512):
+    def __init__(self, injected_templates, synthetic_data, tokenizer, max_length=512, chunk_size=1024):
         self.encodings = []
         self.labels = []
-        
-        PUNCTUATION_TOKENS = set(string.punctuation)
-        
-        for i in range(len(injected_templates)):
-            try:
-                # 1: Getting full encoding first to handle special tokens
-                encoding = tokenizer(
-                    injected_templates[i],
-                    truncation=True,
-                    padding='max_length',
-                    max_length=max_length,
-                    return_tensors="pt",
-                    return_offsets_mapping=True,  
-                    add_special_tokens=True
-                )
-                    
-                # Initializing all labels as NOT_SENSITIVE
-                labels = [0] * len(encoding['input_ids'][0])
-                
-                # Mark special tokens as -100 (ignored in loss calculation)
-                for pos in range(len(encoding['input_ids'][0])):
-                    if encoding['input_ids'][0][pos] in [tokenizer.cls_token_id, 
-                                                       tokenizer.sep_token_id, 
-                                                       tokenizer.pad_token_id]:
-                        labels[pos] = -100
-                
-                # 2: Finding and labeling sensitive data
-                
-                for synthetic_item in synthetic_data[i]:
-                    synthetic_str = str(synthetic_item)
-                    # Find all occurrences of sensitive data in the template
-                    start_idx = 0
-                    while True:
-                        pos = injected_templates[i].find(synthetic_str, start_idx)
-                        if pos == -1:
-                            break
-                            
-                        # Find which tokens correspond to these character positions
-                        char_to_token = encoding.char_to_token(0, pos)
-                        end_pos = pos + len(synthetic_str)
-                        end_token = encoding.char_to_token(0, end_pos - 1)
-                        
-                        if char_to_token is not None and end_token is not None:
-                            # Label all tokens in this range as SENSITIVE
-                            for token_idx in range(char_to_token, end_token + 1):
-                                # Only label if it's not a special token
-                                if labels[token_idx] != -100:
-                                    token = tokenizer.convert_ids_to_tokens(
-                                        encoding['input_ids'][0][token_idx].item()
-                                    )
-                                    # Not marking punctuation as sensitive
-                                    if token not in PUNCTUATION_TOKENS:
-                                        labels[token_idx] = 1
-                        
-                        start_idx = pos + 1
-                
-                self.encodings.append({key: val.squeeze(0) for key, val in encoding.items()})
-                self.labels.append(labels)
-            except Exception as e:
-                print(f"Error processing template {i}: {e}")
-                continue  
-        
+
+        special_ids = np.array([tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id], dtype=np.int64)
+        punctuation_ids = punctuation_token_ids(tokenizer)
+
+        # tokenizing in chunks, the fast tokenizer encodes a whole chunk in parallel
+        for chunk_start in range(0, len(injected_templates), chunk_size):
+            templates = list(injected_templates[chunk_start:chunk_start + chunk_size])
+            encodings = tokenizer(
+                templates,
+                truncation=True,
+                padding='max_length',
+                max_length=max_length,
+                return_offsets_mapping=True,
+                add_special_tokens=True
+            )
+
+            for row, template in enumerate(templates):
+                i = chunk_start + row
+                try:
+                    input_ids = np.array(encodings['input_ids'][row], dtype=np.int64)
+                    offsets = np.array(encodings['offset_mapping'][row], dtype=np.int64)
+                    occurrences = find_occurrences(template, synthetic_data[i])
+                    labels = align_labels(input_ids, offsets, occurrences, special_ids, punctuation_ids)
+
+                    self.encodings.append({
+                        'input_ids': torch.from_numpy(input_ids),
+                        'attention_mask': torch.tensor(encodings['attention_mask'][row], dtype=torch.long),
+                        'offset_mapping': torch.from_numpy(offsets)
+                    })
+                    self.labels.append(labels.tolist())
+                except Exception as e:
+                    print(f"Error processing template {i}: {e}")
+                    continue
+
         # Debug
         print(f"Length of self.encodings: {len(self.encodings)}")
         print(f"Length of self.labels: {len(self.labels)}")
@@ -127,9 +174,62 @@ def create_datasets(tokenizer, injected_templates, synthetic_data):
         synthetic_data=synthetic_data,
         tokenizer=tokenizer
     )
-        
-    
+
+def read_shard(path):
+    """
+    Reads a corpus shard written by `generate_corpus.py`
+
+    Returns:
+        tuple: The injected templates and, for each, the tuple of injected values, as `TrainingTokenDataset` takes them
+    """
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet shards require pyarrow, install it with `pip install pyarrow`")
+        records = pyarrow.parquet.read_table(path).to_pylist()
+    else:
+        with open(path, encoding="utf-8") as fr:
+            records = [json.loads(line) for line in fr]
+
+    templates = [record["text"] for record in records]
+    values = [
+        tuple(dict.fromkeys(record["text"][span["start"]:span["end"]] for span in record["spans"]))
+        for record in records
+    ]
+    return templates, values
+
+def shard_paths(pattern):
+    """The shards matching the glob pattern, sorted by file name"""
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"No corpus shards match {pattern}")
+    return paths
+
+def iter_shards(pattern):
+    """Yields (path, templates, synthetic data) for every shard matching the glob pattern, reading one shard at a time"""
+    for path in shard_paths(pattern):
+        yield (path, *read_shard(path))
+
+def create_sharded_datasets(tokenizer, pattern, name=None, max_length=512):
+    """
+    Builds one unpadded dataset from all shards of a generated corpus, e.g. `model_training/corpus/train/*.jsonl`
+
+    Shards are tokenized one at a time into the pre-tokenized cache and read back memory-mapped, see
+    `pretokenized_dataset.load_pretokenized_shards`.
+    """
+    from pretokenized_dataset import load_pretokenized_shards
+    return load_pretokenized_shards(tokenizer, pattern, name=name, max_length=max_length)
+
+
 if __name__ == '__main__':
+    from training_datasets.generated_synthetic_data import synthetic_data
+    from training_datasets.injected_templates import injected_templates
+    from evaluation_datasets.eval_generated_synthetic_data import Eval_synthetic_data
+    from evaluation_datasets.eval_injected_templates import Eval_injected_templates
+    from test_datasets.test_generated_synthetic_data import test_synthetic_data
+    from test_datasets.test_injected_templates import test_injected_templates
+
     tokenizer = AutoTokenizer.from_pretrained(
         "microsoft/codebert-base",
         add_prefix_space=True
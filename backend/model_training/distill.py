@@ -0,0 +1,335 @@
+"""
+Distils the token classification model into a shallow student for the latency-critical /scan path.
+
+The student is the teacher's architecture with fewer transformer layers (`--layers`, 4 by default
+against CodeBERT's 12). It keeps the tokenizer, the embeddings and the classifier, and starts from
+evenly spaced teacher layers, so it begins close to the teacher instead of from scratch.
+
+1. The training data is the pre-tokenized train split, or with `--corpus` all shards of a corpus
+   written by `generate_corpus.py` from `SyntheticDataGenerator`.
+2. The teacher runs once over it and its logits are cached next to the tokens
+   (`teacher-<hash>.npy`), so every epoch reads them instead of running the teacher again.
+3. The student is trained on `alpha * T^2 * KL(teacher || student)` at temperature `T`, plus
+   `(1 - alpha) *` the cross-entropy with the labels.
+4. The student and its tokenizer are saved to `--output-dir`, a regular checkpoint that every backend
+   of `inference_backends.py` loads, and that `export_model.py` and `calibrate.py` take like any other:
+
+       SCAN_MODEL_PATH=results/student python app.py
+
+5. Teacher and student are evaluated on the test split with `evaluate_checkpoints.py` (F1, latency,
+   memory), together with the cascade the server runs with `SCAN_ESCALATION_MODEL_PATH`: test
+   examples holding a student span below `--escalation-confidence` are decided by the teacher. The
+   side-by-side report is written to `distillation_report.json` and `distillation_report.md` in
+   `--output-dir`.
+
+Usage (from the `backend` directory):
+    python model_training/distill.py --teacher results/checkpoint-50 --layers 4 --output-dir results/student
+    python model_training/distill.py --teacher results/checkpoint-50 --output-dir results/student --report-only
+"""
+
+import argparse, copy, hashlib, json, os, re, sys, time
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from transformers import AutoModelForTokenClassification, TrainingArguments
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference_backends import load_tokenizer
+from pretokenized_dataset import (
+    load_pretokenized, read_fingerprint, PreTokenizedDataset, DynamicPaddingCollator, LengthGroupedBatchSampler,
+    LengthGroupedTrainer, CACHE_DIR
+)
+from calibrate import collect_logits
+from evaluate_checkpoints import evaluate_checkpoint, token_runs, precision_recall_f1, weight_files
+from data_preparation import iter_shards
+
+
+def build_student(teacher, num_layers):
+    """
+    The teacher's architecture with `num_layers` transformer layers, initialized from evenly spaced teacher layers
+
+    Returns:
+        tuple: The student model and the indices of the teacher layers it was initialized from
+    """
+    config = copy.deepcopy(teacher.config)
+    keep = np.linspace(0, config.num_hidden_layers - 1, num_layers).round().astype(int).tolist()
+    config.num_hidden_layers = num_layers
+    student = AutoModelForTokenClassification.from_config(config)
+
+    state = student.state_dict()
+    for name, value in teacher.state_dict().items():
+        match = re.match(r"(.*\.layer\.)(\d+)(\..*)", name)
+        if match:
+            if int(match.group(2)) not in keep:
+                continue
+            name = f"{match.group(1)}{keep.index(int(match.group(2)))}{match.group(3)}"
+        if name in state and state[name].shape == value.shape:
+            state[name] = value.clone()
+    student.load_state_dict(state)
+    return student, keep
+
+
+class DistillationDataset(PreTokenizedDataset):
+    def __init__(self, path, teacher_logits_path):
+        """
+        Args:
+            path (str): A cache directory written by `pretokenized_dataset.write_cache`
+            teacher_logits_path (str): (tokens, 2) teacher logits of all examples back to back, like the token ids
+        """
+        super().__init__(path)
+        self.teacher_logits = np.load(teacher_logits_path, mmap_mode="r")
+
+    def __getitem__(self, idx):
+        item = super().__getitem__(idx)
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        item["teacher_logits"] = torch.from_numpy(self.teacher_logits[start:end].astype(np.float32))
+        return item
+
+
+class DistillationCollator(DynamicPaddingCollator):
+    """Pads like `DynamicPaddingCollator`, plus the teacher logits when the examples have them"""
+
+    def __call__(self, features):
+        batch = super().__call__(features)
+        if "teacher_logits" in features[0]:
+            teacher_logits = torch.zeros((*batch["input_ids"].shape, features[0]["teacher_logits"].shape[-1]))
+            for row, feature in enumerate(features):
+                teacher_logits[row, :len(feature["teacher_logits"])] = feature["teacher_logits"]
+            batch["teacher_logits"] = teacher_logits
+        return batch
+
+
+class DistillationTrainer(LengthGroupedTrainer):
+    def __init__(self, *args, temperature=2.0, alpha=0.5, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def compute_loss(self, model, inputs, return_outputs=False, num_items_in_batch=None):
+        outputs = model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])
+        labels = inputs["labels"]
+        valid = labels != -100
+        logits = outputs.logits[valid]
+        loss = F.cross_entropy(logits, labels[valid])
+        # the eval split has no teacher logits, it is scored on the labels alone
+        if "teacher_logits" in inputs:
+            teacher = inputs["teacher_logits"][valid]
+            distillation = F.kl_div(
+                F.log_softmax(logits / self.temperature, dim=-1),
+                F.softmax(teacher / self.temperature, dim=-1),
+                reduction="batchmean"
+            ) * self.temperature ** 2
+            loss = self.alpha * distillation + (1 - self.alpha) * loss
+        return (loss, outputs) if return_outputs else loss
+
+
+def load_training_split(tokenizer, args):
+    if args.corpus:
+        templates, synthetic_data = [], []
+        for _, shard_templates, shard_data in iter_shards(args.corpus):
+            templates.extend(shard_templates)
+            synthetic_data.extend(shard_data)
+        name = "corpus-" + hashlib.sha256(args.corpus.encode("utf-8")).hexdigest()[:8]
+        return name, load_pretokenized(name, tokenizer, templates, synthetic_data, cache_dir=args.cache_dir)
+
+    from training_datasets.generated_synthetic_data import synthetic_data
+    from training_datasets.injected_templates import injected_templates
+    return "train", load_pretokenized("train", tokenizer, injected_templates, synthetic_data, cache_dir=args.cache_dir)
+
+
+def teacher_logits_path(teacher_path, cache_path):
+    """The teacher logits stay valid while the split and the teacher's weights are unchanged"""
+    fingerprint = hashlib.sha256((read_fingerprint(cache_path) + "".join(
+        f"{path}:{os.path.getmtime(path)}" for path in weight_files(teacher_path)
+    )).encode("utf-8")).hexdigest()
+    return os.path.join(cache_path, f"teacher-{fingerprint[:16]}.npy")
+
+
+def cache_teacher_logits(teacher, dataset, path, pad_token_id, batch_size):
+    if os.path.isfile(path):
+        print(f"Using the teacher logits cached in {path}")
+        return
+    start = time.perf_counter()
+    per_example = collect_logits(teacher, dataset, pad_token_id, batch_size)
+    temporary = f"{path}.tmp-{os.getpid()}.npy"
+    np.save(temporary, np.concatenate(per_example).astype(np.float16))
+    os.replace(temporary, path)
+    print(f"Cached teacher logits of {len(dataset)} examples in {time.perf_counter() - start:.1f}s to {path}")
+
+
+def train(args):
+    tokenizer = load_tokenizer(args.teacher)
+    teacher = AutoModelForTokenClassification.from_pretrained(args.teacher)
+    teacher.eval()
+
+    name, train_split = load_training_split(tokenizer, args)
+    cache_path = os.path.join(args.cache_dir, name)
+    logits_path = teacher_logits_path(args.teacher, cache_path)
+    cache_teacher_logits(teacher, train_split, logits_path, tokenizer.pad_token_id, args.batch_size)
+
+    from evaluation_datasets.eval_generated_synthetic_data import Eval_synthetic_data
+    from evaluation_datasets.eval_injected_templates import Eval_injected_templates
+    eval_dataset = load_pretokenized("eval", tokenizer, Eval_injected_templates, Eval_synthetic_data, cache_dir=args.cache_dir)
+
+    student, layers = build_student(teacher, args.layers)
+    del teacher
+    print(f"Student: {args.layers} layers initialized from teacher layers {layers}, "
+          f"{sum(p.numel() for p in student.parameters()) / 1e6:.1f}M parameters")
+
+    training_args = TrainingArguments(
+        output_dir=args.output_dir,
+        num_train_epochs=args.epochs,
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.batch_size,
+        learning_rate=args.learning_rate,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        save_total_limit=1,
+        logging_steps=50,
+        seed=args.seed,
+        report_to=[],
+    )
+    trainer = DistillationTrainer(
+        model=student,
+        args=training_args,
+        train_dataset=DistillationDataset(cache_path, logits_path),
+        eval_dataset=eval_dataset,
+        data_collator=DistillationCollator(tokenizer.pad_token_id),
+        temperature=args.temperature,
+        alpha=args.alpha,
+    )
+    trainer.train()
+    trainer.save_model(args.output_dir)
+    # fully local, so the server loads the student without the hub
+    tokenizer.save_pretrained(args.output_dir)
+    print(f"Student saved to {args.output_dir}")
+
+
+def evaluate_cascade(student_path, teacher_path, cache_path, pad_token_id, escalation_confidence, threshold, batch_size):
+    """
+    Span metrics of the student with escalation: an example holding a student span whose highest
+    probability is below `escalation_confidence` is decided by the teacher
+
+    Returns:
+        dict: Span precision/recall/F1 of the cascade and the share of escalated examples
+    """
+    from inference_backends import load_model
+    from calibration import load_calibration, CALIBRATION_FILENAME
+
+    models = {}
+    for role, path in (("student", student_path), ("teacher", teacher_path)):
+        calibration = load_calibration(os.path.join(path, CALIBRATION_FILENAME))
+        models[role] = (load_model("torch", path), calibration, calibration.threshold if threshold is None else threshold)
+
+    dataset = PreTokenizedDataset(cache_path)
+    loader = DataLoader(
+        dataset,
+        batch_sampler=LengthGroupedBatchSampler(dataset.lengths, batch_size, shuffle=False),
+        collate_fn=DynamicPaddingCollator(pad_token_id)
+    )
+    true_positives = predicted_count = actual_count = escalated = 0
+    for batch in loader:
+        inputs = {"input_ids": batch["input_ids"], "attention_mask": batch["attention_mask"]}
+        labels = batch["labels"].numpy()
+        valid = labels != -100
+        decisions = {}
+        for role, (model, calibration, role_threshold) in models.items():
+            with torch.no_grad():
+                probs = calibration.probabilities(model(**inputs).logits).numpy()
+            decisions[role] = (probs, (probs > role_threshold) & valid)
+
+        student_probs, student_predicted = decisions["student"]
+        uncertain = {row for row, first, last in token_runs(student_predicted) if student_probs[row, first:last + 1].max() < escalation_confidence}
+        predicted = student_predicted.copy()
+        for row in uncertain:
+            predicted[row] = decisions["teacher"][1][row]
+        escalated += len(uncertain)
+
+        predicted_spans = token_runs(predicted)
+        actual_spans = token_runs((labels == 1) & valid)
+        true_positives += len(predicted_spans & actual_spans)
+        predicted_count += len(predicted_spans)
+        actual_count += len(actual_spans)
+
+    precision, recall, f1 = precision_recall_f1(true_positives, predicted_count, actual_count)
+    return {"span_precision": precision, "span_recall": recall, "span_f1": f1, "escalation_rate": escalated / max(1, len(dataset))}
+
+
+def report(args):
+    from test_datasets.test_generated_synthetic_data import test_synthetic_data
+    from test_datasets.test_injected_templates import test_injected_templates
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    tokenizer = load_tokenizer(args.teacher)
+    load_pretokenized("test", tokenizer, test_injected_templates, test_synthetic_data, cache_dir=args.cache_dir)
+    cache_path = os.path.join(args.cache_dir, "test")
+    evaluation_args = SimpleNamespace(
+        threads_per_worker=max(1, os.cpu_count() or 1), threshold=args.threshold,
+        batch_size=args.batch_size, latency_samples=args.latency_samples
+    )
+    # one fresh process per model, so each one's resident memory is measured on its own
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1) as pool:
+        teacher, student = [
+            pool.submit(evaluate_checkpoint, path, "torch", cache_path, tokenizer.pad_token_id, evaluation_args).result()
+            for path in (args.teacher, args.output_dir)
+        ]
+    cascade = evaluate_cascade(
+        args.output_dir, args.teacher, cache_path, tokenizer.pad_token_id, args.escalation_confidence, args.threshold, args.batch_size
+    )
+    # an escalated prompt pays for both forward passes
+    cascade["latency_p50_ms"] = student["latency_p50_ms"] + cascade["escalation_rate"] * teacher["latency_p50_ms"]
+    cascade["model_rss_mb"] = student["model_rss_mb"] + teacher["model_rss_mb"]
+
+    rows = [
+        ("teacher", teacher["span_f1"], teacher["token_f1"], teacher["latency_p50_ms"], teacher["latency_p95_ms"], teacher["examples_per_second"], teacher["parameters"], teacher["weights_mb"], teacher["model_rss_mb"], None),
+        ("student", student["span_f1"], student["token_f1"], student["latency_p50_ms"], student["latency_p95_ms"], student["examples_per_second"], student["parameters"], student["weights_mb"], student["model_rss_mb"], None),
+        (f"student + escalation < {args.escalation_confidence}", cascade["span_f1"], None, cascade["latency_p50_ms"], None, None, None, None, cascade["model_rss_mb"], cascade["escalation_rate"]),
+    ]
+
+    def cell(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    lines = [
+        "| model | span F1 | token F1 | p50 ms | p95 ms | examples/s | params M | weights MB | RSS MB | escalated |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for name, span_f1, token_f1, p50, p95, throughput, parameters, weights, rss, rate in rows:
+        lines.append(
+            f"| {name} | {cell(span_f1, '.4f')} | {cell(token_f1, '.4f')} | {cell(p50, '.1f')} | {cell(p95, '.1f')} | "
+            f"{cell(throughput, '.1f')} | {cell(parameters and parameters / 1e6, '.1f')} | {cell(weights, '.0f')} | {cell(rss, '.0f')} | {cell(rate, '.1%')} |"
+        )
+    markdown = "\n".join(lines)
+    with open(os.path.join(args.output_dir, "distillation_report.json"), "w") as fw:
+        json.dump({"teacher": teacher, "student": student, "cascade": {**cascade, "escalation_confidence": args.escalation_confidence}}, fw, indent=2)
+    with open(os.path.join(args.output_dir, "distillation_report.md"), "w") as fw:
+        fw.write(markdown + "\n")
+    print("\n" + markdown)
+    print(f"\nReport written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teacher", default="results/checkpoint-50", help="torch checkpoint of the full model")
+    parser.add_argument("--output-dir", default="results/student")
+    parser.add_argument("--layers", type=int, default=4, help="transformer layers of the student")
+    parser.add_argument("--corpus", default=None, help="glob of generate_corpus.py shards, the train split by default")
+    parser.add_argument("--epochs", type=float, default=3)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--temperature", type=float, default=2.0, help="softmax temperature of the distillation loss")
+    parser.add_argument("--alpha", type=float, default=0.5, help="weight of the distillation loss against the label loss")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--threshold", type=float, default=None, help="overrides the calibrated thresholds in the report")
+    parser.add_argument("--escalation-confidence", type=float, default=0.8, help="student spans below it are decided by the teacher")
+    parser.add_argument("--latency-samples", type=int, default=50)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--report-only", action="store_true", help="skip training and only compare an existing student")
+    args = parser.parse_args()
+    if not args.report_only:
+        train(args)
+    report(args)
@@ -1,59 +1,260 @@
-from transformers import AutoModelForTokenClassification, TrainingArguments, Trainer
-from transformers import AutoTokenizer
-from data_preparation import create_datasets, TrainingTokenDataset
-from test_datasets.test_generated_synthetic_data import test_synthetic_data
-from test_datasets.test_injected_templates import test_injected_templates
-
-def evaluate_checkpoint(checkpoint_path, dataset, tokenizer):
-    print(f"\nEvaluating checkpoint: {checkpoint_path}")
-    model = AutoModelForTokenClassification.from_pretrained(checkpoint_path)
-    model.eval()
-
-    eval_args = TrainingArguments(
-        output_dir="./eval_results",
-        do_train=False,
-        do_eval=True,
-        per_device_eval_batch_size=4,
-        report_to="none"
-    )
+"""
+Evaluates every training checkpoint on the test split and writes a leaderboard.
+
+Checkpoints are discovered under `results/` (every `checkpoint-*` directory), and exported artifacts can
+be added with `--checkpoints`. The backend of each is detected from its files (`model.onnx` for onnx, the
+quantized state dict for int8, torch otherwise). The test split is tokenized once into the memory-mapped
+cache of `pretokenized_dataset.py`, and the checkpoints are evaluated concurrently by a pool of worker
+processes that all map that same cache, each with its share of the CPU threads.
+
+Reported per checkpoint:
+- token-level precision/recall/F1 and the eval loss, with the `app.py` decision rule: the checkpoint's
+  calibration.json if it has one (see `calibrate.py`), the sigmoid of the sensitive logit above 0.5
+  otherwise, and `--threshold` overriding the threshold
+- span-level precision/recall/F1, a span being a run of consecutive sensitive tokens as `app.py` reports
+  them, counted as found only when it matches a labelled span exactly
+- batched throughput (examples/s, batches of `--batch-size` padded to their longest example like the
+  micro-batcher) and the p50/p95 latency of scanning a single prompt, which is what a request pays
+  when the server is not busy
+- memory: parameter count, size of the weight files and the resident memory the loaded model adds to
+  its worker process (every checkpoint is evaluated in a fresh process)
+
+The recommended deployment checkpoint is the fastest one whose span F1 is within `--f1-tolerance` of the
+best, among those within `--latency-budget-ms` if given. The leaderboard is written to
+`leaderboard.json` and `leaderboard.md` in `--output-dir`.
+
+Usage (from the `backend` directory):
+    python model_training/evaluate_checkpoints.py --results-dir results --checkpoints exports/checkpoint-50-int8
+"""
+
+import argparse, glob, json, multiprocessing, os, re, sys, time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inference_backends import load_model, load_tokenizer, rss_mb, ONNX_FILENAME, QUANTIZED_FILENAME
+from calibration import load_calibration, CALIBRATION_FILENAME
+from pretokenized_dataset import load_pretokenized, PreTokenizedDataset, DynamicPaddingCollator, LengthGroupedBatchSampler, CACHE_DIR
+
+
+def checkpoint_step(path):
+    match = re.search(r"(\d+)$", path)
+    return int(match.group(1)) if match else 0
+
+
+def discover_checkpoints(results_dir):
+    """The checkpoint-* directories of a training run, in step order"""
+    paths = [path for path in glob.glob(os.path.join(results_dir, "checkpoint-*")) if os.path.isdir(path)]
+    return sorted(paths, key=checkpoint_step)
+
+
+def detect_backend(path):
+    if os.path.isfile(os.path.join(path, ONNX_FILENAME)):
+        return "onnx"
+    if os.path.isfile(os.path.join(path, QUANTIZED_FILENAME)):
+        return "int8"
+    return "torch"
+
+
+def weight_files(path):
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith((".safetensors", ".bin", ".onnx", ".pt")))
+
+
+def parameter_count(model):
+    """Parameters of a torch backend's model, None for onnx"""
+    module = getattr(model, "model", None)
+    if not isinstance(module, torch.nn.Module):
+        return None
+    # int8 Linear layers keep their packed weights outside of parameters()
+    return sum(value.numel() for value in module.state_dict().values() if isinstance(value, torch.Tensor))
 
-    evaluator = Trainer(
-        model=model,
-        args=eval_args,
-        eval_dataset=dataset,
-        tokenizer=tokenizer
-    )
 
-    metrics = evaluator.evaluate()
-    print(f"Metrics for {checkpoint_path}:")
-    for key, value in metrics.items():
-        print(f"{key}: {value:.4f}")
-    return metrics
-
-def main():
-   
-    tokenizer = AutoTokenizer.from_pretrained(
-        "microsoft/codebert-base",
-        add_prefix_space=True
+def token_runs(mask):
+    """(row, first token, last token) of every run of True values in a (batch, tokens) mask"""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=bool)
+    padded[:, 1:-1] = mask
+    rows, columns = np.nonzero(padded[:, 1:] != padded[:, :-1])
+    # edges come in (rise, fall) pairs per row, a rise at column c starts a run at token c
+    return set(zip(rows[0::2].tolist(), columns[0::2].tolist(), (columns[1::2] - 1).tolist()))
+
+
+def precision_recall_f1(true_positives, predicted, actual):
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / actual if actual else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def evaluate_checkpoint(path, backend, cache_path, pad_token_id, args):
+    """
+    Runs one checkpoint over the cached test split
+
+    Returns:
+        dict: The checkpoint's metrics, latency and throughput
+    """
+    torch.set_num_threads(args.threads_per_worker)
+    rss_before = rss_mb()
+    model = load_model(backend, path, intra_op_threads=args.threads_per_worker)
+    model_rss_mb = rss_mb() - rss_before
+    calibration = load_calibration(os.path.join(path, CALIBRATION_FILENAME))
+    threshold = calibration.threshold if args.threshold is None else args.threshold
+    dataset = PreTokenizedDataset(cache_path)
+    loader = DataLoader(
+        dataset,
+        batch_sampler=LengthGroupedBatchSampler(dataset.lengths, args.batch_size, shuffle=False),
+        collate_fn=DynamicPaddingCollator(pad_token_id)
     )
 
-    test_dataset = create_datasets(tokenizer, test_injected_templates, test_synthetic_data)
-    print(f"Test dataset size: {len(test_dataset)}")
+    counts = {"tokens": 0, "token_tp": 0, "token_predicted": 0, "token_actual": 0, "span_tp": 0, "span_predicted": 0, "span_actual": 0}
+    loss_sum = 0.0
+    seconds = 0.0
+    batch_offset = 0
+    for batch in loader:
+        inputs = {"input_ids": batch["input_ids"], "attention_mask": batch["attention_mask"]}
+        start = time.perf_counter()
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        seconds += time.perf_counter() - start
+
+        labels = batch["labels"].numpy()
+        valid = labels != -100
+        predicted = (calibration.probabilities(logits).numpy() > threshold) & valid
+        actual = (labels == 1) & valid
+        counts["tokens"] += int(valid.sum())
+        counts["token_tp"] += int((predicted & actual).sum())
+        counts["token_predicted"] += int(predicted.sum())
+        counts["token_actual"] += int(actual.sum())
+
+        predicted_spans = {(row + batch_offset, *span) for row, *span in token_runs(predicted)}
+        actual_spans = {(row + batch_offset, *span) for row, *span in token_runs(actual)}
+        counts["span_tp"] += len(predicted_spans & actual_spans)
+        counts["span_predicted"] += len(predicted_spans)
+        counts["span_actual"] += len(actual_spans)
+        batch_offset += len(labels)
+
+        loss_sum += float(torch.nn.functional.cross_entropy(
+            logits.reshape(-1, logits.shape[-1]).float(), batch["labels"].reshape(-1), ignore_index=-100, reduction="sum"
+        ))
+
+    # single-prompt latency, as paid by a request on an idle server
+    latencies = []
+    for idx in range(0, len(dataset), max(1, len(dataset) // args.latency_samples)):
+        item = dataset[idx]
+        inputs = {"input_ids": item["input_ids"][None], "attention_mask": item["attention_mask"][None]}
+        start = time.perf_counter()
+        with torch.no_grad():
+            model(**inputs)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    token_precision, token_recall, token_f1 = precision_recall_f1(counts["token_tp"], counts["token_predicted"], counts["token_actual"])
+    span_precision, span_recall, span_f1 = precision_recall_f1(counts["span_tp"], counts["span_predicted"], counts["span_actual"])
+    return {
+        "checkpoint": path,
+        "backend": backend,
+        "calibration": calibration.version,
+        "threshold": threshold,
+        "eval_loss": loss_sum / max(1, counts["tokens"]),
+        "token_precision": token_precision,
+        "token_recall": token_recall,
+        "token_f1": token_f1,
+        "span_precision": span_precision,
+        "span_recall": span_recall,
+        "span_f1": span_f1,
+        "examples_per_second": len(dataset) / seconds if seconds else 0.0,
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p95_ms": float(np.percentile(latencies, 95)),
+        "parameters": parameter_count(model),
+        "weights_mb": sum(os.path.getsize(name) for name in weight_files(path)) / 2 ** 20,
+        "model_rss_mb": model_rss_mb,
+    }
+
+
+def recommend(results, f1_tolerance, latency_budget_ms=None):
+    """The fastest checkpoint within `f1_tolerance` of the best span F1, among those within the latency budget"""
+    candidates = [result for result in results if latency_budget_ms is None or result["latency_p50_ms"] <= latency_budget_ms]
+    if not candidates:
+        return None
+    best_f1 = max(result["span_f1"] for result in candidates)
+    close = [result for result in candidates if result["span_f1"] >= best_f1 - f1_tolerance]
+    return min(close, key=lambda result: result["latency_p50_ms"])
+
+
+def write_leaderboard(results, recommended, args):
+    os.makedirs(args.output_dir, exist_ok=True)
+    ranked = sorted(results, key=lambda result: (-result["span_f1"], result["latency_p50_ms"]))
+    with open(os.path.join(args.output_dir, "leaderboard.json"), "w") as fw:
+        json.dump({
+            "f1_tolerance": args.f1_tolerance,
+            "latency_budget_ms": args.latency_budget_ms,
+            "recommended": recommended["checkpoint"] if recommended else None,
+            "results": ranked
+        }, fw, indent=2)
+
+    lines = [
+        "| checkpoint | backend | threshold | span P | span R | span F1 | token F1 | eval loss | p50 ms | p95 ms | examples/s | params M | weights MB | RSS MB |",
+        "|---|---|---|---|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for result in ranked:
+        name = result["checkpoint"] + (" **(recommended)**" if result is recommended else "")
+        lines.append(
+            f"| {name} | {result['backend']} | {result['threshold']:.2f} | {result['span_precision']:.4f} | {result['span_recall']:.4f} | "
+            f"{result['span_f1']:.4f} | {result['token_f1']:.4f} | {result['eval_loss']:.4f} | "
+            f"{result['latency_p50_ms']:.1f} | {result['latency_p95_ms']:.1f} | {result['examples_per_second']:.1f} | "
+            f"{result['parameters'] / 1e6 if result['parameters'] else float('nan'):.1f} | {result['weights_mb']:.0f} | {result['model_rss_mb']:.0f} |"
+        )
+    markdown = "\n".join(lines)
+    with open(os.path.join(args.output_dir, "leaderboard.md"), "w") as fw:
+        fw.write(markdown + "\n")
+    return markdown
+
+
+def main(args):
+    from test_datasets.test_generated_synthetic_data import test_synthetic_data
+    from test_datasets.test_injected_templates import test_injected_templates
+
+    checkpoints = discover_checkpoints(args.results_dir) + list(args.checkpoints)
+    if not checkpoints:
+        sys.exit(f"No checkpoints found under {args.results_dir}")
+
+    tokenizer = load_tokenizer(checkpoints[0])
+    test_dataset = load_pretokenized("test", tokenizer, test_injected_templates, test_synthetic_data, cache_dir=args.cache_dir)
+    print(f"Test dataset size: {len(test_dataset)}, evaluating {len(checkpoints)} checkpoints")
 
-    # evaluating both checkpoints with the test dataset
-    model_50_results = evaluate_checkpoint("results/checkpoint-50", test_dataset, tokenizer)
-    model_75_results = evaluate_checkpoint("results/checkpoint-75", test_dataset, tokenizer)
+    workers = args.workers or min(len(checkpoints), os.cpu_count() or 1)
+    args.threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    cache_path = os.path.join(args.cache_dir, "test")
+    # spawning, so no worker inherits the parent's torch thread pools, and one process per checkpoint so its memory is its own
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1) as pool:
+        futures = [
+            pool.submit(evaluate_checkpoint, path, detect_backend(path), cache_path, tokenizer.pad_token_id, args)
+            for path in checkpoints
+        ]
+        results = [future.result() for future in futures]
 
-    
-    if model_50_results['eval_loss'] < model_75_results['eval_loss']:
-        print("\nCheckpoint-50 performs better!")
-        best_checkpoint = "results/checkpoint-50"
+    recommended = recommend(results, args.f1_tolerance, args.latency_budget_ms)
+    print("\n" + write_leaderboard(results, recommended, args))
+    if recommended:
+        print(f"\nRecommended checkpoint: {recommended['checkpoint']} ({recommended['backend']}), "
+              f"span F1 {recommended['span_f1']:.4f}, p50 {recommended['latency_p50_ms']:.1f}ms")
     else:
-        print("\nCheckpoint-75 performs better!")
-        best_checkpoint = "results/checkpoint-75"
+        print(f"\nNo checkpoint scans a prompt within {args.latency_budget_ms}ms")
+    print(f"Leaderboard written to {args.output_dir}")
 
-    print(f"\nBest checkpoint: {best_checkpoint}")
-    print(f"Best eval loss: {min(model_50_results['eval_loss'], model_75_results['eval_loss']):.4f}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results-dir", default="results")
+    parser.add_argument("--checkpoints", nargs="*", default=[], help="extra checkpoints or exported artifacts to evaluate")
+    parser.add_argument("--workers", type=int, default=0, help="checkpoints evaluated at once, 0 for one per checkpoint up to the core count")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--threshold", type=float, default=None, help="overrides the calibrated threshold of every checkpoint")
+    parser.add_argument("--latency-samples", type=int, default=50, help="prompts timed one by one for the latency percentiles")
+    parser.add_argument("--f1-tolerance", type=float, default=0.005, help="span F1 a faster checkpoint may give up")
+    parser.add_argument("--latency-budget-ms", type=float, default=None, help="drop checkpoints slower than this per prompt")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--output-dir", default="eval_results")
+    main(parser.parse_args())
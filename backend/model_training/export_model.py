@@ -0,0 +1,198 @@
+"""
+Exports a training checkpoint to an optimized CPU artifact for the scanning service.
+
+Three targets are supported:
+- `torch`: the fp32 weights as memory-mappable safetensors, for a fast, fully local startup
+- `int8`: torch dynamic int8 quantization of the Linear layers, saved as a state dict next to the model config
+- `onnx`: an ONNX graph with dynamic batch and sequence axes, run by ONNX Runtime with all graph optimizations
+
+Every target also stores the tokenizer files next to the model, so the server loads it without network
+access or a hub cache, and copies the checkpoint's calibration.json if it has one.
+
+After exporting, the artifact is loaded through the same `inference_backends.load_model` the server uses
+and compared against the fp32 checkpoint on the `test_datasets` split. The token-level predictions
+(sigmoid of the sensitive logit above the threshold, as in `app.py`) must agree on all but `tolerance`
+of the tokens, otherwise the export is deleted and the script exits with an error. Latency, memory and
+token-level F1 of both backends are printed and written to `export_report.json` in the artifact.
+
+The artifact is written to a temporary directory next to `output_dir` and only renamed into place once
+accepted, so a rejected or failed export never touches anything else. An existing non-empty
+`output_dir` is refused rather than overwritten.
+
+Usage (from the `backend` directory):
+    python model_training/export_model.py results/checkpoint-50 exports/checkpoint-50-int8 --backend int8
+    SCAN_MODEL_BACKEND=int8 SCAN_MODEL_PATH=exports/checkpoint-50-int8 python app.py
+
+    python model_training/export_model.py results/checkpoint-50 exports/checkpoint-50-local --backend torch
+    SCAN_MODEL_PATH=exports/checkpoint-50-local python app.py
+"""
+
+import argparse, json, os, shutil, sys, time
+
+import torch
+from torch.utils.data import DataLoader
+from transformers import AutoModelForTokenClassification, AutoTokenizer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from calibration import CALIBRATION_FILENAME
+from inference_backends import load_model, quantize_dynamic_int8, rss_mb, ONNX_FILENAME, QUANTIZED_FILENAME, TOKENIZER_NAME
+from data_preparation import create_datasets
+from test_datasets.test_generated_synthetic_data import test_synthetic_data
+from test_datasets.test_injected_templates import test_injected_templates
+
+
+def export_torch(checkpoint_path, output_dir):
+    model = AutoModelForTokenClassification.from_pretrained(checkpoint_path)
+    model.save_pretrained(output_dir, safe_serialization=True)
+
+
+def export_int8(checkpoint_path, output_dir):
+    model = AutoModelForTokenClassification.from_pretrained(checkpoint_path)
+    model.eval()
+    quantized = quantize_dynamic_int8(model)
+    model.config.save_pretrained(output_dir)
+    torch.save(quantized.state_dict(), os.path.join(output_dir, QUANTIZED_FILENAME))
+
+
+def export_onnx(checkpoint_path, output_dir, tokenizer, opset):
+    model = AutoModelForTokenClassification.from_pretrained(checkpoint_path)
+    model.eval()
+    model.config.return_dict = False
+    sample = tokenizer(["def f(): return 1", "api_key = 'abc'"], return_tensors="pt", padding=True)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask", "logits")}
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"]),
+        os.path.join(output_dir, ONNX_FILENAME),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset
+    )
+    model.config.save_pretrained(output_dir)
+
+
+def evaluate_backend(model, dataset, batch_size, threshold):
+    """
+    Runs a backend over the dataset
+
+    Returns:
+        tuple: Sensitive-class probabilities of the labelled tokens, their labels and the seconds spent in forward passes
+    """
+    probs, labels = [], []
+    seconds = 0.0
+    for batch in DataLoader(dataset, batch_size=batch_size):
+        inputs = {"input_ids": batch["input_ids"], "attention_mask": batch["attention_mask"]}
+        start = time.perf_counter()
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        seconds += time.perf_counter() - start
+        mask = batch["labels"] != -100
+        probs.append(torch.sigmoid(logits)[:, :, 1][mask])
+        labels.append(batch["labels"][mask])
+    return torch.cat(probs), torch.cat(labels), seconds
+
+
+def token_f1(predictions, labels):
+    true_positives = int(((predictions == 1) & (labels == 1)).sum())
+    predicted = int((predictions == 1).sum())
+    actual = int((labels == 1).sum())
+    precision = true_positives / predicted if predicted else 0.0
+    recall = true_positives / actual if actual else 0.0
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+
+def measure(backend, path, dataset, args):
+    before = rss_mb()
+    start = time.perf_counter()
+    model = load_model(backend, path)
+    load_seconds = time.perf_counter() - start
+    loaded = rss_mb()
+
+    probs, labels, seconds = evaluate_backend(model, dataset, args.batch_size, args.threshold)
+    predictions = (probs > args.threshold).long()
+    return {
+        "backend": backend,
+        "load_seconds": load_seconds,
+        "rss_delta_mb": loaded - before,
+        "latency_ms_per_example": seconds * 1000 / len(dataset),
+        "examples_per_second": len(dataset) / seconds if seconds else 0.0,
+        "token_f1": token_f1(predictions, labels),
+    }, probs, predictions
+
+
+def main(args):
+    if os.path.isdir(args.output_dir) and os.listdir(args.output_dir):
+        sys.exit(f"{args.output_dir} exists and isn't empty, export to a new directory")
+    output_dir = os.path.normpath(args.output_dir)
+    temporary = f"{output_dir}.tmp-{os.getpid()}"
+    os.makedirs(temporary)
+    try:
+        export(args, temporary)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    if os.path.isdir(output_dir):
+        os.rmdir(output_dir)
+    os.replace(temporary, output_dir)
+    print(f"Export accepted, written to {output_dir}")
+
+
+def export(args, output_dir):
+    """Exports and verifies the artifact in `output_dir`, exits with an error if it is rejected"""
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME, add_prefix_space=True)
+
+    print(f"Exporting {args.checkpoint} to {args.output_dir} ({args.backend})")
+    if args.backend == "torch":
+        export_torch(args.checkpoint, output_dir)
+    elif args.backend == "int8":
+        export_int8(args.checkpoint, output_dir)
+    else:
+        export_onnx(args.checkpoint, output_dir, tokenizer, args.opset)
+    tokenizer.save_pretrained(output_dir)
+    # keeping the checkpoint's calibrated temperature and threshold with the artifact
+    if os.path.isfile(os.path.join(args.checkpoint, CALIBRATION_FILENAME)):
+        shutil.copy(os.path.join(args.checkpoint, CALIBRATION_FILENAME), output_dir)
+
+    test_dataset = create_datasets(tokenizer, test_injected_templates, test_synthetic_data)
+
+    reference, reference_probs, reference_predictions = measure("torch", args.checkpoint, test_dataset, args)
+    exported, exported_probs, exported_predictions = measure(args.backend, output_dir, test_dataset, args)
+
+    disagreement = float((reference_predictions != exported_predictions).float().mean())
+    max_prob_diff = float((reference_probs - exported_probs).abs().max())
+    report = {
+        "checkpoint": args.checkpoint,
+        "backend": args.backend,
+        "threshold": args.threshold,
+        "tolerance": args.tolerance,
+        "token_disagreement": disagreement,
+        "max_probability_difference": max_prob_diff,
+        "results": [reference, exported],
+    }
+
+    print(f"\n{'backend':8} {'load s':>8} {'rss MB':>8} {'ms/example':>11} {'examples/s':>11} {'token F1':>9}")
+    for result in report["results"]:
+        print(f"{result['backend']:8} {result['load_seconds']:8.2f} {result['rss_delta_mb']:8.1f} "
+              f"{result['latency_ms_per_example']:11.2f} {result['examples_per_second']:11.1f} {result['token_f1']:9.4f}")
+    print(f"\nToken disagreement: {disagreement:.5f} (tolerance {args.tolerance}), max probability difference: {max_prob_diff:.5f}")
+
+    if disagreement > args.tolerance:
+        sys.exit(f"Export rejected: predictions disagree with the fp32 model on {disagreement:.2%} of tokens")
+
+    with open(os.path.join(output_dir, "export_report.json"), "w") as fw:
+        json.dump(report, fw, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("checkpoint", help="training checkpoint directory, e.g. results/checkpoint-50")
+    parser.add_argument("output_dir", help="directory the artifact is written to")
+    parser.add_argument("--backend", choices=("torch", "int8", "onnx"), default="int8")
+    parser.add_argument("--tolerance", type=float, default=0.001,
+                        help="maximum share of test tokens whose prediction may differ from the fp32 model")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--opset", type=int, default=14)
+    main(parser.parse_args())
@@ -0,0 +1,146 @@
+"""
+Generates large synthetic corpora in parallel and streams them to sharded files.
+
+Unlike `inject_synthetic_to_templates_script.py`, which keeps every sample in memory and writes the
+splits as Python literals, this script writes shards of `--shard-size` samples, one sample per record:
+
+    {"template": "python", "text": "...", "spans": [{"category": "API_KEY", "start": 120, "end": 152}, ...]}
+
+`spans` holds the character offsets of every injected value, so nothing has to be searched for again.
+Shards are generated by a pool of worker processes. Every shard draws from its own generator seeded with
+`--seed` and the shard number, so a corpus is identical whatever the number of workers, and a shard that
+already exists is skipped, so an interrupted run can simply be started again.
+
+Shards are JSONL by default, or Parquet with `--format parquet` (requires pyarrow). They are read back
+lazily, one shard at a time, with `data_preparation.iter_shards`.
+
+Usage (from the `backend` directory):
+    python model_training/generate_corpus.py --split train --samples 100000 --workers 8
+"""
+
+import argparse, importlib, json, os, string, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_sample_data_generator import SyntheticDataGenerator
+
+SPLIT_TEMPLATES = {
+    "train": ("training_datasets.language_templates", "templates"),
+    "eval": ("evaluation_datasets.eval_templates", "eval_templates"),
+    "test": ("test_datasets.test_templates", "test_templates"),
+}
+
+CATEGORIES = ("API_KEY", "PASSWORD", "TOKEN", "SECRET_KEY")
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def load_templates(split):
+    module_name, attribute = SPLIT_TEMPLATES[split]
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def inject(template, values):
+    """
+    Formats a template like `str.format` and records where each value landed
+
+    Returns:
+        tuple: The injected text and a list of {category, start, end} spans
+    """
+    parts, spans = [], []
+    length = 0
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(literal)
+        length += len(literal)
+        if field is not None:
+            value = values[field]
+            spans.append({"category": field, "start": length, "end": length + len(value)})
+            parts.append(value)
+            length += len(value)
+    return "".join(parts), spans
+
+
+def generate_sample(generator, templates, languages):
+    language = generator.random.choice(languages)
+    values = {
+        "API_KEY": generator.generate_api_key(),
+        "PASSWORD": generator.generate_password(),
+        "TOKEN": generator.generate_jwt_like(),
+        "SECRET_KEY": generator.generate_base64_key(),
+    }
+    text, spans = inject(templates[language], values)
+    return {"template": language, "text": text, "spans": spans}
+
+
+def shard_path(output_dir, split, shard, file_format):
+    return os.path.join(output_dir, f"{split}-{shard:05d}.{file_format}")
+
+
+def write_shard(path, records, file_format):
+    # writing next to the shard and renaming, so a shard on disk is always complete
+    temporary = f"{path}.tmp"
+    if file_format == "jsonl":
+        with open(temporary, "w", encoding="utf-8") as fw:
+            for record in records:
+                fw.write(json.dumps(record) + "\n")
+    else:
+        try:
+            import pyarrow, pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet shards require pyarrow, install it with `pip install pyarrow`")
+        pyarrow.parquet.write_table(pyarrow.Table.from_pylist(list(records)), temporary)
+    os.replace(temporary, path)
+
+
+def generate_shard(split, shard, size, seed, templates, output_dir, file_format):
+    generator = SyntheticDataGenerator(seed=seed * 1_000_003 + shard)
+    languages = sorted(templates)
+    records = (generate_sample(generator, templates, languages) for _ in range(size))
+    write_shard(shard_path(output_dir, split, shard, file_format), records, file_format)
+    return size
+
+
+def main(args):
+    templates = load_templates(args.split)
+    output_dir = os.path.join(args.output_dir, args.split)
+    os.makedirs(output_dir, exist_ok=True)
+
+    num_shards = -(-args.samples // args.shard_size)
+    pending = []
+    for shard in range(num_shards):
+        size = min(args.shard_size, args.samples - shard * args.shard_size)
+        if not os.path.exists(shard_path(output_dir, args.split, shard, args.format)):
+            pending.append((shard, size))
+    if len(pending) < num_shards:
+        print(f"{num_shards - len(pending)} of {num_shards} shards already exist, skipping them")
+
+    start = time.perf_counter()
+    generated = 0
+    with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count()) as pool:
+        futures = [
+            pool.submit(generate_shard, args.split, shard, size, args.seed, templates, output_dir, args.format)
+            for shard, size in pending
+        ]
+        for future in as_completed(futures):
+            generated += future.result()
+            elapsed = time.perf_counter() - start
+            print(f"{generated}/{sum(size for _, size in pending)} samples, {generated / elapsed:.0f} samples/s")
+
+    elapsed = time.perf_counter() - start
+    if generated:
+        print(f"Generated {generated} samples in {len(pending)} shards in {elapsed:.1f}s "
+              f"({generated / elapsed:.0f} samples/s) to {output_dir}")
+    return generated, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--split", choices=sorted(SPLIT_TEMPLATES), default="train")
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--shard-size", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=0, help="generator processes, 0 for one per core")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--output-dir", default=CORPUS_DIR)
+    main(parser.parse_args())
@@ -36,8 +36,7 @@ for i in range(num_prompts):
     language = random.choice(list(templates.keys()))
     template = templates[language]
 
-    synthetic_api_keys = synthetic_generator.run_all_api_methods()
-    synthetic_api_key = random.choice(synthetic_api_keys)
+    synthetic_api_key = synthetic_generator.generate_api_key()
     synthetic_password = synthetic_generator.generate_password()
     synthetic_token = synthetic_generator.generate_jwt_like()
     synthetic_secret_key = synthetic_generator.generate_base64_key()
@@ -65,8 +64,7 @@ for i in range(eval_data_num_prompts):
     eval_language = random.choice(list(eval_templates.keys()))
     eval_template = eval_templates[eval_language]
 
-    eval_api_keys = synthetic_generator.run_all_api_methods()
-    random_eval_api_key = random.choice(eval_api_keys)
+    random_eval_api_key = synthetic_generator.generate_api_key()
     eval_password = synthetic_generator.generate_password()
     eval_token = synthetic_generator.generate_jwt_like()
     eval_secret_key = synthetic_generator.generate_base64_key()
@@ -95,8 +93,7 @@ for i in range(test_data_num_prompts):
     test_language = random.choice(list(test_templates.keys()))
     test_template = test_templates[test_language]
 
-    test_api_keys = synthetic_generator.run_all_api_methods()
-    random_test_api_key = random.choice(test_api_keys)
+    random_test_api_key = synthetic_generator.generate_api_key()
     test_password = synthetic_generator.generate_password()
     test_token = synthetic_generator.generate_jwt_like()
     test_secret_key = synthetic_generator.generate_base64_key()
@@ -0,0 +1,312 @@
+"""
+Pre-tokenized, dynamically padded datasets for training and evaluation
+
+`TrainingTokenDataset` pads every example to 512 tokens, while most templates are a fraction of that, so
+most of the compute of a padded batch goes to pad tokens. This module tokenizes and labels a split
+once, strips the padding and caches the examples back to back in memory-mapped NumPy arrays:
+
+- `input_ids.npy` (int32) and `labels.npy` (int8) hold all examples concatenated
+- `offsets.npy` (int64) holds where each example starts, so example i is `[offsets[i], offsets[i + 1])`
+- `meta.json` holds a fingerprint of the tokenizer, max length and data, so a changed split is re-tokenized
+
+Sharded corpora written by `generate_corpus.py` are cached shard by shard (`load_pretokenized_shards`):
+one shard's text is held while it is tokenized, and the training set is the concatenation of the
+memory-mapped shard caches, so neither the raw corpus nor padded examples are ever held at once. A
+shard is only re-tokenized when its file or the tokenizer changed, shards being written once.
+
+Batches are padded to their longest example by `DynamicPaddingCollator`, and `LengthGroupedBatchSampler`
+puts examples of similar length in the same batch, so little padding is left.
+
+Example Usage:
+    train_dataset = load_pretokenized("train", tokenizer, injected_templates, synthetic_data)
+    corpus_dataset = load_pretokenized_shards(tokenizer, "model_training/corpus/train/*.jsonl")
+    loader = DataLoader(
+        train_dataset,
+        batch_sampler=LengthGroupedBatchSampler(train_dataset.lengths, batch_size=4),
+        collate_fn=DynamicPaddingCollator(tokenizer.pad_token_id)
+    )
+"""
+
+import hashlib, json, os, shutil, time
+
+import numpy as np
+import torch
+from torch.utils.data import ConcatDataset, Dataset
+from transformers import Trainer
+
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "token_cache")
+
+
+def dataset_fingerprint(tokenizer, injected_templates, synthetic_data, max_length):
+    """Hash of everything the cached tokens depend on"""
+    digest = hashlib.sha256()
+    digest.update(f"{CACHE_VERSION}|{tokenizer.name_or_path}|{len(tokenizer)}|{max_length}".encode("utf-8"))
+    for template, items in zip(injected_templates, synthetic_data):
+        digest.update(b"\0" + template.encode("utf-8") + b"\0" + repr(items).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def shard_fingerprint(tokenizer, path, max_length):
+    """Hash of the tokenizer, max length and shard file, whose size and modification time change when it is rewritten"""
+    stat = os.stat(path)
+    return hashlib.sha256(
+        f"{CACHE_VERSION}|{tokenizer.name_or_path}|{len(tokenizer)}|{max_length}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")
+    ).hexdigest()
+
+
+def tokenize_examples(tokenizer, injected_templates, synthetic_data, max_length=512, chunk_size=1024):
+    """
+    Tokenizes and labels templates without padding
+
+    Returns:
+        list: (input_ids, labels) NumPy arrays of every template, as `write_cache` takes them
+    """
+    from data_preparation import align_labels, find_occurrences, punctuation_token_ids
+
+    special_ids = np.array([tokenizer.cls_token_id, tokenizer.sep_token_id, tokenizer.pad_token_id], dtype=np.int64)
+    punctuation_ids = punctuation_token_ids(tokenizer)
+    examples = []
+    for chunk_start in range(0, len(injected_templates), chunk_size):
+        templates = list(injected_templates[chunk_start:chunk_start + chunk_size])
+        encodings = tokenizer(templates, truncation=True, max_length=max_length, return_offsets_mapping=True)
+        for row, template in enumerate(templates):
+            try:
+                input_ids = np.array(encodings['input_ids'][row], dtype=np.int64)
+                offsets = np.array(encodings['offset_mapping'][row], dtype=np.int64).reshape(-1, 2)
+                occurrences = find_occurrences(template, synthetic_data[chunk_start + row])
+                labels = align_labels(input_ids, offsets, occurrences, special_ids, punctuation_ids)
+            except Exception as e:
+                print(f"Error processing template {chunk_start + row}: {e}")
+                continue
+            examples.append((input_ids, labels))
+    return examples
+
+
+def write_cache(path, examples, fingerprint):
+    """
+    Writes (input_ids, labels) examples to a cache directory
+
+    The arrays are written to a temporary directory that is renamed into place, so an interrupted
+    build never leaves a half-written cache behind.
+    """
+    lengths = np.array([len(input_ids) for input_ids, _ in examples], dtype=np.int64)
+    offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    input_ids = np.empty(offsets[-1], dtype=np.int32)
+    labels = np.empty(offsets[-1], dtype=np.int8)
+    for i, (example_ids, example_labels) in enumerate(examples):
+        input_ids[offsets[i]:offsets[i + 1]] = example_ids
+        labels[offsets[i]:offsets[i + 1]] = example_labels
+
+    temporary = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(temporary, exist_ok=True)
+    np.save(os.path.join(temporary, "input_ids.npy"), input_ids)
+    np.save(os.path.join(temporary, "labels.npy"), labels)
+    np.save(os.path.join(temporary, "offsets.npy"), offsets)
+    with open(os.path.join(temporary, "meta.json"), "w") as fw:
+        json.dump({"fingerprint": fingerprint, "examples": len(examples), "tokens": int(offsets[-1])}, fw)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(temporary, path)
+
+
+def read_fingerprint(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as fr:
+            return json.load(fr)["fingerprint"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class PreTokenizedDataset(Dataset):
+    def __init__(self, path):
+        """
+        Args:
+            path (str): A cache directory written by `write_cache`
+        """
+        self.input_ids = np.load(os.path.join(path, "input_ids.npy"), mmap_mode="r")
+        self.labels = np.load(os.path.join(path, "labels.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.lengths = np.diff(self.offsets)
+
+    def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        input_ids = torch.from_numpy(self.input_ids[start:end].astype(np.int64))
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "labels": torch.from_numpy(self.labels[start:end].astype(np.int64))
+        }
+
+    def __len__(self):
+        return len(self.lengths)
+
+
+def load_pretokenized(name, tokenizer, injected_templates, synthetic_data, max_length=512, cache_dir=CACHE_DIR):
+    """
+    Loads a cached split, tokenizing and labelling it first if it isn't cached or has changed
+
+    Args:
+        name (str): Name of the split, e.g. "train", used as the cache directory name
+        tokenizer: The tokenizer the model was trained with
+        injected_templates (list): Templates with the synthetic data injected
+        synthetic_data (list): The sensitive strings of each template
+        max_length (int): Examples are truncated to this many tokens
+        cache_dir (str): Directory holding the caches of all splits
+    Returns:
+        PreTokenizedDataset: The split without padding
+    """
+    path = os.path.join(cache_dir, name)
+    fingerprint = dataset_fingerprint(tokenizer, injected_templates, synthetic_data, max_length)
+    if read_fingerprint(path) != fingerprint:
+        start = time.perf_counter()
+        examples = tokenize_examples(tokenizer, injected_templates, synthetic_data, max_length)
+        write_cache(path, examples, fingerprint)
+        print(f"Tokenized {name} split ({len(examples)} examples) in {time.perf_counter() - start:.2f}s, cached to {path}")
+    return PreTokenizedDataset(path)
+
+
+class ShardedPreTokenizedDataset(ConcatDataset):
+    """The shard caches of a corpus read as one dataset, with the `lengths` of all examples for length grouping"""
+
+    def __init__(self, shards):
+        super().__init__(shards)
+        self.lengths = np.concatenate([shard.lengths for shard in shards])
+
+
+def load_pretokenized_shards(tokenizer, pattern, name=None, max_length=512, cache_dir=CACHE_DIR):
+    """
+    Loads every shard of a generated corpus from its cache, tokenizing and labelling the new or changed shards
+
+    Args:
+        tokenizer: The tokenizer the model was trained with
+        pattern (str): Glob of the shards, e.g. `model_training/corpus/train/*.jsonl`
+        name (str): Cache directory of the corpus, derived from `pattern` by default
+        max_length (int): Examples are truncated to this many tokens
+        cache_dir (str): Directory holding the caches of all splits
+    Returns:
+        ShardedPreTokenizedDataset: All shards without padding, in the order of their file names
+    """
+    from data_preparation import read_shard, shard_paths
+
+    name = name or "corpus-" + hashlib.sha256(pattern.encode("utf-8")).hexdigest()[:8]
+    shards = []
+    for shard in shard_paths(pattern):
+        path = os.path.join(cache_dir, name, os.path.splitext(os.path.basename(shard))[0])
+        fingerprint = shard_fingerprint(tokenizer, shard, max_length)
+        if read_fingerprint(path) != fingerprint:
+            start = time.perf_counter()
+            # only this shard's text is in memory while it is tokenized
+            templates, synthetic_data = read_shard(shard)
+            examples = tokenize_examples(tokenizer, templates, synthetic_data, max_length)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_cache(path, examples, fingerprint)
+            print(f"Tokenized {shard} ({len(examples)} examples) in {time.perf_counter() - start:.2f}s, cached to {path}")
+        shards.append(PreTokenizedDataset(path))
+    return ShardedPreTokenizedDataset(shards)
+
+
+class DynamicPaddingCollator:
+    def __init__(self, pad_token_id, pad_to_multiple_of=8):
+        """
+        Args:
+            pad_token_id (int): Token id used for padding input_ids
+            pad_to_multiple_of (int): Rounds the batch length up, which suits the CPU matmul kernels better
+        """
+        self.pad_token_id = pad_token_id
+        self.pad_to_multiple_of = pad_to_multiple_of
+
+    def __call__(self, features):
+        length = max(len(feature["input_ids"]) for feature in features)
+        if self.pad_to_multiple_of:
+            length = -(-length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+
+        batch = {
+            "input_ids": torch.full((len(features), length), self.pad_token_id, dtype=torch.long),
+            "attention_mask": torch.zeros((len(features), length), dtype=torch.long),
+            "labels": torch.full((len(features), length), -100, dtype=torch.long)
+        }
+        for row, feature in enumerate(features):
+            size = len(feature["input_ids"])
+            batch["input_ids"][row, :size] = feature["input_ids"]
+            batch["attention_mask"][row, :size] = feature["attention_mask"]
+            batch["labels"][row, :size] = feature["labels"]
+        return batch
+
+
+class LengthGroupedBatchSampler:
+    def __init__(self, lengths, batch_size, shuffle=True, seed=0, group_size=50):
+        """
+        Batches examples of similar length together
+
+        With shuffling, the examples are shuffled, cut into groups of `group_size` batches, sorted by
+        length within a group and batched, and the batches are shuffled again. Every epoch draws a new
+        order from `seed`, so runs are reproducible.
+
+        Args:
+            lengths (list): Number of tokens of each example
+            batch_size (int): Examples per batch
+            shuffle (bool): Without shuffling the examples are simply sorted by length, e.g. for evaluation
+            seed (int): Seed of the shuffles
+            group_size (int): Batches sorted together, larger groups pad less but are less random
+        """
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.group_size = group_size
+        self.epoch = 0
+
+    def __iter__(self):
+        if not self.shuffle:
+            order = np.argsort(-self.lengths, kind="stable")
+            yield from (order[i:i + self.batch_size].tolist() for i in range(0, len(order), self.batch_size))
+            return
+
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        order = rng.permutation(len(self.lengths))
+        group = self.batch_size * self.group_size
+        batches = []
+        for i in range(0, len(order), group):
+            members = order[i:i + group]
+            members = members[np.argsort(-self.lengths[members], kind="stable")]
+            batches.extend(members[j:j + self.batch_size].tolist() for j in range(0, len(members), self.batch_size))
+        for i in rng.permutation(len(batches)):
+            yield batches[i]
+
+    def __len__(self):
+        return -(-len(self.lengths) // self.batch_size)
+
+
+class LengthGroupedTrainer(Trainer):
+    """Trainer drawing its training and evaluation batches from a `LengthGroupedBatchSampler` over a `PreTokenizedDataset`"""
+
+    def _length_grouped_loader(self, dataset, batch_size, shuffle):
+        workers = self.args.dataloader_num_workers
+        return self.accelerator.prepare(torch.utils.data.DataLoader(
+            dataset,
+            batch_sampler=LengthGroupedBatchSampler(dataset.lengths, batch_size, shuffle=shuffle, seed=self.args.seed),
+            collate_fn=self.data_collator,
+            num_workers=workers,
+            # workers stay alive between epochs and evaluations instead of being forked again
+            persistent_workers=workers > 0 and self.args.dataloader_persistent_workers,
+            prefetch_factor=self.args.dataloader_prefetch_factor if workers > 0 else None
+        ))
+
+    def get_train_dataloader(self):
+        return self._length_grouped_loader(self.train_dataset, self.args.per_device_train_batch_size, shuffle=True)
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        dataset = self.eval_dataset if eval_dataset is None else eval_dataset
+        if isinstance(dataset, str):
+            dataset = self.eval_dataset[dataset]
+        # sorted by length, predictions and labels are gathered batch by batch so their order doesn't matter
+        if not (self.args.dataloader_num_workers > 0 and self.args.dataloader_persistent_workers):
+            return self._length_grouped_loader(dataset, self.args.per_device_eval_batch_size, shuffle=False)
+        # a new loader per evaluation would fork its persistent workers again every time
+        loaders = self.__dict__.setdefault("_length_grouped_eval_loaders", {})
+        if id(dataset) not in loaders:
+            loaders[id(dataset)] = (dataset, self._length_grouped_loader(dataset, self.args.per_device_eval_batch_size, shuffle=False))
+        return loaders[id(dataset)][1]
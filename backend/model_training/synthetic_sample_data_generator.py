@@ -19,21 +19,29 @@ Methods:
 7. `generate_custom_key()`: Generates a custom key with a specific format.
 8. `generate_password()`: Generates a random password using the Faker library.
 9. `run_all_api_methods()`: Runs all the API key generation methods and returns a list of generated keys.
+10. `generate_api_key()`: Generates one API key with a randomly chosen method.
+
+All randomness comes from the generator's own `random.Random` and Faker instance, so a generator created
+with a `seed` produces the same samples on every run.
 
 Example Usage:
-    generator = SyntheticDataGenerator()
+    generator = SyntheticDataGenerator(seed=42)
     uuid = generator.generate_api_key_UUID()
     hex_string = generator.generate_api_key_hex(16)
     base64_string = generator.generate_base64_key(24)
 """
 
 from faker import Faker
-import random, base64, uuid, secrets
+import random, base64, uuid
 import string, datetime, json
 
 class SyntheticDataGenerator:
-    def __init__(self):
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.random = random.Random(seed)
         self.faker = Faker()
+        if seed is not None:
+            self.faker.seed_instance(seed)
         self.prefixes = [
             #AWS related prefixes
             "AKIA",
@@ -68,29 +76,35 @@ class SyntheticDataGenerator:
         ]
     
     def generate_api_key_UUID(self):
-        return str(uuid.uuid4())
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
     
     def generate_base64_key(self, length=32):
-        random_bytes = random.getrandbits(length * 8).to_bytes(length, byteorder="big")
+        random_bytes = self.random.getrandbits(length * 8).to_bytes(length, byteorder="big")
         return base64.urlsafe_b64encode(random_bytes).decode('utf-8').rstrip("=")
     
     def generate_api_key_hex(self, length=32):
-        return ''.join(random.choices('0123456789abcdef', k=length))
+        return ''.join(self.random.choices('0123456789abcdef', k=length))
     
     def generate_api_key_short(self, length=16):
-        return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+        return ''.join(self.random.choices(string.ascii_letters + string.digits, k=length))
     
     def generate_prefixed_key(self, prefix):
-        suffix_length = random.randrange(16,128)
-        suffix = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(suffix_length))
+        suffix_length = self.random.randrange(16,128)
+        suffix = ''.join(self.random.choices(string.ascii_letters + string.digits, k=suffix_length))
         return f"{prefix}{suffix}"
     
+    def issued_at(self):
+        # a seeded generator can't depend on the clock
+        if self.seed is None:
+            return int(datetime.datetime.now().timestamp())
+        return self.random.randrange(1_600_000_000, 1_800_000_000)
+
     def generate_jwt_like(self):
         random_name = self.faker.name()
         random_payload = {
-            "sub": "".join(random.choices(string.digits, k=10)),
+            "sub": "".join(self.random.choices(string.digits, k=10)),
             "name": random_name,
-            "iat": int(datetime.datetime.now().timestamp())
+            "iat": self.issued_at()
         }
         header = base64.urlsafe_b64encode(b'{"alg":"RS256","typ":"JWT"}').decode("utf-8").rstrip("=")
         payload = base64.urlsafe_b64encode(json.dumps(random_payload).encode()).decode("utf-8").rstrip("=")
@@ -100,7 +114,7 @@ class SyntheticDataGenerator:
     def generate_custom_key(self):
         segments = []
         for _ in range(4):
-            segment = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+            segment = ''.join(self.random.choices(string.ascii_letters + string.digits, k=8))
             segments.append(segment)
             return '-'.join(segments)
     
@@ -108,7 +122,7 @@ class SyntheticDataGenerator:
         return self.faker.password()
 
     def run_all_api_methods(self):
-        random_prefix = random.choice(self.prefixes)
+        random_prefix = self.random.choice(self.prefixes)
         api_keys = [
             self.generate_api_key_UUID(),
             self.generate_api_key_hex(),
@@ -119,6 +133,17 @@ class SyntheticDataGenerator:
         ]
         return api_keys
 
+    def generate_api_key(self):
+        generators = [
+            self.generate_api_key_UUID,
+            self.generate_api_key_hex,
+            self.generate_api_key_short,
+            lambda: self.generate_prefixed_key(self.random.choice(self.prefixes)),
+            self.generate_base64_key,
+            self.generate_custom_key
+        ]
+        return self.random.choice(generators)()
+
 
 
 
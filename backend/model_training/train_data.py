@@ -2,44 +2,219 @@
 This script is used to train a model to identify sensitive information in text data.
 It uses the Hugging Face Transformers library to load a pre-trained model and tokenizer,
 and fine-tunes the model on a dataset of synthetic data and templates.
-The `create_datasets` function generates the training and evaluation datasets for the model.
+The training and evaluation splits are tokenized once and cached without padding (`pretokenized_dataset.py`),
+batches are padded to their longest example and grouped by length. With `--train-corpus`/`--eval-corpus`
+the splits are corpora written by `generate_corpus.py` instead, cached shard by shard and read memory-mapped.
 The `main` function loads the model and tokenizer, creates the datasets, and trains the model.
 
+With `--cpu` the run is set up for machines without a GPU:
+- bf16 autocast when the CPU has native bf16 instructions (AVX512-BF16 or AMX), fp32 otherwise (`--bf16`)
+- data loading in worker processes that live across epochs (`--dataloader-workers`)
+- gradient accumulation for a larger effective batch at the memory of a small one (`--gradient-accumulation-steps`)
+- optionally `torch.compile` (`--compile`), which pays off on long runs, batches of new lengths recompile at first
+
+Every run evaluates span-level F1 on the eval split (every epoch, or every `--eval-steps` steps),
+keeps the best checkpoint and stops once F1 hasn't improved for `--early-stopping-patience`
+evaluations, `--epochs` being the upper bound. The time and training samples/sec of every epoch are
+printed and appended to `epoch_stats.jsonl`, and a `training_summary.json` is written to the output
+directory, so runs can be compared.
+
+Usage (from the `backend` directory):
+    python model_training/train_data.py --cpu --batch-size 8 --gradient-accumulation-steps 4 --epochs 10
 """
 
-from transformers import AutoModelForTokenClassification, TrainingArguments, Trainer
+import argparse, json, os, sys, time
+
+import torch
+from transformers import AutoModelForTokenClassification, TrainingArguments, TrainerCallback, EarlyStoppingCallback
 from transformers import AutoTokenizer
-from data_preparation import create_datasets
 
-def main():
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pretokenized_dataset import load_pretokenized, load_pretokenized_shards, DynamicPaddingCollator, LengthGroupedTrainer
+from evaluate_checkpoints import token_runs, precision_recall_f1
+from training_datasets.generated_synthetic_data import synthetic_data
+from training_datasets.injected_templates import injected_templates
+from evaluation_datasets.eval_generated_synthetic_data import Eval_synthetic_data
+from evaluation_datasets.eval_injected_templates import Eval_injected_templates
+
+
+def cpu_supports_bf16():
+    """True when the CPU computes bf16 natively, elsewhere bf16 autocast is emulated and slower than fp32"""
+    for check in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        try:
+            if getattr(torch.cpu, check)():
+                return True
+        except (AttributeError, RuntimeError):
+            continue
+    return False
+
+
+def predicted_classes(logits, labels):
+    # only the argmax is kept across evaluation batches instead of every logit
+    return logits.argmax(dim=-1)
+
+
+def span_metrics(eval_prediction):
+    """Token and span-level precision, recall and F1 of the sensitive class, a span counting only if it matches exactly"""
+    labels = eval_prediction.label_ids
+    valid = labels != -100
+    predicted = (eval_prediction.predictions == 1) & valid
+    actual = (labels == 1) & valid
+    predicted_spans = token_runs(predicted)
+    actual_spans = token_runs(actual)
+    span_precision, span_recall, span_f1 = precision_recall_f1(
+        len(predicted_spans & actual_spans), len(predicted_spans), len(actual_spans)
+    )
+    _, _, token_f1 = precision_recall_f1(int((predicted & actual).sum()), int(predicted.sum()), int(actual.sum()))
+    return {"span_precision": span_precision, "span_recall": span_recall, "span_f1": span_f1, "token_f1": token_f1}
+
+
+class EpochStatsCallback(TrainerCallback):
+    """Records the wall-clock time and training samples/sec of every epoch, evaluations excluded"""
+
+    def __init__(self, train_examples, log_path):
+        self.train_examples = train_examples
+        self.log_path = log_path
+        self.epochs = []
+        self.start = None
+        self.eval_seconds = 0.0
+        self.last_eval = {}
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.start = time.perf_counter()
+        self.eval_seconds = 0.0
+
+    def on_evaluate(self, args, state, control, metrics=None, **kwargs):
+        metrics = metrics or {}
+        self.eval_seconds += metrics.get("eval_runtime", 0.0)
+        self.last_eval = {key: value for key, value in metrics.items() if key in ("eval_loss", "eval_span_f1", "eval_token_f1")}
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        seconds = time.perf_counter() - self.start - self.eval_seconds
+        stats = {
+            "epoch": round(state.epoch, 2),
+            "global_step": state.global_step,
+            "seconds": round(seconds, 2),
+            "samples_per_second": round(self.train_examples / seconds, 2),
+        }
+        self.epochs.append(stats)
+        print(f"Epoch {stats['epoch']}: {stats['seconds']}s, {stats['samples_per_second']} samples/s")
+        with open(self.log_path, "a") as fw:
+            fw.write(json.dumps(stats) + "\n")
+
+
+def main(args):
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    bf16 = args.bf16 == "on" or (args.bf16 == "auto" and args.cpu and cpu_supports_bf16())
+    # workers only help when a core is left over for them next to the training threads
+    auto_workers = min(2, max(0, (os.cpu_count() or 1) - 1)) if args.cpu else 0
+    workers = args.dataloader_workers if args.dataloader_workers >= 0 else auto_workers
+
     tokenizer = AutoTokenizer.from_pretrained(
-        "microsoft/codebert-base",
+        args.model,
         add_prefix_space=True
     )
-    
-    train_dataset, eval_dataset = create_datasets(tokenizer)
-    
-    model = AutoModelForTokenClassification.from_pretrained("microsoft/codebert-base", num_labels=2)
-    
+
+    if args.train_corpus:
+        train_dataset = load_pretokenized_shards(tokenizer, args.train_corpus)
+    else:
+        train_dataset = load_pretokenized("train", tokenizer, injected_templates, synthetic_data)
+    if args.eval_corpus:
+        eval_dataset = load_pretokenized_shards(tokenizer, args.eval_corpus)
+    else:
+        eval_dataset = load_pretokenized("eval", tokenizer, Eval_injected_templates, Eval_synthetic_data)
+
+    model = AutoModelForTokenClassification.from_pretrained(args.model, num_labels=2)
+
+    # evaluating and saving on the same schedule, so the best checkpoint by span F1 can be restored
+    schedule = "steps" if args.eval_steps else "epoch"
     training_args = TrainingArguments(
-        output_dir="./results",
-        num_train_epochs=3,
-        per_device_train_batch_size=4,
-        eval_strategy="epoch",
-        logging_dir="./logs",
-        save_strategy="epoch",
+        output_dir=args.output_dir,
+        num_train_epochs=args.epochs,
+        per_device_train_batch_size=args.batch_size,
+        per_device_eval_batch_size=args.batch_size * 2,
+        gradient_accumulation_steps=args.gradient_accumulation_steps,
+        learning_rate=args.learning_rate,
+        eval_strategy=schedule,
+        save_strategy=schedule,
+        eval_steps=args.eval_steps or None,
+        save_steps=args.eval_steps or None,
         save_total_limit=2,
+        load_best_model_at_end=True,
+        metric_for_best_model="span_f1",
+        greater_is_better=True,
+        logging_steps=50,
+        use_cpu=args.cpu,
+        bf16=bf16,
         fp16=False,
+        torch_compile=args.compile,
+        dataloader_num_workers=workers,
+        dataloader_persistent_workers=workers > 0,
+        seed=args.seed,
+        report_to=[],
     )
-    
-    trainer = Trainer(
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    epoch_stats = EpochStatsCallback(len(train_dataset), os.path.join(args.output_dir, "epoch_stats.jsonl"))
+    callbacks = [epoch_stats]
+    if args.early_stopping_patience:
+        callbacks.append(EarlyStoppingCallback(early_stopping_patience=args.early_stopping_patience))
+
+    trainer = LengthGroupedTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=eval_dataset,
+        data_collator=DynamicPaddingCollator(tokenizer.pad_token_id),
+        compute_metrics=span_metrics,
+        preprocess_logits_for_metrics=predicted_classes,
+        callbacks=callbacks,
     )
-    
-    trainer.train()
+
+    start = time.perf_counter()
+    output = trainer.train()
+    summary = {
+        "model": args.model,
+        "cpu": args.cpu,
+        "bf16": bf16,
+        "compile": args.compile,
+        "threads": torch.get_num_threads(),
+        "dataloader_workers": workers,
+        "effective_batch_size": args.batch_size * args.gradient_accumulation_steps,
+        "epochs_run": round(trainer.state.epoch, 2),
+        "stopped_early": trainer.state.epoch < args.epochs,
+        "train_seconds": round(time.perf_counter() - start, 2),
+        "train_samples_per_second": output.metrics.get("train_samples_per_second"),
+        "best_span_f1": trainer.state.best_metric,
+        "best_checkpoint": trainer.state.best_model_checkpoint,
+        "last_eval": epoch_stats.last_eval,
+        "epochs": epoch_stats.epochs,
+    }
+    with open(os.path.join(args.output_dir, "training_summary.json"), "w") as fw:
+        json.dump(summary, fw, indent=2)
+    print(f"Best span F1 {summary['best_span_f1']} at {summary['best_checkpoint']}, "
+          f"{summary['epochs_run']} epochs in {summary['train_seconds']}s")
+    return summary
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="microsoft/codebert-base")
+    parser.add_argument("--output-dir", default="./results")
+    parser.add_argument("--train-corpus", default=None, help="glob of generate_corpus.py shards, the train split by default")
+    parser.add_argument("--eval-corpus", default=None, help="glob of generate_corpus.py shards, the eval split by default")
+    parser.add_argument("--epochs", type=float, default=3, help="upper bound, early stopping usually ends the run before")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--gradient-accumulation-steps", type=int, default=1)
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--cpu", action="store_true", help="train on the CPU with the settings above, even if a GPU is present")
+    parser.add_argument("--bf16", choices=("auto", "on", "off"), default="auto",
+                        help="bf16 autocast, auto enables it with --cpu on CPUs with native bf16")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the model")
+    parser.add_argument("--dataloader-workers", type=int, default=-1, help="-1 for up to 2 with --cpu and 0 otherwise")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 for torch's default")
+    parser.add_argument("--eval-steps", type=int, default=0, help="evaluate every this many steps, 0 for every epoch")
+    parser.add_argument("--early-stopping-patience", type=int, default=2, help="evaluations without a better span F1, 0 to train every epoch")
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,143 @@
+"""
+Offset-based redaction of scanned prompts
+
+Turns the sensitive spans of a scan into the masked text and the list of edits producing it, so the
+extension applies the edits instead of searching the page text for every span. Spans and regex
+matches are walked together in order of appearance, overlapping spans merged, then the masked text
+is built in one pass over the original text.
+
+Every span is masked by its category, the category of the regex match overlapping it or MODEL for
+spans only the model found, and is widened to that whole match so no part of a known secret format
+is left in place. Masks are configured as `CATEGORY=mask` pairs separated by commas, `*` setting
+the mask of categories without their own.
+
+Offsets are code points, Python's string indices. The extension slices text as JavaScript strings do,
+in UTF-16 code units, where every character outside the Basic Multilingual Plane (emoji, for one)
+takes two, so edits sent to it are converted with `utf16_offsets` first.
+
+Example Usage:
+    masks = parse_masks("API_KEY=[API-KEY],*=*****")
+    redacted, edits = redact(text, categorize_spans(parts, detector.scan(text)), masks)
+    # edits: [{'start': 8, 'end': 59, 'replacement': '[API-KEY]', 'category': 'API_KEY'}]
+"""
+
+import bisect, re
+
+# characters taking two UTF-16 code units (a surrogate pair)
+ASTRAL_PATTERN = re.compile("[\U00010000-\U0010FFFF]")
+
+DEFAULT_MASKS = {
+    "PRIVATE_KEY": "[PRIVATE-KEY]",
+    "DATABASE_CONNECTION": "[CONNECTION-STRING]",
+    "GITHUB_TOKEN": "[GITHUB-TOKEN]",
+    "API_KEY": "[API-KEY]",
+    "AWS_CREDENTIALS": "[AWS-KEY]",
+    "*": "*****",
+}
+
+
+def parse_masks(spec):
+    """
+    Parses mask overrides on top of `DEFAULT_MASKS`
+
+    Args:
+        spec (str): Comma-separated `CATEGORY=mask` pairs, `*` for the fallback mask, empty for the defaults
+    Returns:
+        dict: The mask of every configured category
+    """
+    masks = dict(DEFAULT_MASKS)
+    for entry in filter(None, (entry.strip() for entry in spec.split(","))):
+        category, separator, mask = entry.partition("=")
+        if not separator or not category.strip() or not mask:
+            raise ValueError(f"Invalid mask '{entry}', expected CATEGORY=mask")
+        masks[category.strip().upper() if category.strip() != "*" else "*"] = mask
+    return masks
+
+
+def categorize_spans(sensitive_parts, matches):
+    """
+    Tags every span with the category of the first regex match overlapping it and widens it to cover that match
+
+    Spans and matches are walked together in order of appearance, so no span looks at a match ending
+    before an earlier span started.
+
+    Args:
+        sensitive_parts (list): Spans with `start`/`end` offsets
+        matches (list): Regex matches of the same text in order of appearance, see `SensitivePatternDetector.scan`
+    Returns:
+        list: Copies of the spans with a `category`, MODEL for spans no match overlaps, in order of `start`
+    """
+    spans = []
+    index = 0
+    # already sorted when they come from a scan, which timsort checks in one pass
+    for part in sorted(sensitive_parts, key=lambda part: part["start"]):
+        while index < len(matches) and matches[index]["end"] <= part["start"]:
+            index += 1
+        if index == len(matches) or matches[index]["start"] >= part["end"]:
+            spans.append({**part, "category": "MODEL"})
+        else:
+            match = matches[index]
+            spans.append({**part, "start": min(part["start"], match["start"]), "end": max(part["end"], match["end"]), "category": match["category"]})
+    return spans
+
+
+def redact(text, spans, masks=DEFAULT_MASKS, min_confidence=0.0):
+    """
+    Masks the sensitive parts of one text
+
+    Overlapping or touching spans are merged into one edit, which takes the mask of the span starting
+    first.
+
+    Args:
+        text (str): The scanned text
+        spans (list): Spans with `start`/`end` offsets into `text`, their `confidence` and `category`,
+            in order of `start` as `categorize_spans` returns them
+        masks (dict): Mask per category, `*` for the others
+        min_confidence (float): Spans below this confidence are left in place
+    Returns:
+        tuple: The redacted text and the edits, dicts with `start`/`end` offsets into `text`, the
+            `replacement` and the `category`, in order of appearance
+    """
+    edits = []
+    for span in spans:
+        if span["confidence"] < min_confidence or span["end"] <= span["start"]:
+            continue
+        start, end, category = span["start"], span["end"], span["category"]
+        if edits and start <= edits[-1]["end"]:
+            edits[-1]["end"] = max(edits[-1]["end"], end)
+            continue
+        edits.append({"start": start, "end": end, "replacement": masks.get(category, masks["*"]), "category": category})
+
+    pieces = []
+    position = 0
+    for edit in edits:
+        pieces.append(text[position:edit["start"]])
+        pieces.append(edit["replacement"])
+        position = edit["end"]
+    pieces.append(text[position:])
+    return "".join(pieces), edits
+
+
+def utf16_length(text):
+    """Length of a text in UTF-16 code units, the `length` of the same JavaScript string"""
+    return len(text) if text.isascii() else len(text) + len(ASTRAL_PATTERN.findall(text))
+
+
+def utf16_offsets(text, items):
+    """
+    Converts `start`/`end` offsets from code points to UTF-16 code units, the indices of JavaScript strings
+
+    Args:
+        text (str): The text the offsets point into
+        items (list): Dicts with `start`/`end` code point offsets into `text`
+    Returns:
+        list: Copies of the items with `start`/`end` in UTF-16 code units
+    """
+    if text.isascii():
+        return [dict(item) for item in items]
+    # a code point offset moves by one code unit for every astral character before it
+    astral = [match.start() for match in ASTRAL_PATTERN.finditer(text)]
+    return [
+        {**item, "start": item["start"] + bisect.bisect_left(astral, item["start"]), "end": item["end"] + bisect.bisect_left(astral, item["end"])}
+        for item in items
+    ]
@@ -0,0 +1,131 @@
+"""
+Content-addressed cache of scan results
+
+Results are keyed by a SHA-256 of the exact prompt together with a namespace naming the model
+checkpoint, threshold and detector version, so changing any of them never serves stale results.
+The prompt is not normalized first: the model tokenizes whitespace too, so two prompts differing
+only in it can be scored differently.
+Entries hold only that hash and the (start, end, confidence) of each span. The matched text is
+sliced from the prompt again on a hit, so no secret ever sits in the cache.
+
+The cache is an LRU bounded by an estimate of its memory use, and entries expire after `ttl`
+seconds. Hit, miss, eviction and expiry counters are kept for `stats`.
+
+Example Usage:
+    cache = ScanResultCache(namespace="checkpoint-50|0.5|1")
+    parts = cache.get(prompt)
+    if parts is None:
+        parts = get_sensitive_parts(prompt)
+        cache.put(prompt, parts)
+"""
+
+import hashlib, time
+from collections import OrderedDict
+
+# rough per-entry and per-span footprint of the stored tuples, used to enforce `max_bytes`
+ENTRY_OVERHEAD_BYTES = 200
+SPAN_BYTES = 120
+
+
+class ScanResultCache:
+    def __init__(self, namespace, max_bytes=64 * 1024 * 1024, ttl=3600):
+        """
+        Args:
+            namespace (str): Identifies everything besides the prompt that affects a result (checkpoint, threshold, detector version)
+            max_bytes (int): Approximate memory budget, least recently used entries are evicted beyond it
+            ttl (float): Seconds an entry stays valid, 0 to never expire
+        """
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def key(self, prompt):
+        return hashlib.sha256(f"{self.namespace}\0{prompt}".encode("utf-8")).digest()
+
+    def get(self, prompt):
+        """
+        Looks up the scan result of a prompt
+
+        Args:
+            prompt (str): The prompt as received
+        Returns:
+            list: The sensitive parts with offsets into `prompt`, or None on a miss
+        """
+        key = self.key(prompt)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, spans = entry
+        if self.ttl and time.monotonic() - stored_at > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return [
+            {
+                "text": prompt[start:end],
+                "confidence": confidence,
+                "start": start,
+                "end": end
+            }
+            for start, end, confidence in spans
+        ]
+
+    def put(self, prompt, sensitive_parts):
+        """
+        Stores the offsets and confidences of a scan result, never the matched text
+
+        Args:
+            prompt (str): The prompt as received
+            sensitive_parts (list): The result of scanning `prompt`, with `start`/`end` offsets into it
+        """
+        key = self.key(prompt)
+        if key in self._entries:
+            self._remove(key)
+
+        spans = tuple((part["start"], part["end"], part["confidence"]) for part in sensitive_parts)
+        self._entries[key] = (time.monotonic(), spans)
+        self._size += self._entry_size(spans)
+
+        while self._size > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _entry_size(self, spans):
+        return ENTRY_OVERHEAD_BYTES + SPAN_BYTES * len(spans)
+
+    def _remove(self, key):
+        _, spans = self._entries.pop(key)
+        self._size -= self._entry_size(spans)
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss/eviction/expiry counters, hit rate and current size
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "approx_bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
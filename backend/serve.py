@@ -0,0 +1,178 @@
+"""
+Production launcher for the scan service
+
+`uvicorn --workers N` starts N independent processes that each load their own copy of the checkpoint,
+so resident memory grows linearly with the worker count. This launcher loads the weights once in a
+parent process and forks the workers after loading:
+
+- The parent binds the listening socket, loads the model bundle and freezes every object allocated so
+  far out of the garbage collector (`gc.freeze`), so collections in the workers don't write to the
+  shared pages.
+- Each forked worker serves the app with uvicorn on the inherited socket. Weights are only read at
+  inference time, so their pages stay shared copy-on-write between all workers (safetensors
+  checkpoints are memory-mapped from the file to begin with).
+- Every worker runs torch with its own share of the cores (`--threads-per-worker`, by default the
+  cores divided by the workers) so the workers don't oversubscribe them, optionally pinned to those
+  cores with `--cpu-affinity`.
+- No forward pass runs in the parent, so no intra-op thread pool exists when forking. Each worker
+  warms up on its own before reporting ready.
+- A worker that dies is forked again from the parent, which still holds the weights. SIGTERM and
+  SIGINT shut all workers down gracefully.
+
+The escalation model (SCAN_ESCALATION_MODEL_PATH) is preloaded the same way. The onnx backend is
+loaded in every worker, as an ONNX Runtime session doesn't survive a fork, and `--no-preload` does
+the same for any backend (the `uvicorn --workers` behaviour, for comparison).
+The result cache, the micro-batcher and /metrics are per worker.
+
+Model reloads (model_reload.py) are per worker too: /admin/reload only swaps the worker that answered
+it. To swap every worker, point SCAN_MODEL_PATH at a symlink and run with SCAN_RELOAD_WATCH=1, then
+move the symlink. Reloaded weights are private to each worker, and a restarted worker starts on the
+preloaded ones and reloads from there.
+
+Usage (from the `backend` directory):
+    python serve.py --workers 4 --port 8000
+
+For development with auto-reload, run `uvicorn app:app --reload` instead.
+"""
+
+import argparse, gc, os, signal, socket, time, traceback
+
+import torch
+
+
+def worker_cores(index, threads_per_worker):
+    """The cores a worker is pinned to, consecutive slices of the cores this process may use"""
+    cores = sorted(os.sched_getaffinity(0))
+    first = index * threads_per_worker
+    return {cores[(first + i) % len(cores)] for i in range(threads_per_worker)}
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected at least 1, got {number}")
+    return number
+
+
+def bind_socket(host, port, backlog=2048):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app_module, sock, index, args):
+    import uvicorn
+
+    # the parent's shutdown handler must not run in a worker, uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(args.threads_per_worker)
+    app_module.torch_threads = args.threads_per_worker
+    # the length buckets share the worker's cores, so together they run as many passes as fit them
+    if hasattr(app_module.batcher, "set_total_concurrency"):
+        app_module.batcher.set_total_concurrency(app_module.inference_slots(args.threads_per_worker, args.threads_per_worker))
+    if args.cpu_affinity:
+        os.sched_setaffinity(0, worker_cores(index, args.threads_per_worker))
+
+    config = uvicorn.Config(
+        app_module.app,
+        ssl_keyfile=app_module.ssl_keyfile,
+        ssl_certfile=app_module.ssl_certfile,
+        log_level=args.log_level,
+        access_log=args.access_log,
+        timeout_graceful_shutdown=args.graceful_timeout
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn_worker(app_module, sock, index, args):
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(app_module, sock, index, args)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            # never return into the parent's supervision loop
+            os._exit(status)
+    return pid
+
+
+def main(app_module=None, argv=None):
+    """
+    Loads the model once and supervises the forked workers until shut down
+
+    Args:
+        app_module (module): The imported `app` module, imported here if None
+        argv (list): Command line arguments, sys.argv by default
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("SCAN_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SCAN_PORT", "8000")))
+    parser.add_argument("--workers", type=positive_int, default=os.getenv("SCAN_WORKERS", "1"))
+    parser.add_argument("--threads-per-worker", type=int, default=int(os.getenv("SCAN_TORCH_THREADS", "0")),
+                        help="torch intra-op threads per worker, 0 for the cores divided by the workers")
+    parser.add_argument("--cpu-affinity", action="store_true", help="pin every worker to its own cores")
+    parser.add_argument("--no-preload", action="store_true", help="load the model in every worker instead of once before forking")
+    parser.add_argument("--log-level", default=os.getenv("SCAN_LOG_LEVEL", "info"))
+    parser.add_argument("--access-log", action="store_true")
+    parser.add_argument("--graceful-timeout", type=float, default=10.0, help="seconds a worker waits for open requests on shutdown")
+    parser.add_argument("--restart-delay", type=float, default=1.0, help="seconds before a dead worker is forked again")
+    args = parser.parse_args(argv)
+
+    if app_module is None:
+        import app as app_module
+
+    cores = len(os.sched_getaffinity(0))
+    args.threads_per_worker = args.threads_per_worker or max(1, cores // args.workers)
+    sock = bind_socket(args.host, args.port)
+
+    if not args.no_preload and app_module.MODEL_BACKEND != "onnx":
+        start = time.perf_counter()
+        bundle = app_module.load_bundle(app_module.MODEL_BACKEND, app_module.MODEL_PATH, calibration=app_module.startup_calibration())
+        app_module.preloaded_bundle = bundle
+        print(f"Loaded {bundle.version} in {time.perf_counter() - start:.1f}s, {app_module.rss_mb():.0f} MB resident")
+    if not args.no_preload and app_module.ESCALATION_MODEL_PATH and app_module.ESCALATION_BACKEND != "onnx":
+        app_module.preloaded_escalation_bundle = app_module.load_escalation_bundle()
+    gc.collect()
+    gc.freeze()
+
+    print(f"Forking {args.workers} workers with {args.threads_per_worker} torch threads each on {args.host}:{args.port}")
+    workers = {spawn_worker(app_module, sock, index, args): index for index in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"Worker {index} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting it")
+        time.sleep(args.restart_delay)
+        if not stopping:
+            workers[spawn_worker(app_module, sock, index, args)] = index
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
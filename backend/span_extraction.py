@@ -0,0 +1,69 @@
+"""
+Vectorized extraction of sensitive spans from token probabilities
+
+The whole batch's probability matrix is thresholded at once, runs of consecutive sensitive tokens are
+found from the edges of the flattened mask, and the max probability of each run is taken with a single
+`np.maximum.reduceat`. Runs are mapped to character offsets through the tokenizer's offsets mapping, so
+every span's text is a slice of the prompt exactly as the user typed it.
+
+Example Usage:
+    parts = extract_sensitive_parts(texts, probs, valid, offsets, threshold=0.5)
+"""
+
+import numpy as np
+
+
+def extract_sensitive_parts(texts, probs, valid, offsets, threshold=0.5):
+    """
+    Groups consecutive tokens above the threshold into sensitive spans for every prompt of a batch
+
+    Args:
+        texts (list): The scanned prompts
+        probs (numpy.ndarray): (batch, tokens) probability of the sensitive class
+        valid (numpy.ndarray): (batch, tokens) False for special and padding tokens, which never belong to a span
+        offsets (numpy.ndarray): (batch, tokens, 2) start/end character offsets of each token in its prompt
+        threshold (float): Minimum probability for a token to be considered sensitive
+    Returns:
+        list: For each prompt, a list of dicts with the sensitive `text`, its max `confidence` and its `start`/`end` character offsets
+    """
+    batch_size, num_tokens = probs.shape
+    results = [[] for _ in range(batch_size)]
+    if num_tokens == 0:
+        return results
+
+    # a False column on both sides of every row keeps runs from crossing rows
+    width = num_tokens + 2
+    flagged = np.zeros((batch_size, width), dtype=bool)
+    flagged[:, 1:-1] = (probs > threshold) & valid
+    flat = flagged.ravel()
+
+    edges = np.flatnonzero(flat[1:] != flat[:-1])
+    if edges.size == 0:
+        return results
+    # a rising edge at i means flat[i + 1] starts a run, a falling edge at j means flat[j] ends it
+    run_starts = edges[0::2] + 1
+    run_ends = edges[1::2]
+
+    padded_probs = np.zeros((batch_size, width), dtype=np.float64)
+    padded_probs[:, 1:-1] = probs
+    padded_ends = np.zeros((batch_size, width), dtype=np.int64)
+    padded_ends[:, 1:-1] = offsets[:, :, 1]
+
+    # reduceat over [start, end + 1) pairs, every second result is a run
+    bounds = np.empty(run_starts.size * 2, dtype=np.int64)
+    bounds[0::2] = run_starts
+    bounds[1::2] = run_ends + 1
+    confidences = np.maximum.reduceat(padded_probs.ravel(), bounds)[0::2]
+    end_chars = np.maximum.reduceat(padded_ends.ravel(), bounds)[0::2]
+
+    rows, columns = np.divmod(run_starts, width)
+    start_chars = offsets[rows, columns - 1, 0]
+
+    for row, start, end, confidence in zip(rows.tolist(), start_chars.tolist(), end_chars.tolist(), confidences.tolist()):
+        results[row].append({
+            "text": texts[row][start:end],
+            "confidence": confidence,
+            "start": start,
+            "end": end
+        })
+    return results
@@ -0,0 +1,162 @@
+"""
+Incremental scan sessions for streaming edits from the composer
+
+A session mirrors the composer as paragraphs keyed by client-chosen ids (one per <p> node). The
+client sends bursts of edits, and only the paragraphs they touch are scanned again. Each paragraph is
+split into content-defined blocks of lines: a block ends after a line whose hash hits a boundary,
+so an edit only changes the blocks around it and every other block is a cache hit. The work per
+burst follows the size of the edit, not the size of the composer. Lines longer than a block (a
+minified file or a one-line paste) are cut the same way after their whitespace-separated words,
+and only a run of over `max_chars` characters without whitespace is cut at a fixed length.
+
+Span offsets are reported relative to their paragraph, so they stay stable while other paragraphs change.
+
+Protocol (JSON messages over a WebSocket):
+    client: {"edits": [{"op": "set", "id": "p1", "text": "..."},
+                       {"op": "append", "id": "p1", "text": "..."},
+                       {"op": "delete", "id": "p2"}]}
+    server: {"type": "spans", "revision": 3,
+             "updates": [{"id": "p1", "matches": [{"text": ..., "confidence": ..., "start": ..., "end": ...}]}],
+             "deleted": ["p2"], "found_length": 1}
+"""
+
+import asyncio, re, zlib
+
+EDIT_OPS = ("set", "append", "delete")
+
+# a word with the whitespace after it
+WORD_PATTERN = re.compile(r'\S*\s+|\S+')
+
+
+class EditError(ValueError):
+    """Raised for a malformed edit or one that would exceed the session limits"""
+
+
+def split_units(text, max_chars):
+    """Lines of `text`, lines over `max_chars` characters split into words and words over it into slices"""
+    for line in text.splitlines(keepends=True):
+        if len(line) <= max_chars:
+            yield line
+            continue
+        for word in WORD_PATTERN.findall(line):
+            for start in range(0, len(word), max_chars):
+                yield word[start:start + max_chars]
+
+
+def split_blocks(text, min_chars=256, max_chars=2048, boundary_mask=3):
+    """
+    Splits text into blocks of whole lines at content-defined boundaries, long lines into blocks of whole words
+
+    Args:
+        text (str): The paragraph text
+        min_chars (int): A block only ends at a boundary line once it holds this many characters
+        max_chars (int): A block always ends once it holds this many characters
+        boundary_mask (int): A line (or word of a long line) is a boundary when its crc32 has none of these bits set (1 in 4 by default)
+    Returns:
+        list: (start offset, block text) pairs covering `text`
+    """
+    blocks = []
+    block_start = 0
+    position = 0
+    for unit in split_units(text, max_chars):
+        position += len(unit)
+        size = position - block_start
+        at_boundary = (zlib.crc32(unit.encode("utf-8")) & boundary_mask) == 0
+        if size >= max_chars or (size >= min_chars and at_boundary):
+            blocks.append((block_start, text[block_start:position]))
+            block_start = position
+    if block_start < len(text) or not blocks:
+        blocks.append((block_start, text[block_start:]))
+    return blocks
+
+
+class ScanSession:
+    def __init__(self, scan, max_chars=1_000_000):
+        """
+        Args:
+            scan (coroutine function): Scans one text and returns its sensitive parts with offsets into it
+            max_chars (int): Maximum total size of the paragraphs a session may hold
+        """
+        self.scan = scan
+        self.max_chars = max_chars
+        self.paragraphs = {}
+        self.matches = {}
+        self.revision = 0
+
+    def _apply(self, edits):
+        """Applies the edits to a copy of the paragraph texts, returning it with the ids that changed and the ids deleted"""
+        # editing a copy, so a rejected burst leaves the session untouched
+        paragraphs = dict(self.paragraphs)
+        changed, deleted = [], []
+        if not isinstance(edits, list):
+            raise EditError("Expected the edits as a list")
+        for edit in edits:
+            if not isinstance(edit, dict):
+                raise EditError("Expected every edit as an object")
+            op = edit.get("op")
+            paragraph_id = edit.get("id")
+            if op not in EDIT_OPS or not isinstance(paragraph_id, str):
+                raise EditError(f"Invalid edit, expected an op in {EDIT_OPS} and a string id")
+
+            if op == "delete":
+                if paragraphs.pop(paragraph_id, None) is not None:
+                    deleted.append(paragraph_id)
+                    if paragraph_id in changed:
+                        changed.remove(paragraph_id)
+                continue
+
+            text = edit.get("text")
+            if not isinstance(text, str):
+                raise EditError(f"Edit {op} of {paragraph_id} needs a text")
+            if op == "append":
+                text = paragraphs.get(paragraph_id, "") + text
+            paragraphs[paragraph_id] = text
+            if paragraph_id in deleted:
+                deleted.remove(paragraph_id)
+            if paragraph_id not in changed:
+                changed.append(paragraph_id)
+
+        if sum(len(text) for text in paragraphs.values()) > self.max_chars:
+            raise EditError(f"Session exceeds {self.max_chars} characters")
+        return paragraphs, changed, deleted
+
+    async def _scan_paragraph(self, text):
+        blocks = split_blocks(text)
+        results = await asyncio.gather(*(self.scan(block) for _, block in blocks))
+        matches = []
+        for (offset, _), parts in zip(blocks, results):
+            for part in parts:
+                matches.append({**part, "start": part["start"] + offset, "end": part["end"] + offset})
+        return matches
+
+    async def apply_edits(self, edits):
+        """
+        Applies a burst of edits and rescans the paragraphs they touched
+
+        The texts and the matches of the session only change once every scan of the burst succeeded, so
+        a burst that is rejected or whose scan fails leaves the session as it was.
+
+        Args:
+            edits (list): Edit dicts, see the module docstring
+        Returns:
+            dict: The span update to push to the client
+        """
+        paragraphs, changed, deleted = self._apply(edits)
+        results = await asyncio.gather(*(self._scan_paragraph(paragraphs[paragraph_id]) for paragraph_id in changed))
+
+        self.paragraphs = paragraphs
+        for paragraph_id in deleted:
+            self.matches.pop(paragraph_id, None)
+        updates = []
+        for paragraph_id, matches in zip(changed, results):
+            self.matches[paragraph_id] = matches
+            updates.append({"id": paragraph_id, "matches": matches})
+
+        self.revision += 1
+        return {
+            "type": "spans",
+            "revision": self.revision,
+            "updates": updates,
+            "deleted": deleted,
+            "found_length": sum(len(matches) for matches in self.matches.values())
+        }
@@ -0,0 +1,6 @@
+import os, sys
+
+# the backend modules import each other by name, as when run from the `backend` directory
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "model_training"))
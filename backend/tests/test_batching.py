@@ -0,0 +1,73 @@
+import asyncio, threading, time
+
+from batching import DispatchSlots, LengthRoutedBatcher, MicroBatcher, parse_length_buckets
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_freed_slot_goes_to_lowest_priority_value():
+    slots = DispatchSlots(1)
+    slots.acquire()
+    order = []
+
+    def take(priority):
+        with slots.slot(priority):
+            order.append(priority)
+
+    threads = []
+    for priority in (2, 1, 0, 2):
+        threads.append(threading.Thread(target=take, args=(priority,)))
+        threads[-1].start()
+        wait_until(lambda: slots.waiting == len(threads))
+    slots.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 2]
+
+
+def test_short_bucket_overtakes_long_batch_waiting_for_a_slot():
+    started = []
+    release_first = threading.Event()
+
+    def process_batch(items):
+        started.append(items)
+        if items == ["x" * 100]:
+            release_first.wait(5)
+        return [len(item) for item in items]
+
+    # no deferral, so only the slot order keeps the short prompt ahead
+    batcher = LengthRoutedBatcher(process_batch, parse_length_buckets("10:4:1,*:4:2"), estimate_tokens=len,
+                                  max_wait_ms=0, max_defer_ms=0, max_total_concurrency=1)
+    slots = batcher.batchers[0].dispatch_slots
+
+    async def run():
+        first = asyncio.create_task(batcher.submit("x" * 100))
+        await asyncio.to_thread(wait_until, lambda: started)
+        second = asyncio.create_task(batcher.submit("y" * 100))
+        await asyncio.to_thread(wait_until, lambda: slots.waiting == 1)
+        short = asyncio.create_task(batcher.submit("short"))
+        await asyncio.to_thread(wait_until, lambda: slots.waiting == 2)
+        release_first.set()
+        return await asyncio.gather(first, second, short)
+
+    assert asyncio.run(run()) == [100, 100, 5]
+    assert started == [["x" * 100], ["short"], ["y" * 100]]
+
+
+def test_failing_observe_batch_keeps_the_worker_running():
+    def observe_batch(size, waits):
+        raise RuntimeError("metrics backend down")
+
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_wait_ms=0, observe_batch=observe_batch)
+
+    async def run():
+        first = await batcher.submit(1)
+        second = await asyncio.wait_for(batcher.submit(2), 5)
+        return first, second
+
+    assert asyncio.run(run()) == (2, 4)
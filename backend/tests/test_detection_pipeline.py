@@ -0,0 +1,30 @@
+from detection_pipeline import DetectionPipeline
+from pattern_detector import SensitivePatternDetector
+
+
+def test_paranoid_without_stats_runs_no_stage():
+    observed = []
+    pipeline = DetectionPipeline(SensitivePatternDetector(), mode="paranoid", collect_stats=False,
+                                 observe_stage=lambda name, seconds: observed.append(name))
+    decision = pipeline.evaluate("password: hunter2")
+    assert decision == {"run_model": True, "stage": None, "evaluated": False}
+    assert observed == []
+    pipeline.record_model_result(decision, [{"start": 10, "end": 17}])
+    stats = pipeline.stats()
+    assert stats["model_runs"] == 1 and stats["model_hits"] == 1
+    # nothing was evaluated, so nothing was missed
+    assert stats["gate_misses"] == 0
+
+
+def test_paranoid_with_stats_counts_gate_misses():
+    pipeline = DetectionPipeline(SensitivePatternDetector(), mode="paranoid", collect_stats=True)
+    decision = pipeline.evaluate("what a lovely day")
+    assert decision["run_model"] and decision["evaluated"] and decision["stage"] is None
+    pipeline.record_model_result(decision, [{"start": 0, "end": 4}])
+    assert pipeline.stats()["gate_misses"] == 1
+
+
+def test_cascade_flags_secret_assignment():
+    pipeline = DetectionPipeline(SensitivePatternDetector(), mode="cascade")
+    assert pipeline.evaluate("DB_PASSWORD=hunter2")["stage"] == "keyword"
+    assert not pipeline.evaluate("how do I sort a list?")["run_model"]
@@ -0,0 +1,49 @@
+import random
+
+from redaction import categorize_spans, redact
+
+
+def categorize_spans_reference(sensitive_parts, matches):
+    """The per-span search categorize_spans replaced"""
+    spans = []
+    for part in sensitive_parts:
+        match = next((match for match in matches if match["start"] < part["end"] and part["start"] < match["end"]), None)
+        if match is None:
+            spans.append({**part, "category": "MODEL"})
+        else:
+            spans.append({**part, "start": min(part["start"], match["start"]), "end": max(part["end"], match["end"]), "category": match["category"]})
+    return spans
+
+
+def random_intervals(rng, length, count, overlapping):
+    intervals = []
+    position = 0
+    for _ in range(count):
+        start = rng.randrange(0, length) if overlapping else position + rng.randrange(0, 5)
+        end = start + rng.randrange(1, 8)
+        intervals.append((start, end))
+        position = end
+    return sorted(intervals)
+
+
+def test_categorize_spans_matches_reference():
+    rng = random.Random(0)
+    for _ in range(500):
+        matches = [
+            {"start": start, "end": end, "category": rng.choice(["API_KEY", "GITHUB_TOKEN"]), "text": ""}
+            for start, end in random_intervals(rng, 60, rng.randrange(0, 6), overlapping=False)
+        ]
+        parts = [
+            {"start": start, "end": end, "confidence": 0.9, "text": ""}
+            for start, end in random_intervals(rng, 60, rng.randrange(0, 8), overlapping=True)
+        ]
+        spans = categorize_spans(parts, matches)
+        assert spans == categorize_spans_reference(parts, matches)
+        text = "x" * 80
+        assert redact(text, spans) == redact(text, sorted(spans, key=lambda span: (span["start"], span["end"], span["category"])))
+
+
+def test_unsorted_parts_are_ordered():
+    matches = [{"start": 0, "end": 4, "category": "API_KEY", "text": "abcd"}]
+    parts = [{"start": 10, "end": 12, "confidence": 0.5}, {"start": 2, "end": 3, "confidence": 0.5}]
+    assert [(span["start"], span["category"]) for span in categorize_spans(parts, matches)] == [(0, "API_KEY"), (10, "MODEL")]
@@ -0,0 +1,16 @@
+from result_cache import ScanResultCache
+
+
+def test_whitespace_variants_do_not_share_an_entry():
+    cache = ScanResultCache(namespace="test")
+    prompt = "key=hunter2"
+    cache.put(prompt, [{"text": "hunter2", "confidence": 0.9, "start": 4, "end": 11}])
+    assert cache.get("  " + prompt) is None
+    assert cache.get(prompt + "\n") is None
+    assert cache.get(prompt) == [{"text": "hunter2", "confidence": 0.9, "start": 4, "end": 11}]
+
+
+def test_entries_hold_no_text():
+    cache = ScanResultCache(namespace="test")
+    cache.put("key=hunter2", [{"text": "hunter2", "confidence": 0.9, "start": 4, "end": 11}])
+    assert "hunter2" not in repr(list(cache._entries.items()))
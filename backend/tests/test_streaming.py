@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from streaming import EditError, ScanSession, split_blocks
+
+SECRET = "ghp_" + "a" * 36
+
+
+async def find_secret(text):
+    start = text.find(SECRET)
+    if start < 0:
+        return []
+    return [{"text": SECRET, "confidence": 0.9, "start": start, "end": start + len(SECRET)}]
+
+
+def test_split_blocks_covers_text():
+    text = "".join(f"line {i} {'x' * (i % 7)}\n" for i in range(500)) + "y" * 5000
+    blocks = split_blocks(text)
+    assert "".join(block for _, block in blocks) == text
+    assert all(text[offset:offset + len(block)] == block for offset, block in blocks)
+    assert max(len(block) for _, block in blocks) <= 2048
+
+
+def test_offsets_are_relative_to_the_paragraph():
+    session = ScanSession(find_secret)
+    update = asyncio.run(session.apply_edits([
+        {"op": "set", "id": "p1", "text": "first paragraph"},
+        {"op": "set", "id": "p2", "text": f"token {SECRET} end"},
+    ]))
+    matches = {item["id"]: item["matches"] for item in update["updates"]}
+    assert matches["p1"] == []
+    assert [(match["start"], match["end"]) for match in matches["p2"]] == [(6, 6 + len(SECRET))]
+    assert update["found_length"] == 1
+
+
+def test_rejected_edit_leaves_session_unchanged():
+    session = ScanSession(find_secret, max_chars=100)
+    asyncio.run(session.apply_edits([{"op": "set", "id": "p1", "text": SECRET}]))
+    with pytest.raises(EditError):
+        asyncio.run(session.apply_edits([{"op": "append", "id": "p1", "text": "x" * 100}]))
+    assert session.paragraphs == {"p1": SECRET}
+    assert session.revision == 1
+
+
+def test_failed_scan_leaves_session_unchanged():
+    calls = []
+
+    async def scan(text):
+        calls.append(text)
+        # the second paragraph of the burst fails, as when the scan queue is full
+        if "boom" in text:
+            raise RuntimeError("scan queue is full")
+        return await find_secret(text)
+
+    session = ScanSession(scan)
+    first = asyncio.run(session.apply_edits([{"op": "set", "id": "p1", "text": f"key {SECRET}"}]))
+    assert first["found_length"] == 1
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(session.apply_edits([
+            {"op": "set", "id": "p1", "text": f"prefix moves the key {SECRET}"},
+            {"op": "set", "id": "p2", "text": "boom"},
+            {"op": "delete", "id": "p0"},
+        ]))
+    assert len(calls) >= 2
+    assert session.paragraphs == {"p1": f"key {SECRET}"}
+    assert session.matches["p1"][0]["start"] == 4
+    assert "p2" not in session.matches
+    assert session.revision == 1
+
+    # the next burst builds on the state before the failed one
+    update = asyncio.run(session.apply_edits([{"op": "append", "id": "p1", "text": " done"}]))
+    assert update["revision"] == 2
+    assert session.paragraphs["p1"] == f"key {SECRET} done"
+    assert update["updates"][0]["matches"][0]["start"] == 4
+    assert update["found_length"] == 1
@@ -0,0 +1,213 @@
+"""
+Request and response encodings of /scan
+
+Large code pastes make large request bodies, so /scan accepts bodies compressed with gzip, deflate
+or zstd (`Content-Encoding`, every member of a multi-member gzip body and every frame of a zstd body) and encoded as JSON or msgpack (`Content-Type`). Responses are encoded
+as msgpack for clients asking for it in `Accept`, as JSON otherwise, with orjson when it is
+installed. Decompressed bodies are capped at `max_bytes`, decompression stops there, so a small
+compressed body can't expand into gigabytes in memory.
+
+Responses are not compressed. A response echoing secrets next to text an attacker may control is
+what compression side channels over TLS (BREACH) recover secrets from. Clients that want a small
+response request offsets only (`/scan?mode=offsets`), which carries no text at all.
+
+msgpack and zstd are optional, install them with `pip install msgpack zstandard`.
+
+Example Usage:
+    payload = decode_request(body, headers.get("content-encoding"), headers.get("content-type"))
+    media_type = negotiate(headers.get("accept"))
+    body = encode(response, media_type)
+"""
+
+import importlib.util, io, json, zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+MSGPACK_INSTALLED = importlib.util.find_spec("msgpack") is not None
+
+# zlib window bits of the gzip and zlib containers
+GZIP_WBITS = 31
+DEFLATE_WBITS = 15
+
+
+class WireFormatError(ValueError):
+    def __init__(self, message, status_code=400):
+        """
+        Args:
+            message (str): What is wrong with the body, never its content
+            status_code (int): 400 for a malformed body, 413 for too large, 415 for an unsupported encoding
+        """
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def import_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise WireFormatError("msgpack bodies require msgpack, install it with `pip install msgpack`", 415)
+    return msgpack
+
+
+def inflate(body, wbits, max_bytes, multi_member=False):
+    """
+    Inflates a zlib or gzip body, every member of a multi-member gzip body when `multi_member` is set
+
+    Raises:
+        WireFormatError: For an invalid or truncated body, trailing data after the last member, or output over `max_bytes`
+    """
+    data = b""
+    while True:
+        decompressor = zlib.decompressobj(wbits)
+        try:
+            data += decompressor.decompress(body, max_bytes + 1 - len(data))
+        except zlib.error as e:
+            raise WireFormatError(f"invalid compressed body: {e}")
+        if len(data) > max_bytes:
+            raise WireFormatError(f"decompressed body over {max_bytes} bytes", 413)
+        if not decompressor.eof:
+            raise WireFormatError("truncated compressed body")
+        body = decompressor.unused_data
+        if not body:
+            return data
+        # a gzip body may hold several members (RFC 1952), anything else after the stream is an error
+        if not multi_member:
+            raise WireFormatError("trailing data after the compressed body")
+
+
+def unzstd(body, max_bytes):
+    """
+    Decompresses every frame of a zstd body
+
+    Raises:
+        WireFormatError: For an invalid or truncated body, or output over `max_bytes`
+    """
+    try:
+        import zstandard
+    except ImportError:
+        raise WireFormatError("zstd bodies require zstandard, install it with `pip install zstandard`", 415)
+    data = b""
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body), read_across_frames=True) as reader:
+            while len(data) <= max_bytes:
+                piece = reader.read(max_bytes + 1 - len(data))
+                if not piece:
+                    break
+                data += piece
+        if len(data) > max_bytes:
+            raise WireFormatError(f"decompressed body over {max_bytes} bytes", 413)
+        # the stream reader stops quietly at a cut frame, the output being bounded now, check every frame ends
+        while body:
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            decompressor.decompress(body)
+            if not decompressor.eof:
+                raise WireFormatError("truncated compressed body")
+            body = decompressor.unused_data
+    except zstandard.ZstdError as e:
+        raise WireFormatError(f"invalid compressed body: {e}")
+    return data
+
+
+def decompress(body, content_encoding, max_bytes):
+    """
+    Undoes the `Content-Encoding` of a request body
+
+    Args:
+        body (bytes): The body as received
+        content_encoding (str): The header value, codings applied in the order listed, None for none
+        max_bytes (int): Largest body accepted after every step
+    Returns:
+        bytes: The decompressed body
+    Raises:
+        WireFormatError: For an unsupported coding, an invalid or truncated body, or one over `max_bytes`
+    """
+    if len(body) > max_bytes:
+        raise WireFormatError(f"body over {max_bytes} bytes", 413)
+    codings = [coding.strip().lower() for coding in (content_encoding or "").split(",") if coding.strip()]
+    for coding in reversed(codings):
+        if coding in ("gzip", "x-gzip"):
+            body = inflate(body, GZIP_WBITS, max_bytes, multi_member=True)
+        elif coding == "deflate":
+            body = inflate(body, DEFLATE_WBITS, max_bytes)
+        elif coding == "zstd":
+            body = unzstd(body, max_bytes)
+        elif coding != "identity":
+            raise WireFormatError(f"unsupported content encoding '{coding}', expected gzip, deflate or zstd", 415)
+    return body
+
+
+def media_type_of(content_type):
+    return (content_type or JSON).split(";")[0].strip().lower()
+
+
+def loads(body, content_type=None):
+    """
+    Parses a request body by its `Content-Type`, JSON when it has none
+
+    Raises:
+        WireFormatError: For an unsupported content type or a body that doesn't parse
+    """
+    media_type = media_type_of(content_type)
+    if media_type in MSGPACK_TYPES:
+        msgpack = import_msgpack()
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise WireFormatError(f"invalid msgpack body: {type(e).__name__}")
+    if media_type != JSON and not media_type.endswith("+json"):
+        raise WireFormatError(f"unsupported content type '{media_type}', expected {JSON} or {MSGPACK}", 415)
+    try:
+        return orjson.loads(body) if orjson is not None else json.loads(body)
+    except ValueError as e:
+        # the position only, the message of orjson and json quotes no content
+        raise WireFormatError(f"invalid JSON body: {e}")
+
+
+def decode_request(body, content_encoding=None, content_type=None, max_bytes=16 * 1024 * 1024):
+    """
+    Decompresses and parses a request body
+
+    Args:
+        body (bytes): The body as received
+        content_encoding (str): The `Content-Encoding` header
+        content_type (str): The `Content-Type` header
+        max_bytes (int): Largest body accepted, compressed or not
+    Returns:
+        The parsed body
+    """
+    return loads(decompress(body, content_encoding, max_bytes), content_type)
+
+
+def negotiate(accept):
+    """The response media type for an `Accept` header, msgpack if it names msgpack and msgpack is installed, JSON otherwise"""
+    if not accept or not MSGPACK_INSTALLED:
+        return JSON
+    if any(media_type_of(entry) in MSGPACK_TYPES for entry in accept.split(",")):
+        return MSGPACK
+    return JSON
+
+
+def dumps(content):
+    """Compact UTF-8 JSON, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode(content, media_type=JSON):
+    """
+    Args:
+        content: The response content
+        media_type (str): JSON or MSGPACK, see `negotiate`
+    Returns:
+        bytes: The encoded response body
+    """
+    if media_type == MSGPACK:
+        return import_msgpack().packb(content, use_bin_type=True)
+    return dumps(content)
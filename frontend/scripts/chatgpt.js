@@ -1,3 +1,28 @@
+//texts the backend already redacted, so masked paragraphs are not sent for scanning again
+const redactedTexts = new Set();
+
+//request bodies from this size on are gzipped, large code pastes compress to a tenth
+const COMPRESS_MIN_BYTES = 16 * 1024;
+
+/**
+ * Builds the fetch options of a /scan request, gzipping large bodies where the browser supports CompressionStream
+ * @param {Object} payload - The request body
+ * @returns {Promise<Object>} The method, headers and body to pass to fetch
+ */
+async function scanRequestOptions(payload) {
+  const body = new TextEncoder().encode(JSON.stringify(payload));
+  const headers = { "Content-Type": "application/json" };
+  if (body.length < COMPRESS_MIN_BYTES || typeof CompressionStream === "undefined") {
+    return { method: "POST", headers, body };
+  }
+  const compressed = new Blob([body]).stream().pipeThrough(new CompressionStream("gzip"));
+  return {
+    method: "POST",
+    headers: { ...headers, "Content-Encoding": "gzip" },
+    body: await new Response(compressed).arrayBuffer(),
+  };
+}
+
 /**
  * Initializes the script to start mutation observer on the prompt textarea and handle sensitive data
  * @returns {void}
@@ -24,7 +49,7 @@ const loadPatterns = async () => {
                 if (
                   node.nodeName === "P" &&
                   !processedNodes.has(node) &&
-                  !node.textContent.includes("*****")
+                  !redactedTexts.has(node.textContent)
                 ) {
                   sensitiveNodes.push({ node, text: node.textContent });
                 }
@@ -55,18 +80,14 @@ const handleSensitiveData = async (inputContainer,
   processedNodes) => {
   const composerContainer = document.getElementById("composer-background");
   try {
-    console.log("SENSITIVE NODES ----", sensitiveNodes);
-
-    const results = await sendPromptForScanning(
-      sensitiveNodes.map(({ text }) => text).join(" ")
-    );
+    const paragraphs = sensitiveNodes.map(({ text }) => text);
+    const results = await sendPromptForScanning(paragraphs.join(" "), paragraphs);
 
     if (results) {
-      console.log("RESULTS ----", results.matches);
       addCleanseButton(
         inputContainer,
         sensitiveNodes,
-        results.matches,
+        results.paragraphs,
         composerContainer,
         processedNodes,
         () => {
@@ -87,19 +108,18 @@ const handleSensitiveData = async (inputContainer,
 };
 
 /**
- * Sends the prompt to the backend for scanning for sensitive data
+ * Sends the prompt to the backend for scanning for sensitive data, in redact mode so the result carries the masking edits
  * @param {string} prompt - The text to scan for sensitive content
- * @returns {Promise<Object|undefined>} Result object containing found_length if sensitive data found, undefined on error or if nothing found
+ * @param {string[]} paragraphs - The p tag texts joined into prompt, lets the backend cache each paragraph
+ * @returns {Promise<Object|undefined>} Result object containing found_length and the edits of each paragraph if sensitive data found, undefined on error or if nothing found
  */
-async function sendPromptForScanning(prompt) {
+async function sendPromptForScanning(prompt, paragraphs) {
   try {
-    const response = await fetch("https://127.0.0.1:8000/scan", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({ prompt }),
-    });
+    //offsets only, the response carries the masking edits but never the secrets themselves
+    const response = await fetch(
+      "https://127.0.0.1:8000/scan?mode=redact,offsets",
+      await scanRequestOptions({ prompt, paragraphs })
+    );
     const result = await response.json();
     if (result.found_length > 0) {
       const composerContainer = document.getElementById("composer-background");
@@ -131,11 +151,27 @@ function showWarning() {
   warning.textContent = `⚠️ Found sensitive data!`;
 }
 
+/**
+ * Applies the backend's redaction edits to a text in one pass
+ * @param {string} text - The paragraph text exactly as it was scanned
+ * @param {Object[]} edits - Non-overlapping {start, end, replacement} edits in order of appearance
+ * @returns {string} The redacted text
+ */
+function applyEdits(text, edits) {
+  let redacted = "";
+  let position = 0;
+  edits.forEach(({ start, end, replacement }) => {
+    redacted += text.slice(position, start) + replacement;
+    position = end;
+  });
+  return redacted + text.slice(position);
+}
+
 /**
  * Adds a button to cleanse sensitive data when detected
  * @param {inputContainer} - The prompt textarea of AI chat applications
  * @param {sensitiveNodes} - The list of nodes containing all P tags with prompt text
- * @param {patterns} - Detected sensitive patterns
+ * @param {redactions} - The edits of every paragraph with something to mask, by its index in sensitiveNodes
  * @param {composerContainer} - The parent container of inputContainer to highlight
  * @param {processedNodes} - The nodes that have been processed for sensitive data
  * @param {resetState}  - The callback to mark nodes as processed for mutation observer
@@ -145,7 +181,7 @@ function showWarning() {
 function addCleanseButton(
   inputContainer,
   sensitiveNodes,
-  patterns,
+  redactions,
   composerContainer,
   processedNodes,
   resetState
@@ -170,15 +206,15 @@ function addCleanseButton(
       e.stopPropagation();
 
 
-      sensitiveNodes.forEach(({ node, text }) => {
-        let replacedText = text;
-        patterns.forEach((pattern) => {
-          detected = pattern.text;
-          confidence = pattern.confidence;
-          replacedText = (confidence > 0.9) ? replacedText.replace(detected, "*****") : replacedText;
-        });
-        node.textContent = replacedText;
-        processedNodes.add(node); 
+      redactions.forEach(({ index, edits }) => {
+        const { node, text } = sensitiveNodes[index];
+        //the offsets only hold for the text that was scanned, a paragraph edited since is left as typed
+        if (node.textContent === text) {
+          const redacted = applyEdits(text, edits);
+          redactedTexts.add(redacted);
+          node.textContent = redacted;
+        }
+        processedNodes.add(node);
       });
 
      resetState();
@@ -33,10 +33,10 @@ const loadDeepseek = async () => {
       );
   
       if (results) {
-        console.log("RESULTS ----", results.matches);
         addCleanseButtonDeepseek(
           inputContainer,
-          results.matches,
+          prompt,
+          results.redacted_prompt,
           composerContainer,      
         );
       }
@@ -51,15 +51,12 @@ const loadDeepseek = async () => {
 //    * @returns {Promise<Object|undefined>} Result object containing found_length if sensitive data found, undefined on error or if nothing found
 //    */
   async function sendPromptForScanningDeepseek(prompt) {
-    console.log("Prompt to scan:", prompt);
     try {
-      const response = await fetch("https://127.0.0.1:8000/scan", {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({ prompt }),
-      });
+      //scanRequestOptions is defined in chatgpt.js, loaded first into the same content script scope
+      const response = await fetch(
+        "https://127.0.0.1:8000/scan?mode=redact,offsets",
+        await scanRequestOptions({ prompt })
+      );
       const result = await response.json();
       if (result.found_length > 0) {
         const composerContainer = document.querySelector(".cefa5c26");
@@ -76,8 +73,8 @@ const loadDeepseek = async () => {
 //   /**
 //    * Adds a button to cleanse sensitive data when detected
 //    * @param {inputContainer} - The prompt textarea of AI chat applications
-//    * @param {sensitiveNodes} - The list of nodes containing all P tags with prompt text
-//    * @param {patterns} - Detected sensitive patterns
+//    * @param {prompt} - The prompt text that was scanned
+//    * @param {redactedPrompt} - The prompt with the sensitive data masked by the backend
 //    * @param {composerContainer} - The parent container of inputContainer to highlight
 //    * @param {processedNodes} - The nodes that have been processed for sensitive data
 //    * @param {resetState}  - The callback to mark nodes as processed for mutation observer
@@ -86,7 +83,8 @@ const loadDeepseek = async () => {
 //    */
   function addCleanseButtonDeepseek(
     inputContainer,
-    patterns,
+    prompt,
+    redactedPrompt,
     composerContainer,
   ) {
     let button = document.querySelector(".cleanse-button");
@@ -110,19 +108,10 @@ const loadDeepseek = async () => {
         
         const text = document.querySelector(".b13855df")?.textContent.trim();
         const container = document.getElementById("chat-input");
-        let replacedText = '';
-
-        replacedText = text.split("\n")
-        .map(line => {
-            let modifiedLine = line;
-            patterns.forEach(pattern => {
-                
-                modifiedLine = (pattern.confidence > 0.9) ? modifiedLine.replace(pattern.text, "*****") : modifiedLine;
-            });
-            return modifiedLine;
-        })
-        .join("\n");
-         container.value = replacedText;
+        //the redaction only holds for the prompt that was scanned, an edited prompt is left for the next paste
+        if (text === prompt) {
+          container.value = redactedPrompt;
+        }
           
   
         document.querySelector(".sensitive-warning")?.remove();